@@ -0,0 +1,159 @@
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+from PIL import Image
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import mian
+except Exception as e:
+    print(f"导入mian.py失败: {e}")
+    sys.exit(1)
+
+
+POSITION_NAMES = ["左上", "右上", "左下", "右下", "居中", "底部居中"]
+
+
+def bench(fn, repeat):
+    """运行 fn repeat 次，返回单次平均耗时（毫秒）"""
+    fn()  # 预热：水印缓存、numpy首次调用等
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def make_watermark():
+    """生成一个带半透明边缘的测试水印"""
+    watermark = Image.new("RGBA", (400, 200), (255, 255, 255, 0))
+    for x in range(400):
+        for y in range(20, 180):
+            watermark.putpixel((x, y), (255, 255, 255, 255 if 40 < x < 360 else 128))
+    return watermark
+
+
+def legacy_add_watermark(image, watermark, x, y):
+    """优化前的做法：整张图片转换为RGBA，粘贴水印后再转换回RGB"""
+    image = image.convert("RGBA")
+    image.paste(watermark, (x, y), watermark)
+    return image.convert("RGB")
+
+
+def benchmark_watermark(width, height, watermark_size, repeat):
+    """比较三种水印合成方式在六个位置上的耗时"""
+    print(f"\n===== 水印合成：{width}x{height} 图片，水印大小 {watermark_size}% =====")
+    tile = Image.effect_noise((width, height), 64).convert("RGB")
+    cache = mian.WatermarkCache()
+
+    modes = ["pillow"] + (["numpy"] if mian.np is not None else [])
+    if mian.np is None:
+        print("未安装numpy，跳过numpy混合方式")
+    print(f"{'位置':<8}{'整张转换(ms)':>14}" + "".join(f"{mode + '(ms)':>14}{'加速':>8}" for mode in modes))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        watermark_path = os.path.join(tmp, "benchmark_watermark.png")
+        make_watermark().save(watermark_path)
+        for position, name in enumerate(POSITION_NAMES):
+            watermark, x, y = mian.watermark_placement(width, height, watermark_path, watermark_size,
+                                                       position, 70, cache)
+            legacy_ms = bench(lambda: legacy_add_watermark(tile, watermark, x, y), repeat)
+            row = f"{name:<8}{legacy_ms:>14.2f}"
+            for mode in modes:
+                # 区域混合是原地修改，在同一张副本上重复混合，耗时与像素内容无关
+                target = tile.copy()
+                blend_ms = bench(lambda: mian.blend_watermark(target, watermark, x, y, mode=mode, cache=cache),
+                                 repeat)
+                row += f"{blend_ms:>14.2f}{legacy_ms / max(blend_ms, 1e-3):>7.1f}x"
+            print(row)
+
+
+def benchmark_png_profiles(width, height, repeat):
+    """比较拆分输出的各个PNG保存方式的耗时和文件大小"""
+    print(f"\n===== 拆分PNG保存：{width}x{height} 图片 =====")
+    # 平滑渐变加少量噪声，压缩率接近真实照片
+    tile = Image.merge("RGB", [Image.linear_gradient("L").resize((width, height)),
+                               Image.effect_noise((width, height), 20),
+                               Image.radial_gradient("L").resize((width, height))])
+    print(f"{'方式':<10}{'耗时(ms)':>12}{'大小(KB)':>12}")
+    for profile, options in mian.SPLIT_PNG_PROFILES.items():
+        buffer = io.BytesIO()
+
+        def save():
+            buffer.seek(0)
+            buffer.truncate()
+            tile.save(buffer, "PNG", **options)
+
+        elapsed = bench(save, repeat)
+        print(f"{profile:<10}{elapsed:>12.1f}{len(buffer.getvalue()) / 1024:>12.0f}")
+
+
+def benchmark_canvas_pool(width, height, repeat, batches=8):
+    """比较每批新建画布与从画布池复用画布的拼接耗时（2x2网格，尺寸相同的批次）"""
+    print(f"\n===== 拼接画布：{width}x{height} 画布，连续 {batches} 批 =====")
+    tile = Image.effect_noise((width // 2, height // 2), 64).convert("RGB")
+    batch = {"rows": 2, "cols": 2, "filenames": [f"{i}.jpg" for i in range(4)], "exif": [{}] * 4}
+
+    def run(pool):
+        for _ in range(batches):
+            merged, _, _ = mian.compose_batch(batch, [tile] * 4, 0, max(width, height), pool=pool)
+            if pool is not None:
+                pool.release(merged)
+
+    fresh_ms = bench(lambda: run(None), repeat)
+    pool = mian.CanvasPool()
+    pooled_ms = bench(lambda: run(pool), repeat)
+    print(f"{'每批新建(ms)':>14}{'画布池(ms)':>14}{'加速':>8}{'复用次数':>10}")
+    print(f"{fresh_ms:>14.1f}{pooled_ms:>14.1f}{fresh_ms / max(pooled_ms, 1e-3):>7.1f}x{pool.reused:>10}")
+
+
+def benchmark_header_cache(file_count):
+    """比较不使用缓存与文件头缓存命中时按横竖屏分类的耗时"""
+    print(f"\n===== 文件头分类：{file_count} 张带EXIF的JPEG =====")
+    with tempfile.TemporaryDirectory() as tmp:
+        src_dir = os.path.join(tmp, "src")
+        os.makedirs(src_dir)
+        exif = Image.Exif()
+        exif[271] = "Benchmark"
+        exif[mian.EXIF_ORIENTATION_TAG] = 6
+        image = Image.new("RGB", (64, 48))
+        for i in range(file_count):
+            image.save(os.path.join(src_dir, f"{i:06d}.jpg"), exif=exif.tobytes())
+
+        def categorize(header_cache):
+            start = time.perf_counter()
+            mian.categorize_images_by_orientation(src_dir, header_cache=header_cache)
+            return (time.perf_counter() - start) * 1000
+
+        uncached_ms = categorize(None)
+        cache = mian.HeaderCache(os.path.join(tmp, mian.HEADER_CACHE_FILE))
+        try:
+            cold_ms = categorize(cache)
+            warm_ms = categorize(cache)
+        finally:
+            cache.close()
+    print(f"{'不使用缓存(ms)':>14}{'首次写入(ms)':>14}{'缓存命中(ms)':>14}{'加速':>8}")
+    print(f"{uncached_ms:>14.0f}{cold_ms:>14.0f}{warm_ms:>14.0f}{uncached_ms / max(warm_ms, 1e-3):>7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="mian.py 微基准测试")
+    parser.add_argument("--width", type=int, default=6000, help="测试图片宽度（默认约24MP）")
+    parser.add_argument("--height", type=int, default=4000, help="测试图片高度")
+    parser.add_argument("--watermark-size", type=int, default=20, help="水印大小（占较短边的百分比）")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数")
+    parser.add_argument("--files", type=int, default=2000, help="文件头缓存测试的文件数量")
+    args = parser.parse_args()
+
+    benchmark_watermark(args.width, args.height, args.watermark_size, args.repeat)
+    benchmark_png_profiles(args.width // 2, args.height // 2, args.repeat)
+    benchmark_canvas_pool(args.width, args.height, args.repeat)
+    benchmark_header_cache(args.files)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,39 @@
 import os
+import io
+import sys
 import json
+import time
+import uuid
+import queue
+import argparse
+import mimetypes
+import shutil
+import sqlite3
+import struct
+import subprocess
+import tarfile
+import zipfile
+import posixpath
+import hashlib
+import threading
+import weakref
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk, Scale
 from PIL import Image, ImageEnhance
 from PIL.ExifTags import TAGS
 import piexif
+try:
+    import psutil  # 可选依赖：没有 /proc 的系统（如Windows）上用于读取进程常驻内存
+except ImportError:
+    psutil = None
+try:
+    import numpy as np  # 可选依赖：水印混合的NumPy实现
+except ImportError:
+    np = None
 import os
 from fractions import Fraction
 
@@ -28,6 +57,97 @@ DEFAULT_SPLIT_BY_ORIENTATION = True
 # 定义保存的常量
 FILE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
 
+# 合并流水线参数：读取线程数、预读的批次数、待编码队列长度
+DEFAULT_IO_WORKERS = 4
+DEFAULT_PREFETCH_BATCHES = 2
+DEFAULT_ENCODE_QUEUE_SIZE = 2
+# 合并时最多保留的空闲画布数：同尺寸的批次复用画布，只重新填充背景色，不重新分配内存
+DEFAULT_CANVAS_POOL_SIZE = 2
+
+# 合并时在处理中的批次（预读的源图片、画布和缩放结果）预估内存的上限（MB），
+# 以及按实际常驻内存修正预估值时的最大放大倍数
+DEFAULT_MERGE_MEMORY_BUDGET_MB = 2048
+MAX_MEMORY_CORRECTION = 4.0
+
+# 拆分时后台预读的合成图数量，以及预读图片占用内存的上限（MB）
+DEFAULT_SPLIT_READ_AHEAD = 2
+DEFAULT_SPLIT_MEMORY_BUDGET_MB = 1024
+
+# 原图库目录名：按内容哈希保存原始JPEG字节，拆分时可无损还原
+ORIGINALS_DIRNAME = "originals"
+ORIGINAL_EXTENSIONS = ('.jpg', '.jpeg')
+
+# EXIF旁路文件：原始EXIF块按内容去重后依次存放，record.json 中只记录 [偏移, 长度]
+EXIF_BLOB_FILE = "exif_blobs.bin"
+
+# 单文件容器输出：拼接结果整体写入一个不压缩的zip，文件名为输出目录名加此扩展名
+CONTAINER_EXTENSION = ".zip"
+
+# 预估输出大小时，照片内容的PNG平均每像素字节数（约为原始RGB的一半），以及JPEG拼接图的平均每像素字节数
+ESTIMATED_PNG_BYTES_PER_PIXEL = 1.5
+ESTIMATED_JPEG_BYTES_PER_PIXEL = 0.5
+
+# 拼接图格式：png 无损；jpeg 文件小，每张图片的位置按JPEG最小编码单元（MCU）对齐，
+# 拆分时输出为JPEG的图片可由 jpegtran 在DCT域直接裁剪，不重新编码，画质不会再损失
+SHEET_FORMATS = {"png": ".png", "jpeg": ".jpg"}
+DEFAULT_SHEET_FORMAT = "png"
+# 超过 max_size 时的缩放方式：canvas 整张画布按同一比例缩放；
+# cell 把 max_size 平均分成统一的单元格，每张图片单独缩小到能放进单元格，小图保留原始分辨率
+TILE_SCALING_MODES = ("canvas", "cell")
+DEFAULT_TILE_SCALING = "canvas"
+
+# JPEG拼接图的编码参数：不做色度抽样（4:4:4），此时MCU为8x8像素
+SHEET_JPEG_OPTIONS = {"quality": 95, "subsampling": 0}
+JPEG_MCU_SIZE = 8
+
+# 计算文件哈希时每次读取的块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 持久化文件头缓存：数据库文件名（默认放在用户缓存目录下）、格式版本，以及最多保留的条目数
+HEADER_CACHE_FILE = "header_cache.sqlite3"
+HEADER_CACHE_VERSION = 1
+DEFAULT_HEADER_CACHE_MAX_ENTRIES = 200000
+
+# 监视文件夹：扫描间隔（秒），以及文件多久不再变化才认为写入完成（秒）
+DEFAULT_WATCH_POLL_INTERVAL = 5.0
+DEFAULT_WATCH_SETTLE_TIME = 10.0
+
+# 本地HTTP服务：监听地址、端口、工作线程数、最多排队任务数、保留的已结束任务数
+DEFAULT_SERVICE_HOST = "127.0.0.1"
+DEFAULT_SERVICE_PORT = 8765
+DEFAULT_SERVICE_WORKERS = 2
+DEFAULT_SERVICE_MAX_PENDING = 64
+DEFAULT_SERVICE_MAX_HISTORY = 1000
+
+# 递归扫描源目录时跳过的子目录（程序自己的输出目录）
+SCAN_SKIP_DIRS = ("merged_output", "split_output")
+
+# 分片执行：批次清单格式版本，以及各分片记录/EXIF旁路文件名中的分片标识
+MANIFEST_VERSION = 1
+SHARD_NAME_FORMAT = "shard-{:03d}-of-{:03d}"
+
+# 可直接作为拼接来源的压缩包（zip随机读取成员，tar顺序流式读取）
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# 拆分输出PNG的保存方式：fast 低压缩级别最快，balanced 为zlib默认级别，max 尝试多种策略文件最小但最慢
+SPLIT_PNG_PROFILES = {
+    "fast": {"compress_level": 1},
+    "balanced": {"compress_level": 6},
+    "max": {"optimize": True},
+}
+DEFAULT_SPLIT_PNG_PROFILE = "balanced"
+
+# 拆分时同时生成的预览尺寸输出目录：拆分输出目录名加长边像素数，例如 split_output_2048px
+RENDITION_DIR_FORMAT = "{}_{}px"
+
+# 水印混合方式：pillow 用水印alpha作蒙版粘贴；numpy 用预乘alpha的uint16运算，未安装numpy时退回pillow
+# 两种方式都只处理水印覆盖的区域
+WATERMARK_BLEND_MODES = ("pillow", "numpy")
+DEFAULT_WATERMARK_BLEND = "pillow"
+
+# EXIF方向标签，值5~8表示图片需要旋转90度（宽高互换）
+EXIF_ORIENTATION_TAG = 0x0112
+
 
 class PILJSONEncoder(json.JSONEncoder):
     """自定义JSON编码器，用于处理PIL和EXIF相关的特殊类型"""
@@ -88,8 +208,329 @@ def is_portrait(image):
     return image.height > image.width
 
 
-def categorize_images_by_orientation(src_dir):
+class SourceImage:
+    """延迟解码的源图片
+    分类阶段只读取文件头（尺寸和EXIF方向），宽高已按EXIF方向修正；
+    像素数据在合并流水线的读取阶段才通过 load() 解码
+    来自文件对象的图片没有路径，原始字节保存在 data 中
+    """
+    def __init__(self, path, width, height, data=None, ext=None):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.data = data
+        self.ext = ext if ext is not None else os.path.splitext(path or "")[1].lower()
+        # 内容完全相同的其他文件：[(文件名, EXIF数据), ...]，拆分时共用这张图片的位置
+        self.duplicates = []
+        # 是否带有原始EXIF块（原始字节在读取阶段取出，不常驻内存）
+        self.has_exif = False
+
+    @classmethod
+    def from_path(cls, path):
+        return cls._from_header(path, path)
+
+    @classmethod
+    def from_bytes(cls, data, name):
+        """从内存中的文件内容创建，name 只用于确定扩展名"""
+        return cls._from_header(io.BytesIO(data), None, data, os.path.splitext(name)[1].lower())
+
+    @classmethod
+    def _from_header(cls, fp, path, data=None, ext=None):
+        with Image.open(fp) as img:
+            width, height = img.size
+            orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            has_exif = bool(img.info.get('exif'))
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+        src = cls(path, width, height, data, ext)
+        src.has_exif = has_exif
+        return src
+
+    def read_bytes(self):
+        """返回原始文件内容"""
+        if self.data is not None:
+            return self.data
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def load(self, fp=None):
+        """读取并解码图片，修正EXIF旋转方向后转为RGB
+        fp: 已读入内存的文件对象，为空时从 path 读取
+        """
+        return self.decode(fp)[0]
+
+    def decode(self, fp=None):
+        """同 load()，另外返回方向已复位的原始EXIF块（没有时为None）"""
+        if fp is None:
+            fp = io.BytesIO(self.data) if self.data is not None else self.path
+        with Image.open(fp) as img:
+            exif_blob = img.info.get('exif')
+            img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        return img, reset_exif_orientation(exif_blob) if exif_blob else None
+
+
+def reset_exif_orientation(exif_blob):
+    """把原始EXIF块中的方向标签改为1（正常）
+    拼接时图片已按方向旋转过，原样写回方向标签会让还原后的图片被再次旋转；
+    这里只改写标签值的两个字节，其余内容（包括MakerNote等偏移）保持不变
+    """
+    base = 6 if exif_blob.startswith(b"Exif\x00\x00") else 0
+    tiff = exif_blob[base:]
+    if len(tiff) < 8 or tiff[:2] not in (b"II", b"MM"):
+        return exif_blob
+    endian = "<" if tiff[:2] == b"II" else ">"
+    ifd_offset = struct.unpack_from(endian + "I", tiff, 4)[0]
+    if ifd_offset + 2 > len(tiff):
+        return exif_blob
+    entry_count = struct.unpack_from(endian + "H", tiff, ifd_offset)[0]
+    for i in range(entry_count):
+        entry = ifd_offset + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        tag, field_type, count = struct.unpack_from(endian + "HHI", tiff, entry)
+        if tag == EXIF_ORIENTATION_TAG and field_type == 3 and count == 1:
+            if struct.unpack_from(endian + "H", tiff, entry + 8)[0] == 1:
+                return exif_blob
+            patched = bytearray(exif_blob)
+            struct.pack_into(endian + "H", patched, base + entry + 8, 1)
+            return bytes(patched)
+    return exif_blob
+
+
+class ExifBlobStore:
+    """EXIF旁路文件的写入端
+    原始EXIF块按内容去重后追加到同一个二进制文件，add() 返回 [偏移, 长度]
+    """
+    def __init__(self, path, append=False):
+        self.path = path
+        self._mode = 'ab' if append else 'wb'
+        self._file = None
+        self._refs = {}
+        self._lock = threading.Lock()
+
+    def add(self, exif_blob):
+        key = hashlib.sha256(exif_blob).digest()
+        with self._lock:
+            ref = self._refs.get(key)
+            if ref is None:
+                if self._file is None:
+                    self._file = open(self.path, self._mode)
+                offset = self._file.seek(0, os.SEEK_END)
+                self._file.write(exif_blob)
+                ref = self._refs[key] = [offset, len(exif_blob)]
+            return list(ref)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class ContainerWriter:
+    """单文件容器的写入端
+    拼接图、原图库、EXIF旁路文件和 record.json 依次写入同一个不压缩的zip，
+    zip 末尾的中央目录记录每个成员的偏移，拆分时可直接定位任意一张拼接图
+    写入过程中使用临时文件，close() 时才替换为正式文件；多个线程可同时调用 write_bytes()
+    """
+    def __init__(self, path):
+        self.path = path
+        self._tmp_path = path + ".tmp"
+        self._zip = zipfile.ZipFile(self._tmp_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._names
+
+    def write_bytes(self, name, data):
+        """写入一个成员，同名成员已存在时忽略（原图库按内容命名，相同内容只保存一份）"""
+        with self._lock:
+            if name in self._names:
+                return
+            self._zip.writestr(name, data)
+            self._names.add(name)
+
+    def write_file(self, name, path):
+        with self._lock:
+            self._zip.write(path, name)
+            self._names.add(name)
+
+    def close(self):
+        self._zip.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """出错时丢弃未完成的容器"""
+        self._zip.close()
+        os.remove(self._tmp_path)
+
+
+class MergedDirStore:
+    """拼接输出目录的读取端，成员名使用 / 分隔的相对路径"""
+    def __init__(self, root):
+        self.root = root
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.root, *name.split("/")))
+
+    def read(self, name, offset=0, length=-1):
+        with open(os.path.join(self.root, *name.split("/")), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def open_image(self, name):
+        return Image.open(os.path.join(self.root, *name.split("/")))
+
+    def copy_to(self, name, target_file):
+        shutil.copyfile(os.path.join(self.root, *name.split("/")), target_file)
+
+    def close(self):
+        pass
+
+
+class MergedContainerStore:
+    """单文件容器的读取端，接口与 MergedDirStore 相同
+    成员不压缩，按中央目录中的偏移直接读取，不需要顺序扫描整个容器
+    """
+    def __init__(self, path):
+        self._zip = zipfile.ZipFile(path)
+        self._names = set(self._zip.namelist())
+
+    def exists(self, name):
+        return name in self._names
+
+    def read(self, name, offset=0, length=-1):
+        with self._zip.open(name) as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def open_image(self, name):
+        return Image.open(io.BytesIO(self._zip.read(name)))
+
+    def copy_to(self, name, target_file):
+        with self._zip.open(name) as src, open(target_file, 'wb') as dst:
+            shutil.copyfileobj(src, dst, HASH_CHUNK_SIZE)
+
+    def close(self):
+        self._zip.close()
+
+
+def scan_image_files(src_dir, recursive=False, io_workers=DEFAULT_IO_WORKERS, exclude_dirs=()):
+    """列出源目录中的图片，返回以 / 分隔的相对路径列表（按路径逐级排序）
+    使用 os.scandir 直接读取目录项类型，不再逐个 stat；
+    recursive 为真时包含子目录，多个目录由线程池同时读取，网络文件系统上可以掩盖延迟
+    跳过隐藏目录、程序的输出目录以及 exclude_dirs 中的目录
+    """
+    exclude_dirs = {os.path.abspath(d) for d in exclude_dirs if d}
+
+    def scan_one(rel_dir):
+        files, subdirs = [], []
+        try:
+            with os.scandir(os.path.join(src_dir, *rel_dir.split("/")) if rel_dir else src_dir) as it:
+                for entry in it:
+                    rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if (recursive and not entry.name.startswith(".") and entry.name not in SCAN_SKIP_DIRS
+                                and os.path.abspath(entry.path) not in exclude_dirs):
+                            subdirs.append(rel)
+                    elif entry.name.lower().endswith(FILE_EXTENSIONS) and entry.is_file():
+                        files.append(rel)
+        except OSError as e:
+            print(f"无法读取目录 {rel_dir or src_dir}: {e}")
+        return files, subdirs
+
+    found = []
+    with ThreadPoolExecutor(max_workers=max(1, io_workers), thread_name_prefix="scan") as pool:
+        pending = {pool.submit(scan_one, "")}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                found += files
+                pending |= {pool.submit(scan_one, rel) for rel in subdirs}
+    return sorted(found, key=lambda rel: rel.split("/"))
+
+
+def default_cache_dir():
+    """用户缓存目录：Windows 为 %LOCALAPPDATA%\\mian，其他系统为 $XDG_CACHE_HOME/mian 或 ~/.cache/mian"""
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") \
+        or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "mian")
+
+
+class HeaderCache:
+    """持久化的文件头缓存（SQLite）
+    按 绝对路径 + 文件大小 + 修改时间 保存按EXIF方向修正后的尺寸、是否带EXIF块以及提取出的元数据，
+    再次分类同一批文件时不必重新打开每个文件；大小或修改时间变化即视为失效，
+    条目超过 max_entries 时删除最久未使用的
+    数据库只在创建它的线程中访问：读取线程只查询 load() 预先取出的字典，结果由 update() 统一写回
+    缓存只是加速手段，数据库无法打开或写入时打印提示后按无缓存继续
+    """
+    def __init__(self, path=None, max_entries=DEFAULT_HEADER_CACHE_MAX_ENTRIES):
+        self.path = path or os.path.join(default_cache_dir(), HEADER_CACHE_FILE)
+        self.max_entries = max_entries
+        self.conn = None
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            if conn.execute("PRAGMA user_version").fetchone()[0] != HEADER_CACHE_VERSION:
+                conn.execute("DROP TABLE IF EXISTS headers")
+                conn.execute(f"PRAGMA user_version = {HEADER_CACHE_VERSION}")
+            conn.execute("CREATE TABLE IF NOT EXISTS headers (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                         "width INTEGER, height INTEGER, has_exif INTEGER, exif_data TEXT, last_used REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS headers_last_used ON headers (last_used)")
+            conn.commit()
+            self.conn = conn
+        except (OSError, sqlite3.Error) as e:
+            print(f"无法打开文件头缓存，本次不使用缓存: {e}")
+
+    def load(self, src_dir):
+        """取出 src_dir 下的所有条目：{绝对路径: (大小, 修改时间, 宽, 高, 是否带EXIF, 元数据JSON)}"""
+        if self.conn is None:
+            return {}
+        prefix = os.path.join(os.path.abspath(src_dir), "")
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        try:
+            rows = self.conn.execute("SELECT path, size, mtime_ns, width, height, has_exif, exif_data FROM headers "
+                                     "WHERE path >= ? AND path < ?", (prefix, upper)).fetchall()
+        except sqlite3.Error as e:
+            print(f"读取文件头缓存失败: {e}")
+            return {}
+        return {row[0]: row[1:] for row in rows}
+
+    def update(self, hits, misses):
+        """记录本次命中的路径，写入新读取的文件头 [(绝对路径, 大小, 修改时间, SourceImage, 元数据)]，然后按容量淘汰"""
+        if self.conn is None:
+            return
+        now = time.time()
+        try:
+            with self.conn:
+                self.conn.executemany("UPDATE headers SET last_used = ? WHERE path = ?", ((now, path) for path in hits))
+                self.conn.executemany("INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+                    (path, size, mtime_ns, img.width, img.height, int(img.has_exif),
+                     json.dumps(exif_data, ensure_ascii=False), now)
+                    for path, size, mtime_ns, img, exif_data in misses))
+                self.conn.execute("DELETE FROM headers WHERE path IN "
+                                  "(SELECT path FROM headers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                                  (self.max_entries,))
+        except sqlite3.Error as e:
+            print(f"更新文件头缓存失败: {e}")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def categorize_images_by_orientation(src_dir, recursive=False, io_workers=DEFAULT_IO_WORKERS, exclude_dirs=(),
+                                     header_cache=None):
     """按横竖屏分类图片
+    recursive 为真时包含子目录，文件名为相对于 src_dir 的路径（以 / 分隔）
+    header_cache: HeaderCache，不为空时大小和修改时间未变的文件直接使用缓存的文件头，不再打开文件
     返回：(portrait_images, landscape_images, portrait_exif, landscape_exif, portrait_filenames, landscape_filenames)
     """
     portrait_images = []
@@ -98,33 +539,105 @@ def categorize_images_by_orientation(src_dir):
     landscape_exif = []
     portrait_filenames = []
     landscape_filenames = []
-    
-    for fname in sorted(os.listdir(src_dir)):
-        if fname.lower().endswith(FILE_EXTENSIONS):
-            try:
-                img_path = os.path.join(src_dir, fname)
-                img = Image.open(img_path)
-                # 修正图片的EXIF旋转方向
-                img = ImageOps.exif_transpose(img)
-                # 提取并保存EXIF元数据
-                exif_data = extract_exif_data(img_path)
-                
-                # 根据方向分类图片
-                if is_portrait(img):
-                    portrait_images.append(img)
-                    portrait_exif.append(exif_data)
-                    portrait_filenames.append(fname)
-                else:
-                    landscape_images.append(img)
-                    landscape_exif.append(exif_data)
-                    landscape_filenames.append(fname)
-            except Exception as e:
-                print(f"无法打开 {fname}: {e}")
-    
+
+    cached = header_cache.load(src_dir) if header_cache is not None else {}
+    cache_hits = []
+    cache_misses = []
+
+    def read_header(fname):
+        try:
+            img_path = os.path.join(src_dir, *fname.split("/"))
+            if header_cache is not None:
+                # 先取大小和修改时间，读取期间文件被修改时下次会因不一致而重新读取
+                abs_path = os.path.abspath(img_path)
+                stat = os.stat(img_path)
+                entry = cached.get(abs_path)
+                if entry and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+                    img = SourceImage(img_path, entry[2], entry[3])
+                    img.has_exif = bool(entry[4])
+                    cache_hits.append(abs_path)
+                    return img, json.loads(entry[5])
+            # 只读取文件头，像素在合并时再解码
+            img = SourceImage.from_path(img_path)
+            # 原始EXIF块在合并时直接写入旁路文件，这里只提取PNG文本等其他元数据
+            exif_data = {} if img.has_exif else extract_exif_data(img_path)
+            if header_cache is not None:
+                cache_misses.append((abs_path, stat.st_size, stat.st_mtime_ns, img, exif_data))
+            return img, exif_data
+        except Exception as e:
+            print(f"无法打开 {fname}: {e}")
+            return None
+
+    # 文件头由线程池并行读取，结果仍按文件名顺序处理
+    filenames = scan_image_files(src_dir, recursive, io_workers, exclude_dirs)
+    with ThreadPoolExecutor(max_workers=max(1, io_workers), thread_name_prefix="header") as pool:
+        headers = list(pool.map(read_header, filenames))
+    if header_cache is not None:
+        header_cache.update(cache_hits, cache_misses)
+        print(f"文件头缓存命中 {len(cache_hits)} 张，新读取 {len(cache_misses)} 张")
+
+    for fname, header in zip(filenames, headers):
+        if header is None:
+            continue
+        img, exif_data = header
+        # 根据方向分类图片
+        if is_portrait(img):
+            portrait_images.append(img)
+            portrait_exif.append(exif_data)
+            portrait_filenames.append(fname)
+        else:
+            landscape_images.append(img)
+            landscape_exif.append(exif_data)
+            landscape_filenames.append(fname)
+
     print(f"共找到 {len(portrait_images)} 张竖屏图片，{len(landscape_images)} 张横屏图片")
     return portrait_images, landscape_images, portrait_exif, landscape_exif, portrait_filenames, landscape_filenames
 
 
+def file_sha256(path, chunk_size=HASH_CHUNK_SIZE):
+    """分块流式计算文件的SHA-256，不把整个文件读入内存"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dedupe_images(images, filenames, exif_metadata, io_workers=DEFAULT_IO_WORKERS):
+    """按文件内容去除重复图片
+    只有文件大小与其他文件相同的才需要计算哈希；重复的图片不再单独拼接，
+    而是记录到首个相同图片的 duplicates 中，拆分时仍会还原出每个文件名
+    返回去重后的 (images, filenames, exif_metadata)
+    """
+    sizes = {}
+    for i, img in enumerate(images):
+        sizes.setdefault(os.path.getsize(img.path), []).append(i)
+    candidates = [i for group in sizes.values() if len(group) > 1 for i in group]
+    if not candidates:
+        return images, filenames, exif_metadata
+
+    with ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="dedupe-hash") as pool:
+        digests = dict(zip(candidates, pool.map(lambda i: file_sha256(images[i].path), candidates)))
+
+    first_by_digest = {}
+    unique_images, unique_filenames, unique_exif = [], [], []
+    for i, img in enumerate(images):
+        digest = digests.get(i)
+        if digest is not None and digest in first_by_digest:
+            first_by_digest[digest].duplicates.append((filenames[i], exif_metadata[i]))
+            continue
+        if digest is not None:
+            first_by_digest[digest] = img
+        unique_images.append(img)
+        unique_filenames.append(filenames[i])
+        unique_exif.append(exif_metadata[i])
+
+    removed = len(images) - len(unique_images)
+    if removed:
+        print(f"发现 {removed} 张重复图片，将与相同内容的图片共用拼接位置")
+    return unique_images, unique_filenames, unique_exif
+
+
 def extract_exif_data(image_path):
     """提取图片的EXIF数据"""
     exif_data = {}
@@ -197,118 +710,1464 @@ def save_watermark_config(config):
         print(f"保存配置文件失败: {e}")
 
 
-def merge_images_grid(src_dir, merge_count, spacing, max_size, progress_var, split_by_orientation=True):
-    """按横竖屏分类合并图片
-    src_dir: 源图片目录
+def store_original(data, dst_dir, ext, container=None):
+    """把原始文件字节按内容哈希存入原图库，内容相同的文件只保存一份
+    返回相对于 dst_dir 的引用路径，写入 record.json；container 不为空时写入容器
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    ref = f"{ORIGINALS_DIRNAME}/{digest[:2]}/{digest}{ext}"
+    if container is not None:
+        container.write_bytes(ref, data)
+        return ref
+    target = os.path.join(dst_dir, *ref.split("/"))
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # 多台机器可能同时写入共享存储上的同一原图，临时文件名需全局唯一
+        tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, target)
+    return ref
+
+
+def read_source(src, dst_dir, keep_originals, container=None, name=None):
+    """流水线读取阶段：解码一张源图片
+    keep_originals 为真且源文件是JPEG时，只读一次文件，解码成功后字节存入原图库
+    分类阶段只读取了文件头，文件内容损坏（例如被截断）时在这里才会发现：
+    打印提示后返回 (None, None, None)，调用方把这张图片从批次中去掉
+    返回 (解码后的图片, 原图库引用或None, 原始EXIF块或None)
+    """
+    try:
+        data = None
+        fp = None
+        if keep_originals and src.ext in ORIGINAL_EXTENSIONS:
+            data = src.read_bytes()
+            fp = io.BytesIO(data)
+        image, exif_blob = src.decode(fp)
+        ref = store_original(data, dst_dir, src.ext, container) if data is not None else None
+    except Exception as e:
+        print(f"无法打开 {name or src.path}: {e}")
+        return None, None, None
+    return image, ref, exif_blob
+
+
+class JobError(Exception):
+    """任务参数或输入无效，消息可直接展示给用户"""
+
+
+def _report_progress(progress, percent):
+    if progress is not None:
+        progress(int(percent))
+
+
+class MergeJob:
+    """一次拼接任务
+    所有配置通过参数传入，进度通过回调报告，不读取界面控件或全局变量，
+    因此多个任务可以在同一进程的不同线程中同时运行
+    src_dir: 源图片目录，也可以是zip/tar压缩包（不解压，直接读取其中的图片）
     merge_count: 每张合并图片包含的图片数量（2,3,4,6,9）
     spacing: 图片间距
     max_size: 最大尺寸限制
-    progress_var: 进度条变量
     split_by_orientation: 是否将横竖屏分开拼接
+    keep_originals: 是否把JPEG原图存入原图库，拆分时无水印则原样还原
+    dedup: 是否去除内容完全相同的重复图片（重复图片共用一个拼接位置）
+    dst_dir: 输出目录，默认为 src_dir/merged_output；来源是压缩包时为压缩包所在目录下的 merged_output
+    container: 为真时不创建输出目录，所有输出写入单个文件 dst_dir + ".zip"
+    recursive: 是否包含子文件夹中的图片，记录中的文件名为相对路径，拆分时还原目录结构
+    per_folder: 与 recursive 一起使用，每个子文件夹单独切分批次，拼接图不混合不同文件夹的图片
+    memory_budget_mb: 处理中批次的内存上限（MB），并发度在预算内自动调整，为空时固定预读 prefetch_batches 批
+    largest_first: 按预估处理量从大到小处理批次，拼接图文件名和记录顺序不受影响
+    sheet_format: 拼接图格式，见 SHEET_FORMATS；jpeg 时图片位置按MCU对齐，拆分时可无损裁剪
+    tile_scaling: 超过 max_size 时的缩放方式，见 TILE_SCALING_MODES；cell 时每张图片单独缩放到统一的单元格，
+        小图不跟着大图一起缩小，记录中每个位置的 scale 为该图片的缩放比例
+    header_cache: 持久化文件头缓存，True 使用用户缓存目录下的默认数据库，也可以是数据库路径，为假时不使用
+    memory_budget: 与其他任务共用的 MemoryBudget（见 JobManager），不为空时代替 memory_budget_mb
+    progress: 进度回调，参数为0~100的整数
+    """
+    def __init__(self, src_dir, merge_count=6, spacing=0, max_size=DEFAULT_MAX_SIZE,
+                 split_by_orientation=DEFAULT_SPLIT_BY_ORIENTATION, keep_originals=False, dedup=False,
+                 dst_dir=None, io_workers=DEFAULT_IO_WORKERS, prefetch_batches=DEFAULT_PREFETCH_BATCHES,
+                 container=False, recursive=False, per_folder=False,
+                 memory_budget_mb=DEFAULT_MERGE_MEMORY_BUDGET_MB, largest_first=True,
+                 sheet_format=DEFAULT_SHEET_FORMAT, tile_scaling=DEFAULT_TILE_SCALING, header_cache=True,
+                 memory_budget=None, progress=None):
+        self.src_dir = src_dir
+        self.merge_count = merge_count
+        self.spacing = spacing
+        self.max_size = max_size
+        self.split_by_orientation = split_by_orientation
+        self.keep_originals = keep_originals
+        self.dedup = dedup
+        self.from_archive = is_archive(src_dir)
+        if dst_dir is None and src_dir:
+            base_dir = os.path.dirname(os.path.abspath(src_dir)) if self.from_archive else src_dir
+            dst_dir = os.path.join(base_dir, "merged_output")
+        self.dst_dir = dst_dir
+        self.io_workers = io_workers
+        self.prefetch_batches = prefetch_batches
+        self.container = container
+        self.recursive = recursive
+        self.per_folder = per_folder
+        self.memory_budget_mb = memory_budget_mb
+        self.largest_first = largest_first
+        self.sheet_format = sheet_format
+        self.tile_scaling = tile_scaling
+        self.header_cache = header_cache
+        self.memory_budget = memory_budget
+        self.progress = progress
+        self.record_data = []
+
+    def validate(self):
+        if not self.src_dir or not os.path.exists(self.src_dir):
+            raise JobError("请选择有效的源图片文件夹")
+        # 验证合并数量是否在支持的选项中
+        if self.merge_count not in MERGE_OPTIONS:
+            raise JobError(f"不支持的合并数量: {self.merge_count}，请选择 2,3,4,6,9")
+        if self.from_archive and self.dedup:
+            raise JobError("压缩包来源暂不支持去除重复图片")
+        if self.sheet_format not in SHEET_FORMATS:
+            raise JobError(f"不支持的拼接图格式: {self.sheet_format}，请选择 {', '.join(SHEET_FORMATS)}")
+        if self.tile_scaling not in TILE_SCALING_MODES:
+            raise JobError(f"不支持的缩放方式: {self.tile_scaling}，请选择 {', '.join(TILE_SCALING_MODES)}")
+
+    def plan(self):
+        """分类源图片并切分批次（只读取文件头），返回批次列表"""
+        self.validate()
+
+        # 按横竖屏分类图片
+        header_cache = None
+        if self.header_cache:
+            header_cache = HeaderCache(None if self.header_cache is True else self.header_cache)
+        try:
+            portrait_images, landscape_images, portrait_exif, landscape_exif, portrait_filenames, landscape_filenames = \
+                categorize_images_by_orientation(self.src_dir, self.recursive, self.io_workers, [self.dst_dir],
+                                                 header_cache)
+        finally:
+            if header_cache is not None:
+                header_cache.close()
+
+        if not portrait_images and not landscape_images:
+            raise JobError("没有找到图片文件")
+
+        if self.dedup:
+            portrait_images, portrait_filenames, portrait_exif = \
+                dedupe_images(portrait_images, portrait_filenames, portrait_exif, self.io_workers)
+            landscape_images, landscape_filenames, landscape_exif = \
+                dedupe_images(landscape_images, landscape_filenames, landscape_exif, self.io_workers)
+
+        if not (self.recursive and self.per_folder):
+            return self._plan_group(portrait_images, landscape_images, portrait_exif, landscape_exif,
+                                    portrait_filenames, landscape_filenames, 0)
+
+        # 按子文件夹分组切分批次，批次序号在所有文件夹之间连续
+        # 一次遍历把下标按文件夹分组：文件夹 -> ([竖屏下标], [横屏下标])
+        groups = {}
+        for side, filenames in enumerate((portrait_filenames, landscape_filenames)):
+            for i, name in enumerate(filenames):
+                groups.setdefault(posixpath.dirname(name), ([], []))[side].append(i)
+
+        def pick(items, picked):
+            return [items[i] for i in picked]
+
+        batches = []
+        for folder in sorted(groups, key=lambda folder: folder.split("/")):
+            p_idx, l_idx = groups[folder]
+            batches += self._plan_group(
+                pick(portrait_images, p_idx), pick(landscape_images, l_idx),
+                pick(portrait_exif, p_idx), pick(landscape_exif, l_idx),
+                pick(portrait_filenames, p_idx), pick(landscape_filenames, l_idx), len(batches))
+        return batches
+
+    def dry_run(self):
+        """只读取文件头，计算完整的拼接计划和资源预估，不解码像素也不写入任何文件"""
+        if self.from_archive:
+            raise JobError("压缩包来源不支持预估，请先在文件夹上预估")
+        return estimate_plan(self.plan(), self.spacing, self.max_size, self.keep_originals,
+                             self.prefetch_batches, self.sheet_format, self.tile_scaling,
+                             self.memory_budget_mb, self.io_workers, self.largest_first)
+
+    def _plan_group(self, portrait_images, landscape_images, portrait_exif, landscape_exif,
+                    portrait_filenames, landscape_filenames, start_index):
+        """把一组已分类的图片切分为批次，批次序号从 start_index + 1 开始"""
+        merge_count = self.merge_count
+        batches = []
+        if self.split_by_orientation:
+            # 处理竖屏图片
+            if portrait_images:
+                rows, cols = MERGE_OPTIONS[merge_count]["portrait"]
+                batches += plan_image_batches(
+                    portrait_images, portrait_filenames, portrait_exif,
+                    rows, cols, "portrait", start_index + len(batches)
+                )
+
+            # 处理横屏图片
+            if landscape_images:
+                rows, cols = MERGE_OPTIONS[merge_count]["landscape"]
+                batches += plan_image_batches(
+                    landscape_images, landscape_filenames, landscape_exif,
+                    rows, cols, "landscape", start_index + len(batches)
+                )
+        else:
+            # 不按横竖屏分开拼接，混合处理所有图片
+            # 但仍然根据每张图片的方向选择合适的布局，尽量减少尺寸调整
+            all_images = portrait_images + landscape_images
+            all_filenames = portrait_filenames + landscape_filenames
+            all_exif = portrait_exif + landscape_exif
+
+            # 为混合模式实现尽量最小化尺寸调整的逻辑
+            batch_size = merge_count
+            for i in range(0, len(all_images), batch_size):
+                batch_imgs = all_images[i:i + batch_size]
+                rows, cols, layout_type = choose_mixed_layout(batch_imgs, merge_count)
+                batches += plan_image_batches(
+                    batch_imgs, all_filenames[i:i + batch_size], all_exif[i:i + batch_size],
+                    rows, cols, layout_type, start_index + len(batches)
+                )
+        return batches
+
+    def output_paths(self):
+        """任务会写入的路径，HTTP服务据此拒绝输出重叠的任务"""
+        return [self.dst_dir + CONTAINER_EXTENSION if self.container else self.dst_dir]
+
+    def run(self):
+        """执行拼接，返回输出目录（容器模式下为容器文件路径）"""
+        if self.from_archive:
+            # 压缩包边读边拼接，不先解压
+            self.validate()
+            batches = iter_merge_batches(iter_archive_items(self.src_dir), self.merge_count,
+                                         self.split_by_orientation)
+        else:
+            batches = self.plan()
+
+        # 所有批次放入同一条流水线，读取、拼接和编码互相重叠
+        self.record_data, output_path = write_merge_output(
+            batches, self.dst_dir, self.spacing, self.max_size, self.progress, self.io_workers,
+            self.prefetch_batches, self.keep_originals, self.container, self.memory_budget_mb,
+            self.largest_first, self.sheet_format, self.tile_scaling, self.memory_budget
+        )
+        return output_path
+
+
+def write_merge_output(batches, dst_dir, spacing, max_size, progress, io_workers=DEFAULT_IO_WORKERS,
+                       prefetch_batches=DEFAULT_PREFETCH_BATCHES, keep_originals=False, container=False,
+                       memory_budget_mb=DEFAULT_MERGE_MEMORY_BUDGET_MB, largest_first=False,
+                       sheet_format=DEFAULT_SHEET_FORMAT, tile_scaling=DEFAULT_TILE_SCALING, memory_budget=None):
+    """运行合并流水线，写出拼接图、EXIF旁路文件和 record.json，返回 (记录数据, 输出路径)
+    container 为真时全部写入单个文件 dst_dir + ".zip"，record.json 放在容器最后
     """
-    if not src_dir or not os.path.exists(src_dir):
-        messagebox.showerror("错误", "请选择有效的源图片文件夹")
+    record_data = []
+    if container:
+        output_path = os.path.abspath(dst_dir).rstrip(os.sep) + CONTAINER_EXTENSION
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        writer = ContainerWriter(output_path)
+        exif_path = output_path + ".exif.tmp"
+    else:
+        output_path = dst_dir
+        os.makedirs(dst_dir, exist_ok=True)
+        writer = None
+        exif_path = os.path.join(dst_dir, EXIF_BLOB_FILE)
+
+    exif_store = ExifBlobStore(exif_path)
+    try:
+        run_merge_pipeline(batches, spacing, max_size, progress, dst_dir, record_data,
+                           io_workers=io_workers, prefetch_batches=prefetch_batches,
+                           keep_originals=keep_originals, exif_store=exif_store, container=writer,
+                           memory_budget_mb=memory_budget_mb, largest_first=largest_first,
+                           sheet_format=sheet_format, tile_scaling=tile_scaling, memory_budget=memory_budget)
+        exif_store.close()
+        if not record_data:
+            raise JobError("没有找到图片文件")
+
+        if writer is None:
+            save_record(os.path.join(dst_dir, "record.json"), record_data)
+        else:
+            if os.path.exists(exif_path):
+                writer.write_file(EXIF_BLOB_FILE, exif_path)
+            writer.write_bytes("record.json", json.dumps(record_data, ensure_ascii=False, indent=4,
+                                                         cls=PILJSONEncoder).encode('utf-8'))
+            writer.close()
+            writer = None
+    finally:
+        exif_store.close()
+        if writer is not None:
+            writer.abort()
+        if container and os.path.exists(exif_path):
+            os.remove(exif_path)
+
+    _report_progress(progress, 100)
+    return record_data, output_path
+
+
+def choose_mixed_layout(batch_imgs, merge_count):
+    """混合模式下按批次中图片的方向分布选择布局，返回 (rows, cols, 布局标识)"""
+    # 分析当前批次中图片的方向分布
+    portrait_count = sum(1 for img in batch_imgs if is_portrait(img))
+    landscape_count = len(batch_imgs) - portrait_count
+
+    # 选择合适的布局（基于方向分布）
+    # 如果竖屏图片占大多数，使用竖屏布局；否则使用横屏布局
+    if portrait_count > landscape_count:
+        rows, cols = MERGE_OPTIONS[merge_count]["portrait"]
+        return rows, cols, "mixed_portrait_preferred"
+    rows, cols = MERGE_OPTIONS[merge_count]["landscape"]
+    return rows, cols, "mixed_landscape_preferred"
+
+
+def save_record(record_file, record_data):
+    """写入 record.json；先写临时文件再替换，中途出错不会留下不完整的记录"""
+    tmp_file = record_file + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(record_data, f, ensure_ascii=False, indent=4, cls=PILJSONEncoder)
+    os.replace(tmp_file, record_file)
+
+
+def last_sheet_index(record_data):
+    """记录中已使用的最大拼接图序号（文件名末尾的数字）
+    批次中的图片全部无法解码时不生成拼接图也没有记录，序号可能不连续，
+    追加新批次时必须从这里往后编号，不能按记录条数，否则会覆盖已有的拼接图
+    """
+    last = 0
+    for entry in record_data:
+        suffix = os.path.splitext(entry["merged_file"])[0].rsplit("_", 1)[-1]
+        if suffix.isdigit():
+            last = max(last, int(suffix))
+    return last
+
+
+def load_record(record_file):
+    """读取 record.json，文件不存在时返回空列表"""
+    if not os.path.exists(record_file):
+        return []
+    with open(record_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class BatchAccumulator:
+    """按布局累积陆续到来的图片，凑满一批即切出批次
+    split_by_orientation 时横竖屏各自累积；否则混合累积，并按批次内的方向分布选择布局
+    """
+    def __init__(self, merge_count, split_by_orientation=DEFAULT_SPLIT_BY_ORIENTATION):
+        self.merge_count = merge_count
+        self.split_by_orientation = split_by_orientation
+        # 布局标识 -> [(SourceImage, 文件名, EXIF数据), ...]
+        self._queues = {}
+
+    def __len__(self):
+        return sum(len(queued) for queued in self._queues.values())
+
+    def _key(self, img):
+        if self.split_by_orientation:
+            return "portrait" if is_portrait(img) else "landscape"
+        return "mixed"
+
+    def add(self, img, name, exif_data):
+        self._queues.setdefault(self._key(img), []).append((img, name, exif_data))
+
+    def put_back(self, batches):
+        """把 take() 取出但没有完成的批次放回各自队列的最前面，保持原来的顺序"""
+        returned = {}
+        for batch in batches:
+            for img, name, exif_data in zip(batch["images"], batch["filenames"], batch["exif"]):
+                returned.setdefault(self._key(img), []).append((img, name, exif_data))
+        for key, items in returned.items():
+            self._queues[key] = items + self._queues.get(key, [])
+
+    def take(self, start_index, flush=False):
+        """取出已凑满的批次（flush 时不足一批的也取出），批次序号从 start_index + 1 开始"""
+        batches = []
+        for key in sorted(self._queues):
+            queued = self._queues[key]
+            if key == "mixed":
+                batch_size = self.merge_count
+            else:
+                rows, cols = MERGE_OPTIONS[self.merge_count][key]
+                batch_size = rows * cols
+            while len(queued) >= batch_size or (flush and queued):
+                chunk, queued[:] = queued[:batch_size], queued[batch_size:]
+                images = [item[0] for item in chunk]
+                if key == "mixed":
+                    rows, cols, layout_type = choose_mixed_layout(images, self.merge_count)
+                else:
+                    layout_type = key
+                batches += plan_image_batches(
+                    images, [item[1] for item in chunk], [item[2] for item in chunk],
+                    rows, cols, layout_type, start_index + len(batches)
+                )
+        return batches
+
+
+def is_archive(path):
+    """判断路径是否为支持的压缩包文件"""
+    return bool(path) and os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def paths_overlap(a, b):
+    """两个路径相同或其中一个位于另一个之内"""
+    a, b = os.path.realpath(a), os.path.realpath(b)
+    try:
+        return os.path.commonpath([a, b]) in (a, b)
+    except ValueError:
+        # Windows 上不同盘符的路径
+        return False
+
+
+def safe_member_name(name):
+    """把压缩包成员名或调用方给出的文件名规范为相对路径（以 / 分隔），
+    绝对路径、带盘符或包含 .. 而会落到输出目录之外的名字返回None
+    """
+    name = posixpath.normpath(name.replace("\\", "/"))
+    if name.startswith("/") or name in (".", "..") or name.startswith("../") or os.path.splitdrive(name)[0]:
+        return None
+    return name
+
+
+def iter_archive_items(archive_path):
+    """逐个产出压缩包中的图片 (成员名, 文件对象)，不解压到磁盘
+    zip 按成员名排序后随机读取；tar 按包内顺序流式读取，每个成员必须在取下一个之前读完
+    成员名保留包内的目录结构，作为拆分时还原的文件名
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            members = [info for info in zf.infolist()
+                       if not info.is_dir() and info.filename.lower().endswith(FILE_EXTENSIONS)]
+            for info in sorted(members, key=lambda info: info.filename):
+                name = safe_member_name(info.filename)
+                if name is None:
+                    print(f"跳过不安全的成员名: {info.filename}")
+                    continue
+                with zf.open(info) as f:
+                    yield name, f
         return
 
-    # 验证合并数量是否在支持的选项中
+    with tarfile.open(archive_path, mode="r|*") as tf:
+        for member in tf:
+            if not member.isfile() or not member.name.lower().endswith(FILE_EXTENSIONS):
+                continue
+            name = safe_member_name(member.name)
+            if name is None:
+                print(f"跳过不安全的成员名: {member.name}")
+                continue
+            yield name, tf.extractfile(member)
+
+
+def open_source_item(name, source):
+    """把 (文件名, 路径或文件对象) 转为 (SourceImage, EXIF数据)
+    文件对象只顺序读取一次，内容保存在内存中供之后解码
+    """
+    if isinstance(source, (str, os.PathLike)):
+        img = SourceImage.from_path(source)
+        exif_data = {} if img.has_exif else extract_exif_data(source)
+    else:
+        data = source.read()
+        img = SourceImage.from_bytes(data, name)
+        exif_data = {} if img.has_exif else extract_exif_data(io.BytesIO(data))
+    return img, exif_data
+
+
+def iter_merge_batches(items, merge_count, split_by_orientation=DEFAULT_SPLIT_BY_ORIENTATION):
+    """逐项读取 (文件名, 路径或文件对象)，每凑满一批就产出一个批次，最后产出不足一批的剩余图片"""
+    accumulator = BatchAccumulator(merge_count, split_by_orientation)
+    count = 0
+    for name, source in items:
+        # 文件名会写入记录，拆分时作为输出路径，必须是输出目录内的相对路径
+        safe_name = safe_member_name(name)
+        if safe_name is None:
+            print(f"跳过不安全的文件名: {name}")
+            continue
+        name = safe_name
+        try:
+            img, exif_data = open_source_item(name, source)
+        except Exception as e:
+            print(f"无法打开 {name}: {e}")
+            continue
+        accumulator.add(img, name, exif_data)
+        for batch in accumulator.take(count):
+            count += 1
+            yield batch
+    for batch in accumulator.take(count, flush=True):
+        count += 1
+        yield batch
+
+
+def merge_from_iterable(items, dst_dir, merge_count=6, spacing=0, max_size=DEFAULT_MAX_SIZE,
+                        split_by_orientation=DEFAULT_SPLIT_BY_ORIENTATION, keep_originals=False,
+                        io_workers=DEFAULT_IO_WORKERS, prefetch_batches=DEFAULT_PREFETCH_BATCHES,
+                        container=False, sheet_format=DEFAULT_SHEET_FORMAT, tile_scaling=DEFAULT_TILE_SCALING,
+                        progress=None):
+    """从任意 (文件名, 路径或文件对象) 序列拼接图片，写出拼接图和 record.json，返回记录数据
+    序列按需逐项读取：图片凑满一批就送入合并流水线，不需要先把所有图片保存到磁盘；
+    内存中最多保留尚未凑满的批次和流水线预读的批次
+    批次、文件名和记录格式与 MergeJob 相同；由于总数未知，progress 只在结束时收到100
+    container 为真时所有输出写入单个文件 dst_dir + ".zip"
+    """
     if merge_count not in MERGE_OPTIONS:
-        messagebox.showerror("错误", f"不支持的合并数量: {merge_count}，请选择 2,3,4,6,9")
-        return
+        raise JobError(f"不支持的合并数量: {merge_count}，请选择 2,3,4,6,9")
+    if sheet_format not in SHEET_FORMATS:
+        raise JobError(f"不支持的拼接图格式: {sheet_format}，请选择 {', '.join(SHEET_FORMATS)}")
+    if tile_scaling not in TILE_SCALING_MODES:
+        raise JobError(f"不支持的缩放方式: {tile_scaling}，请选择 {', '.join(TILE_SCALING_MODES)}")
+    batches = iter_merge_batches(items, merge_count, split_by_orientation)
+    record_data, _ = write_merge_output(batches, dst_dir, spacing, max_size, progress, io_workers,
+                                        prefetch_batches, keep_originals, container,
+                                        sheet_format=sheet_format, tile_scaling=tile_scaling)
+    return record_data
+
+
+class FolderWatcher:
+    """监视文件夹，新照片写入完成后累积到满一批即合并，追加到已有的拼接输出
+    定期扫描目录比较文件大小和修改时间（stat快照），在 settle_time 秒内不再变化
+    才认为写入完成；已记录在 record.json 中的文件不会重复合并，重启后可继续
+    不足一批的图片会一直等待，直到凑满一批或调用 poll_once(flush=True)
+    文件只在所在批次写入 record.json 之后才算处理完；某一轮合并失败时这些图片重新排队，
+    下一轮再试，run() 不会因为一轮失败而退出
+    """
+    def __init__(self, src_dir, merge_count=6, spacing=0, max_size=DEFAULT_MAX_SIZE,
+                 split_by_orientation=DEFAULT_SPLIT_BY_ORIENTATION, keep_originals=False, dst_dir=None,
+                 poll_interval=DEFAULT_WATCH_POLL_INTERVAL, settle_time=DEFAULT_WATCH_SETTLE_TIME,
+                 progress=None):
+        if not src_dir or not os.path.isdir(src_dir):
+            raise JobError("请选择有效的源图片文件夹")
+        if merge_count not in MERGE_OPTIONS:
+            raise JobError(f"不支持的合并数量: {merge_count}，请选择 2,3,4,6,9")
+        self.src_dir = src_dir
+        self.merge_count = merge_count
+        self.spacing = spacing
+        self.max_size = max_size
+        self.split_by_orientation = split_by_orientation
+        self.keep_originals = keep_originals
+        self.dst_dir = dst_dir or os.path.join(src_dir, "merged_output")
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.progress = progress
+
+        self.record_file = os.path.join(self.dst_dir, "record.json")
+        self.record_data = load_record(self.record_file)
+        # 已处理过的文件（包括已合并和无法打开的）
+        self.seen = {pos["file"] for entry in self.record_data for pos in entry["positions"]}
+        # 已读取文件头、正在等待凑满一批或正在合并的文件
+        self._queued = set()
+        # 尚未稳定的文件：文件名 -> ((大小, 修改时间), 首次看到该状态的时间, 是否已稳定)
+        self._candidates = {}
+        # 等待凑满一批的图片
+        self._accumulator = BatchAccumulator(merge_count, split_by_orientation)
+
+    def scan(self, now=None):
+        """扫描一次源目录，返回已写入完成、尚未处理的文件名列表"""
+        now = time.time() if now is None else now
+        settled = []
+        present = set()
+        with os.scandir(self.src_dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if name in self.seen or name in self._queued or not name.lower().endswith(FILE_EXTENSIONS) \
+                        or not entry.is_file():
+                    continue
+                present.add(name)
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                previous = self._candidates.get(name)
+                if previous is None or previous[0] != signature:
+                    # 修改时间已经足够早的文件（例如启动前就在的）无需再等待
+                    self._candidates[name] = previous = (signature, now, now - stat.st_mtime >= self.settle_time)
+                if previous[2] or now - previous[1] >= self.settle_time:
+                    settled.append(name)
+        # 扫描期间被删除的文件不再跟踪
+        for name in list(self._candidates):
+            if name not in present:
+                del self._candidates[name]
+        return sorted(settled)
+
+    def _enqueue(self, name):
+        img_path = os.path.join(self.src_dir, name)
+        try:
+            img = SourceImage.from_path(img_path)
+        except Exception as e:
+            print(f"无法打开 {name}: {e}")
+            self.seen.add(name)
+            self._candidates.pop(name, None)
+            return
+        exif_data = {} if img.has_exif else extract_exif_data(img_path)
+        self._accumulator.add(img, name, exif_data)
+        self._queued.add(name)
+        self._candidates.pop(name, None)
+
+    def poll_once(self, flush=False, now=None):
+        """扫描并合并一轮，返回本轮新生成的合成图数量
+        合并失败时本轮的图片重新排队并抛出异常，已记录的数据不变
+        """
+        for name in self.scan(now):
+            self._enqueue(name)
+        batches = self._accumulator.take(last_sheet_index(self.record_data), flush)
+        if not batches:
+            return 0
+
+        new_records = []
+        recorded = len(self.record_data)
+        try:
+            os.makedirs(self.dst_dir, exist_ok=True)
+            exif_store = ExifBlobStore(os.path.join(self.dst_dir, EXIF_BLOB_FILE), append=True)
+            try:
+                run_merge_pipeline(batches, self.spacing, self.max_size, self.progress, self.dst_dir, new_records,
+                                   keep_originals=self.keep_originals, exif_store=exif_store)
+            finally:
+                exif_store.close()
+            self.record_data.extend(new_records)
+            save_record(self.record_file, self.record_data)
+        except BaseException:
+            # 记录没有写入：撤销本轮新增的记录，图片放回队列，下一轮重新合并
+            del self.record_data[recorded:]
+            self._accumulator.put_back(batches)
+            raise
+        # 批次中无法解码而被跳过的图片也标记为已处理，不再反复尝试
+        for batch in batches:
+            self._queued.difference_update(batch["filenames"])
+            self.seen.update(batch["filenames"])
+        print(f"已合并 {len(new_records)} 张拼接图，累计 {len(self.record_data)} 张")
+        return len(new_records)
+
+    def poll_safely(self, flush=False):
+        """poll_once，失败时打印原因后返回0，图片留在队列中等下一轮"""
+        try:
+            return self.poll_once(flush)
+        except Exception as e:
+            print(f"本轮拼接失败，下次扫描时重试: {e}")
+            return 0
 
-    dst_dir = os.path.join(src_dir, "merged_output")
-    os.makedirs(dst_dir, exist_ok=True)
-    record_file = os.path.join(dst_dir, "record.json")
+    def run(self, stop_event=None, flush_on_exit=False):
+        """持续监视，直到 stop_event 被设置或收到 Ctrl+C"""
+        stop_event = stop_event or threading.Event()
+        print(f"开始监视 {self.src_dir}，输出目录: {self.dst_dir}")
+        try:
+            while not stop_event.is_set():
+                self.poll_safely()
+                stop_event.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if flush_on_exit:
+                self.poll_safely(flush=True)
+            print("已停止监视")
+
+
+def write_manifest(job, manifest_path):
+    """分片执行第一步：只读取文件头，把 MergeJob 的批次划分写成确定的批次清单
+    清单中记录每个批次包含哪些文件、网格布局和拼接参数，各节点据此执行互不重叠的分片
+    """
+    if job.from_archive or job.container:
+        raise JobError("分片执行只支持文件夹来源和目录输出")
+    batches = job.plan()
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "src_dir": os.path.abspath(job.src_dir),
+        "dst_dir": os.path.abspath(job.dst_dir),
+        "spacing": job.spacing,
+        "max_size": job.max_size,
+        "keep_originals": job.keep_originals,
+        "sheet_format": job.sheet_format,
+        "tile_scaling": job.tile_scaling,
+        "batches": [{
+            "index": batch["index"],
+            "orientation": batch["orientation"],
+            "rows": batch["rows"],
+            "cols": batch["cols"],
+            "images": [{
+                "file": name,
+                "width": img.width,
+                "height": img.height,
+                "has_exif": img.has_exif,
+                "exif_data": exif,
+                "duplicates": img.duplicates,
+            } for img, name, exif in zip(batch["images"], batch["filenames"], batch["exif"])],
+        } for batch in batches],
+    }
+    save_record(manifest_path, manifest)
+    print(f"已生成批次清单 {manifest_path}，共 {len(batches)} 张拼接图")
+    return manifest
 
-    # 按横竖屏分类图片
-    portrait_images, landscape_images, portrait_exif, landscape_exif, portrait_filenames, landscape_filenames = \
-        categorize_images_by_orientation(src_dir)
 
-    if not portrait_images and not landscape_images:
-        messagebox.showerror("错误", "没有找到图片文件")
-        return
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        raise JobError(f"找不到批次清单: {manifest_path}")
+    manifest = load_record(manifest_path)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise JobError("批次清单版本不兼容，请重新生成")
+    return manifest
+
 
+def parse_shard(text):
+    """解析 "3/8" 形式的分片参数，返回 (分片序号, 分片总数)，序号从1开始"""
+    try:
+        shard, shard_count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise JobError("分片格式应为 i/n，例如 3/8")
+    if not 1 <= shard <= shard_count:
+        raise JobError(f"分片序号超出范围: {text}")
+    return shard, shard_count
+
+
+def execute_manifest(manifest_path, shard=1, shard_count=1, src_dir=None, dst_dir=None,
+                     io_workers=DEFAULT_IO_WORKERS, prefetch_batches=DEFAULT_PREFETCH_BATCHES,
+                     memory_budget_mb=DEFAULT_MERGE_MEMORY_BUDGET_MB, progress=None):
+    """分片执行第二步：执行批次清单中第 shard 个（共 shard_count 个）连续区间的批次
+    拼接图直接写入共享的输出目录；本分片的记录和EXIF旁路文件使用带分片标识的文件名，
+    全部分片完成后由 merge_shard_records 合并。src_dir/dst_dir 可覆盖清单中的路径（不同节点挂载点不同时）
+    返回本分片的记录数据
+    """
+    manifest = load_manifest(manifest_path)
+    src_dir = src_dir or manifest["src_dir"]
+    dst_dir = dst_dir or manifest["dst_dir"]
+    total = len(manifest["batches"])
+    start, end = total * (shard - 1) // shard_count, total * shard // shard_count
+
+    batches = []
+    for entry in manifest["batches"][start:end]:
+        images = []
+        for item in entry["images"]:
+            img = SourceImage(os.path.join(src_dir, *item["file"].split("/")), item["width"], item["height"])
+            img.has_exif = item["has_exif"]
+            img.duplicates = [tuple(dup) for dup in item["duplicates"]]
+            images.append(img)
+        batches.append(dict(entry, images=images,
+                            filenames=[item["file"] for item in entry["images"]],
+                            exif=[item["exif_data"] for item in entry["images"]]))
+
+    suffix = SHARD_NAME_FORMAT.format(shard, shard_count)
+    os.makedirs(dst_dir, exist_ok=True)
     record_data = []
-    total_batches = 0
-    processed_batches = 0
-    
-    if split_by_orientation:
-        # 处理竖屏图片
-        if portrait_images:
-            rows, cols = MERGE_OPTIONS[merge_count]["portrait"]
-            batch_size = rows * cols
-            total_portrait_batches = (len(portrait_images) + batch_size - 1) // batch_size
-            total_batches += total_portrait_batches
-            
-            processed_batches = merge_image_batches_optimized(
-                portrait_images, portrait_filenames, portrait_exif, 
-                rows, cols, spacing, max_size, progress_var,
-                dst_dir, record_data, "portrait", processed_batches
-            )
-        
-        # 处理横屏图片
-        if landscape_images:
-            rows, cols = MERGE_OPTIONS[merge_count]["landscape"]
-            batch_size = rows * cols
-            total_landscape_batches = (len(landscape_images) + batch_size - 1) // batch_size
-            total_batches += total_landscape_batches
-            
-            merge_image_batches_optimized(
-                landscape_images, landscape_filenames, landscape_exif, 
-                rows, cols, spacing, max_size, progress_var,
-                dst_dir, record_data, "landscape", processed_batches
-            )
+    exif_store = ExifBlobStore(os.path.join(dst_dir, f"exif_blobs.{suffix}.bin"))
+    try:
+        run_merge_pipeline(batches, manifest["spacing"], manifest["max_size"], progress, dst_dir, record_data,
+                           io_workers=io_workers, prefetch_batches=prefetch_batches,
+                           keep_originals=manifest["keep_originals"], exif_store=exif_store,
+                           memory_budget_mb=memory_budget_mb, largest_first=True,
+                           sheet_format=manifest.get("sheet_format", DEFAULT_SHEET_FORMAT),
+                           tile_scaling=manifest.get("tile_scaling", DEFAULT_TILE_SCALING))
+    finally:
+        exif_store.close()
+
+    # 分片记录最后写入，存在即表示该分片已全部完成
+    save_record(os.path.join(dst_dir, f"record.{suffix}.json"), record_data)
+    _report_progress(progress, 100)
+    if start < end:
+        print(f"分片 {shard}/{shard_count} 完成：第 {start + 1}~{end} 批，共 {len(record_data)} 张拼接图")
     else:
-        # 不按横竖屏分开拼接，混合处理所有图片
-        # 但仍然根据每张图片的方向选择合适的布局，尽量减少尺寸调整
-        all_images = portrait_images + landscape_images
-        all_filenames = portrait_filenames + landscape_filenames
-        all_exif = portrait_exif + landscape_exif
-        
-        # 为混合模式实现尽量最小化尺寸调整的逻辑
-        batch_size = merge_count
-        total_batches = (len(all_images) + batch_size - 1) // batch_size
-        
-        # 处理每个批次
-        processed_batches = 0
-        for i in range(0, len(all_images), batch_size):
-            batch_imgs = all_images[i:i + batch_size]
-            batch_names = all_filenames[i:i + batch_size]
-            batch_exif = all_exif[i:i + batch_size]
-            
-            # 分析当前批次中图片的方向分布
-            portrait_count = sum(1 for img in batch_imgs if is_portrait(img))
-            landscape_count = len(batch_imgs) - portrait_count
-            
-            # 选择合适的布局（基于方向分布）
-            # 如果竖屏图片占大多数，使用竖屏布局；否则使用横屏布局
-            if portrait_count > landscape_count:
-                rows, cols = MERGE_OPTIONS[merge_count]["portrait"]
-                layout_type = "mixed_portrait_preferred"
-            else:
-                rows, cols = MERGE_OPTIONS[merge_count]["landscape"]
-                layout_type = "mixed_landscape_preferred"
-            
-            # 调用批处理函数
-            merge_image_batches_optimized(
-                batch_imgs, batch_names, batch_exif, 
-                rows, cols, spacing, max_size, progress_var,
-                dst_dir, record_data, layout_type, processed_batches
-            )
-            
-            processed_batches += 1
-            progress_var.set(int(processed_batches / total_batches * 100))
-            root.update_idletasks()
-    
-    # 保存记录文件
-    with open(record_file, 'w', encoding='utf-8') as f:
-        json.dump(record_data, f, ensure_ascii=False, indent=4, cls=PILJSONEncoder)
-    
+        print(f"分片 {shard}/{shard_count} 没有分配到批次")
+    return record_data
+
+
+def merge_shard_records(manifest_path, dst_dir=None):
+    """分片执行第三步：按分片顺序合并各分片的记录和EXIF旁路文件，生成 split_images 使用的 record.json
+    所有分片都完成后才会合并；合并成功后删除分片文件。返回合并后的记录数据
+    """
+    manifest = load_manifest(manifest_path)
+    dst_dir = dst_dir or manifest["dst_dir"]
+    shard_counts = set()
+    if os.path.isdir(dst_dir):
+        for fname in os.listdir(dst_dir):
+            if fname.startswith("record.shard-") and fname.endswith(".json"):
+                shard_counts.add(int(fname[:-len(".json")].rsplit("-of-", 1)[1]))
+    if len(shard_counts) != 1:
+        raise JobError("输出目录中没有分片记录，或存在不同分片总数的记录")
+    shard_count = shard_counts.pop()
+    suffixes = [SHARD_NAME_FORMAT.format(shard, shard_count) for shard in range(1, shard_count + 1)]
+    missing = [str(shard) for shard, suffix in enumerate(suffixes, start=1)
+               if not os.path.exists(os.path.join(dst_dir, f"record.{suffix}.json"))]
+    if missing:
+        raise JobError(f"以下分片尚未完成: {', '.join(missing)}")
+
+    record_data = []
+    blob_file = os.path.join(dst_dir, EXIF_BLOB_FILE)
+    with open(blob_file + ".tmp", 'wb') as blob_out:
+        for suffix in suffixes:
+            # 各分片的EXIF偏移相对于自己的旁路文件，拼接后整体后移
+            base = blob_out.tell()
+            shard_blob = os.path.join(dst_dir, f"exif_blobs.{suffix}.bin")
+            if os.path.exists(shard_blob):
+                with open(shard_blob, 'rb') as f:
+                    shutil.copyfileobj(f, blob_out, HASH_CHUNK_SIZE)
+            for entry in load_record(os.path.join(dst_dir, f"record.{suffix}.json")):
+                for pos in entry["positions"]:
+                    if pos.get("exif_blob"):
+                        offset, length = pos["exif_blob"]
+                        pos["exif_blob"] = [base + offset, length]
+                record_data.append(entry)
+    if len(record_data) != len(manifest["batches"]):
+        print(f"警告：清单中有 {len(manifest['batches'])} 张拼接图，分片记录中只有 {len(record_data)} 张")
+    os.replace(blob_file + ".tmp", blob_file)
+    save_record(os.path.join(dst_dir, "record.json"), record_data)
+
+    for suffix in suffixes:
+        for fname in (f"record.{suffix}.json", f"exif_blobs.{suffix}.bin"):
+            if os.path.exists(os.path.join(dst_dir, fname)):
+                os.remove(os.path.join(dst_dir, fname))
+    print(f"已合并 {shard_count} 个分片的记录，共 {len(record_data)} 张拼接图")
+    return record_data
+
+
+def estimate_plan(batches, spacing, max_size, keep_originals=False, prefetch_batches=DEFAULT_PREFETCH_BATCHES,
+                  sheet_format=DEFAULT_SHEET_FORMAT, tile_scaling=DEFAULT_TILE_SCALING,
+                  memory_budget_mb=DEFAULT_MERGE_MEMORY_BUDGET_MB, io_workers=DEFAULT_IO_WORKERS,
+                  largest_first=False):
+    """根据批次中的图片尺寸预估拼接结果，布局计算与实际拼接使用同一个 layout_grid
+    每张拼接图：缩放前后的画布尺寸、缩放比例、每张原图实际的缩放比例、拼接时的内存峰值（RGB每像素3字节）
+    整体：流水线同时持有多个批次时的内存峰值、拼接图预估总大小、原图库大小
+    memory_budget_mb、io_workers、largest_first 与 run_merge_pipeline 相同，按同样的规则模拟批次的接纳
+    """
+    bytes_per_pixel = ESTIMATED_JPEG_BYTES_PER_PIXEL if sheet_format == "jpeg" else ESTIMATED_PNG_BYTES_PER_PIXEL
+    sheets = []
+    for batch in batches:
+        sizes = [(img.width, img.height) for img in batch["images"]]
+        source_bytes = sum(w * h * 3 for w, h in sizes)
+        if tile_scaling == "cell":
+            # 逐张缩放：画布直接是最终尺寸，缩放时只多出一张缩放后的图片
+            width, height, _, scaled, tile_scales = cell_layout(sizes, batch["rows"], batch["cols"],
+                                                                spacing, max_size)
+            out_width, out_height = width, height
+            scale = min(tile_scales, default=1.0)
+            output_bytes = max((w * h * 3 for (w, h), s in zip(scaled, tile_scales) if s < 1.0), default=0)
+            original_scales = [sw / w if w else 1.0 for (sw, _), (w, _) in zip(scaled, sizes)]
+        else:
+            width, height, _, scale = layout_grid(sizes, batch["rows"], batch["cols"], spacing, max_size)
+            out_width, out_height = (int(width * scale), int(height * scale)) if scale < 1.0 else (width, height)
+            output_bytes = out_width * out_height * 3 if scale < 1.0 else 0
+            original_scales = [int(w * scale) / w if w else 1.0 for w, _ in sizes]
+        canvas_bytes = width * height * 3
+        sheets.append({
+            "merged_file": merged_file_name(batch, sheet_format),
+            "canvas": [width, height],
+            "output": [out_width, out_height],
+            "scale": scale,
+            "originals": [{"file": name, "size": [w, h], "scale": original_scale}
+                          for name, (w, h), original_scale in zip(batch["filenames"], sizes, original_scales)],
+            "source_bytes": source_bytes,
+            "peak_memory": source_bytes + canvas_bytes + output_bytes,
+            "estimated_bytes": int(out_width * out_height * bytes_per_pixel),
+        })
+
+    order = list(range(len(sheets)))
+    if largest_first:
+        order = order_by_cost(order, lambda i: sheets[i]["peak_memory"])
+    pipeline_peak = simulate_pipeline_peak(
+        [sheets[i]["peak_memory"] for i in order],
+        [sheets[i]["output"][0] * sheets[i]["output"][1] * 3 for i in order],
+        prefetch_batches, memory_budget_mb, io_workers)
+
+    originals_bytes = 0
+    if keep_originals:
+        originals_bytes = sum(os.path.getsize(img.path) for batch in batches for img in batch["images"]
+                              if img.path and img.ext in ORIGINAL_EXTENSIONS)
+    return {
+        "total_sheets": len(sheets),
+        "total_images": sum(len(sheet["originals"]) for sheet in sheets),
+        "clamped_sheets": sum(1 for sheet in sheets if sheet["scale"] < 1.0),
+        "min_scale": min((sheet["scale"] for sheet in sheets), default=1.0),
+        "peak_memory": pipeline_peak,
+        "estimated_output_bytes": sum(sheet["estimated_bytes"] for sheet in sheets),
+        "originals_bytes": originals_bytes,
+        "sheets": sheets,
+    }
+
+
+def simulate_pipeline_peak(costs, output_bytes, prefetch_batches=DEFAULT_PREFETCH_BATCHES,
+                           memory_budget_mb=DEFAULT_MERGE_MEMORY_BUDGET_MB, io_workers=DEFAULT_IO_WORKERS):
+    """按 run_merge_pipeline 的接纳规则模拟流水线，返回预估的内存峰值
+    costs、output_bytes 按处理顺序给出每个批次的预估内存和拼接结果大小；
+    按写盘最慢的情况计算：编码队列和写盘线程中始终有最近的拼接图占用预算
+    """
+    budget_bytes = memory_budget_mb * 1024 * 1024 if memory_budget_mb else None
+    max_pending = (max(prefetch_batches, io_workers) if memory_budget_mb else prefetch_batches) + 1
+    pending = deque()
+    writing = deque()
+    held = 0
+    peak = 0
+    upcoming = 0
+    while upcoming < len(costs) or pending:
+        # 与 prefetch() 相同：数量未满且预算允许（或流水线为空）时接纳下一个批次
+        while upcoming < len(costs) and len(pending) < max_pending:
+            cost = costs[upcoming]
+            if pending and budget_bytes and held + cost > budget_bytes:
+                break
+            pending.append(upcoming)
+            held += cost
+            upcoming += 1
+        # 拼接当前批次时，所有已接纳批次和等待写盘的拼接图同时占用内存
+        peak = max(peak, held)
+        current = pending.popleft()
+        held += output_bytes[current] - costs[current]
+        writing.append(output_bytes[current])
+        if len(writing) > DEFAULT_ENCODE_QUEUE_SIZE + 1:
+            held -= writing.popleft()
+    return peak
+
+
+def format_bytes(size):
+    """把字节数格式化为便于阅读的字符串"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def print_plan_report(report, details=False):
+    """在命令行输出预估结果，details 为真时逐张列出拼接图"""
+    if details:
+        for sheet in report["sheets"]:
+            canvas, output = sheet["canvas"], sheet["output"]
+            print(f"{sheet['merged_file']}: {len(sheet['originals'])} 张，画布 {canvas[0]}x{canvas[1]}"
+                  f" -> {output[0]}x{output[1]}，缩放 {sheet['scale']:.3f}，"
+                  f"内存峰值 {format_bytes(sheet['peak_memory'])}，预估 {format_bytes(sheet['estimated_bytes'])}")
+    print(f"共 {report['total_images']} 张图片，将生成 {report['total_sheets']} 张拼接图，"
+          f"其中 {report['clamped_sheets']} 张超过最大尺寸需要缩放（最小缩放 {report['min_scale']:.3f}）")
+    print(f"流水线内存峰值约 {format_bytes(report['peak_memory'])}，"
+          f"拼接图预估共 {format_bytes(report['estimated_output_bytes'])}")
+    if report["originals_bytes"]:
+        print(f"原图库约 {format_bytes(report['originals_bytes'])}")
+
+
+def merge_images_grid(src_dir, merge_count, spacing, max_size, progress_var, split_by_orientation=True,
+                      keep_originals=False, dedup=False, recursive=False, per_folder=False):
+    """界面入口：按横竖屏分类合并图片
+    src_dir: 源图片目录
+    merge_count: 每张合并图片包含的图片数量（2,3,4,6,9）
+    spacing: 图片间距
+    max_size: 最大尺寸限制
+    progress_var: 进度条变量
+    split_by_orientation: 是否将横竖屏分开拼接
+    keep_originals: 是否把JPEG原图存入原图库，拆分时无水印则原样还原
+    dedup: 是否去除内容完全相同的重复图片（重复图片共用一个拼接位置）
+    recursive: 是否包含子文件夹
+    per_folder: 每个子文件夹单独拼接
+    """
+    job = MergeJob(src_dir, merge_count, spacing, max_size, split_by_orientation,
+                   keep_originals=keep_originals, dedup=dedup, recursive=recursive, per_folder=per_folder,
+                   progress=gui_progress(progress_var))
+    try:
+        dst_dir = job.run()
+    except JobError as e:
+        messagebox.showerror("错误", str(e))
+        return
+
     progress_var.set(100)
     messagebox.showinfo("完成", f"拼接完成，输出目录: {dst_dir}")
-    
+
+
+def plan_image_batches(images, filenames, exif_metadata, rows, cols, orientation, start_index):
+    """把一组图片按网格容量切分为批次
+    返回批次列表，每个批次记录批次序号、布局和其中的图片，供合并流水线使用
+    """
+    batch_size = rows * cols
+    batches = []
+    for idx in range(0, len(images), batch_size):
+        batches.append({
+            "index": start_index + (idx // batch_size) + 1,
+            "orientation": orientation,
+            "rows": rows,
+            "cols": cols,
+            "images": images[idx:idx + batch_size],
+            "filenames": filenames[idx:idx + batch_size],
+            "exif": [exif_metadata[i] if i < len(exif_metadata) else {}
+                     for i in range(idx, min(idx + batch_size, len(images)))],
+        })
+    return batches
+
+
+def merged_file_name(batch, sheet_format=DEFAULT_SHEET_FORMAT):
+    """生成带方向标识的拼接图文件名"""
+    return f"merged_{batch['orientation']}_{batch['index']:04d}{SHEET_FORMATS[sheet_format]}"
+
+
+def layout_grid(sizes, rows, cols, spacing, max_size):
+    """只根据图片尺寸计算网格布局，不需要像素数据
+    sizes: 按批次顺序的 [(宽, 高), ...]
+    返回 (画布宽, 画布高, 每张图片左上角 [(x, y), ...], 缩放比例)
+    """
+    # 计算每列最大宽度，每行最大高度（网格尺寸）
+    col_widths = [max((w for w, _ in sizes[i::cols]), default=0) for i in range(cols)]
+    row_heights = [max((h for _, h in sizes[r*cols:(r+1)*cols]), default=0) for r in range(rows)]
+
+    total_width = sum(col_widths) + (cols - 1) * spacing
+    total_height = sum(row_heights) + (rows - 1) * spacing
+
+    offsets = []
+    y_offset = 0
+    for r in range(rows):
+        x_offset = 0
+        for c in range(cols):
+            if r * cols + c < len(sizes):
+                offsets.append((x_offset, y_offset))
+            x_offset += col_widths[c] + spacing
+        y_offset += row_heights[r] + spacing
+
+    # 限制合成图最大宽高 max_size，超过则整体缩放
+    scale = min(max_size / total_width, max_size / total_height, 1.0)
+    return total_width, total_height, offsets, scale
+
+
+def align_layout(sizes, rows, cols, spacing, align):
+    """与 layout_grid 相同的网格，但每张图片的左上角对齐到 align 像素的整数倍
+    （列宽、行高加上间距后向上取整，最后一列/行不填充）
+    sizes 为最终（已缩放）的尺寸，返回 (画布宽, 画布高, 每张图片左上角 [(x, y), ...])
+    """
+    col_widths = [max((w for w, _ in sizes[i::cols]), default=0) for i in range(cols)]
+    row_heights = [max((h for _, h in sizes[r*cols:(r+1)*cols]), default=0) for r in range(rows)]
+
+    def aligned_starts(lengths):
+        starts = [0]
+        for length in lengths[:-1]:
+            starts.append(starts[-1] + -(-(length + spacing) // align) * align)
+        return starts
+
+    col_x = aligned_starts(col_widths)
+    row_y = aligned_starts(row_heights)
+    offsets = [(col_x[i % cols], row_y[i // cols]) for i in range(len(sizes))]
+    return col_x[-1] + col_widths[-1], row_y[-1] + row_heights[-1], offsets
+
+
+def cell_layout(sizes, rows, cols, spacing, max_size):
+    """逐张缩放：把 max_size 按行列数平均分成统一的单元格，每张图片单独缩小到能放进单元格（不放大），
+    再用 layout_grid 排列缩放后的尺寸，画布不会超过 max_size；
+    原尺寸的网格本来就不超过 max_size 时不缩放任何图片，与整体缩放的布局相同
+    返回 (画布宽, 画布高, 每张图片左上角 [(x, y), ...], 缩放后的尺寸, 每张图片的缩放比例)
+    """
+    total_width, total_height, offsets, scale = layout_grid(sizes, rows, cols, spacing, max_size)
+    if scale >= 1.0:
+        return total_width, total_height, offsets, list(sizes), [1.0] * len(sizes)
+    cell_width = max(1, (max_size - (cols - 1) * spacing) // cols)
+    cell_height = max(1, (max_size - (rows - 1) * spacing) // rows)
+    scales = [min(cell_width / w, cell_height / h, 1.0) if w and h else 1.0 for w, h in sizes]
+    scaled = [(max(1, int(w * s)), max(1, int(h * s))) for (w, h), s in zip(sizes, scales)]
+    total_width, total_height, offsets, _ = layout_grid(scaled, rows, cols, spacing, max_size)
+    return total_width, total_height, offsets, scaled, scales
+
+
+class CanvasPool:
+    """拼接画布池：尺寸相同的批次之间复用画布，取出时重新填充白色背景而不是重新分配内存，
+    避免每批都分配和释放几百MB的内存（以及随之而来的缺页开销）
+    只回收由本池分配的画布，最多保留 max_idle 张空闲画布；拼接线程取出、写盘线程归还，线程安全
+    budget: MemoryBudget，不为空时空闲画布占用预算（取出复用时归还，此后由批次的预估覆盖），
+        预算不足以接纳新批次时用 evict() 丢弃全部空闲画布
+    """
+    def __init__(self, max_idle=DEFAULT_CANVAS_POOL_SIZE, color=(255, 255, 255), budget=None):
+        self.max_idle = max_idle
+        self.color = color
+        self.budget = budget
+        self.reused = 0
+        self._idle = deque()
+        # id(画布) -> 弱引用；Image 定义了按像素比较的 __eq__，不能放进集合，也不能用 deque.remove 查找
+        self._owned = {}
+        self._lock = threading.Lock()
+
+    def owns(self, canvas):
+        ref = self._owned.get(id(canvas))
+        return ref is not None and ref() is canvas
+
+    def acquire(self, size):
+        """取出一张指定尺寸、已填充背景色的RGB画布"""
+        canvas = None
+        with self._lock:
+            for i, idle in enumerate(self._idle):
+                if idle.size == size:
+                    canvas = idle
+                    del self._idle[i]
+                    self.reused += 1
+                    self._release_budget(canvas)
+                    break
+        if canvas is None:
+            canvas = Image.new('RGB', size, color=self.color)
+            key = id(canvas)
+            with self._lock:
+                self._owned[key] = weakref.ref(canvas, lambda _: self._owned.pop(key, None))
+        else:
+            canvas.paste(self.color, (0, 0) + size)
+        return canvas
+
+    def release(self, canvas):
+        """归还画布；不是本池分配的画布直接忽略，空闲画布过多时丢弃最早归还的"""
+        with self._lock:
+            if not self.owns(canvas) or any(idle is canvas for idle in self._idle):
+                return
+            self._idle.append(canvas)
+            if self.budget is not None:
+                self.budget.acquire(canvas.width * canvas.height * 3)
+            while len(self._idle) > self.max_idle:
+                self._release_budget(self._idle.popleft())
+
+    def evict(self):
+        """丢弃全部空闲画布并归还其占用的预算，返回是否丢弃了画布"""
+        with self._lock:
+            evicted = bool(self._idle)
+            while self._idle:
+                self._release_budget(self._idle.popleft())
+        return evicted
+
+    def _release_budget(self, canvas):
+        if self.budget is not None:
+            self.budget.release(canvas.width * canvas.height * 3)
+
+
+def compose_batch(batch, loaded_images, spacing, max_size, align=0, tile_scaling=DEFAULT_TILE_SCALING,
+                  pool=None):
+    """把一个批次已解码的图片拼接到画布上
+    align: 大于0时每张图片的左上角对齐到 align 像素的整数倍（JPEG拼接图按MCU对齐），
+        此时各图片先按整体缩放比例单独缩放，再放到对齐后的位置上，画布不再整体缩放
+    tile_scaling: 见 TILE_SCALING_MODES；cell 时每张图片按 cell_layout 单独缩放，
+        位置记录中的 scale 为该图片自己的缩放比例
+    pool: CanvasPool，不为空时从中取画布；整体缩放后缩放前的画布立即归还，返回的合成图写盘后由调用方归还
+    返回 (合成图, 位置列表, 缩放比例)，逐张缩放时缩放比例为各图片中最小的一个
+    """
+    batch_imgs = loaded_images
+    sizes = [img.size for img in batch_imgs]
+    rows, cols = batch["rows"], batch["cols"]
+    # 对齐填充让每行/每列最多多出 align-1 像素，计算缩放比例时预留这部分余量
+    margin = (max(rows, cols) - 1) * (align - 1) if align else 0
+    if tile_scaling == "cell":
+        total_width, total_height, offsets, sizes, tile_scales = cell_layout(
+            sizes, rows, cols, spacing, max_size - margin)
+        scale = min(tile_scales, default=1.0)
+    elif align:
+        _, _, _, scale = layout_grid(sizes, rows, cols, spacing, max_size - margin)
+        if scale < 1.0:
+            sizes = [(max(1, int(w * scale)), max(1, int(h * scale))) for w, h in sizes]
+            spacing = int(spacing * scale)
+        tile_scales = [scale] * len(sizes)
+    else:
+        total_width, total_height, offsets, scale = layout_grid(sizes, rows, cols, spacing, max_size)
+        tile_scales = [scale] * len(sizes)
+    if align:
+        total_width, total_height, offsets = align_layout(sizes, rows, cols, spacing, align)
+
+    if pool is not None:
+        merged = pool.acquire((total_width, total_height))
+    else:
+        merged = Image.new('RGB', (total_width, total_height), color=(255, 255, 255))
+
+    positions = []
+    for idx_in_batch, (im, size, (x_offset, y_offset)) in enumerate(zip(batch_imgs, sizes, offsets)):
+        if im.size != size:
+            im = im.resize(size, Image.LANCZOS)
+        merged.paste(im, (x_offset, y_offset))
+        positions.append({
+            "file": batch["filenames"][idx_in_batch],
+            "x": x_offset,
+            "y": y_offset,
+            "w": im.width,
+            "h": im.height,
+            "scale": tile_scales[idx_in_batch],
+            "exif_data": batch["exif"][idx_in_batch]
+        })
+
+    w, h = merged.size
+    if scale < 1.0 and not align and tile_scaling != "cell":
+        new_w = int(w * scale)
+        new_h = int(h * scale)
+        canvas = merged
+        merged = merged.resize((new_w, new_h), Image.LANCZOS)
+        if pool is not None:
+            pool.release(canvas)
+        for pos in positions:
+            pos["x"] = int(pos["x"] * scale)
+            pos["y"] = int(pos["y"] * scale)
+            pos["w"] = int(pos["w"] * scale)
+            pos["h"] = int(pos["h"] * scale)
+
+    return merged, positions, scale
+
+
+def order_by_cost(items, cost_fn):
+    """按预估代价从大到小排列（最长处理时间优先），代价相同时保持原顺序，结果是确定的"""
+    return sorted(items, key=cost_fn, reverse=True)
+
+
+def current_rss():
+    """当前进程的常驻内存（字节），无法获取时返回None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+
+def estimate_batch_bytes(batch, spacing, max_size, tile_scaling=DEFAULT_TILE_SCALING):
+    """只根据文件头预估一个批次拼接时的内存占用：解码后的源图片 + 画布 + 缩放后的画布（RGB每像素3字节）
+    逐张缩放时画布已是最终尺寸，有图片需要缩小时另外只多出一张缩放后的图片
+    """
+    sizes = [(img.width, img.height) for img in batch["images"]]
+    if tile_scaling == "cell":
+        width, height, _, scaled, scales = cell_layout(sizes, batch["rows"], batch["cols"], spacing, max_size)
+        resized_bytes = max((w * h * 3 for (w, h), s in zip(scaled, scales) if s < 1.0), default=0)
+        return sum(w * h * 3 for w, h in sizes) + width * height * 3 + resized_bytes
+    width, height, _, scale = layout_grid(sizes, batch["rows"], batch["cols"], spacing, max_size)
+    output_bytes = int(width * scale) * int(height * scale) * 3 if scale < 1.0 else 0
+    return sum(w * h * 3 for w, h in sizes) + width * height * 3 + output_bytes
+
+
+class MemoryBudget:
+    """按预估内存占用决定是否再接纳一个批次进入流水线
+    每个批次拼接完成时（内存占用最高的时刻）采样进程常驻内存，实际增长超过预估时
+    按比例放大之后的预估值，使并发度自动收敛到预算之内；无法采样时只使用预估值
+    等待写盘的拼接图由写盘线程释放，因此各方法都可以在多个线程中调用
+    同一进程中的多个流水线应共用一个预算（见 JobManager），否则每个流水线都会把其他流水线的内存
+    算作自己的增长；进程中还有使用其他预算的流水线时不做修正，只使用预估值
+    """
+    # 进程中正在运行的合并流水线数（所有预算合计）
+    _active_lock = threading.Lock()
+    _active_pipelines = 0
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.held = 0
+        self.correction = 1.0
+        self.pipelines = 0
+        self._baseline = current_rss()
+        self._lock = threading.Lock()
+
+    def enter(self):
+        """一个使用该预算的流水线开始运行；第一个流水线开始时重新记录基准内存"""
+        with MemoryBudget._active_lock:
+            MemoryBudget._active_pipelines += 1
+        with self._lock:
+            if self.pipelines == 0:
+                self._baseline = current_rss()
+            self.pipelines += 1
+
+    def exit(self):
+        with self._lock:
+            self.pipelines -= 1
+        with MemoryBudget._active_lock:
+            MemoryBudget._active_pipelines -= 1
+
+    def admits(self, cost, idle):
+        """idle 为真（流水线中没有批次）时总是接纳，保证处理能继续"""
+        if idle or not self.budget_bytes:
+            return True
+        with self._lock:
+            return (self.held + cost) * self.correction <= self.budget_bytes
+
+    def acquire(self, cost):
+        with self._lock:
+            self.held += cost
+
+    def release(self, cost):
+        with self._lock:
+            self.held -= cost
+
+    def sample(self):
+        rss = current_rss()
+        with MemoryBudget._active_lock:
+            active = MemoryBudget._active_pipelines
+        with self._lock:
+            if rss is None or self._baseline is None or self.held <= 0 or self.pipelines < active:
+                return
+            ratio = (rss - self._baseline) / self.held
+            self.correction = min(max(1.0, (self.correction + ratio) / 2), MAX_MEMORY_CORRECTION)
+
+
+def run_merge_pipeline(batches, spacing, max_size, progress, dst_dir, record_data,
+                       io_workers=DEFAULT_IO_WORKERS, prefetch_batches=DEFAULT_PREFETCH_BATCHES,
+                       keep_originals=False, exif_store=None, container=None,
+                       memory_budget_mb=DEFAULT_MERGE_MEMORY_BUDGET_MB, largest_first=False,
+                       sheet_format=DEFAULT_SHEET_FORMAT, tile_scaling=DEFAULT_TILE_SCALING,
+                       canvas_pool_size=DEFAULT_CANVAS_POOL_SIZE, memory_budget=None):
+    """三级流水线执行合并：读取解码 -> 拼接缩放 -> 编码写盘
+    读取线程池提前解码后续批次的源图片，
+    拼接在当前线程按批次顺序进行（保证文件名和记录顺序确定），
+    编码和写盘由单独的线程完成，各级之间通过有界队列限制内存占用
+    memory_budget_mb: 处理中批次的预估内存上限，按文件头尺寸预估并以实际常驻内存修正；
+        预算允许时最多预读 max(prefetch_batches, io_workers) 个批次，为空时固定预读 prefetch_batches 个
+    largest_first: 按预估处理量从大到小处理批次（batches 为列表时），避免最大的批次最后单独运行；
+        文件名仍按批次序号生成，record_data 中新增的记录也按批次序号排列
+    progress: 进度回调，参数为0~100的整数，可为空
+    keep_originals: 读取阶段同时把JPEG原图存入原图库
+    batches 可以是列表，也可以是按需生成批次的迭代器
+    exif_store: 原始EXIF块写入的旁路文件，为空时追加到 dst_dir 下的 exif_blobs.bin
+    container: ContainerWriter，不为空时拼接图和原图写入容器而不是 dst_dir
+    sheet_format: 拼接图格式，见 SHEET_FORMATS；jpeg 时图片位置按MCU对齐，记录中写入 mcu_align
+    tile_scaling: 超过 max_size 时的缩放方式，见 TILE_SCALING_MODES
+    canvas_pool_size: 批次之间复用的空闲画布数，为0时每批重新分配
+    memory_budget: 多个流水线共用的 MemoryBudget，不为空时代替 memory_budget_mb
+    """
+    if not batches:
+        return
+
+    align = JPEG_MCU_SIZE if sheet_format == "jpeg" else 0
+
+    if largest_first and isinstance(batches, list):
+        batches = order_by_cost(batches, lambda batch: estimate_batch_bytes(batch, spacing, max_size, tile_scaling))
+
+    own_exif_store = exif_store is None
+    if own_exif_store:
+        exif_store = ExifBlobStore(os.path.join(dst_dir, EXIF_BLOB_FILE), append=True)
+
+    encode_queue = queue.Queue(maxsize=DEFAULT_ENCODE_QUEUE_SIZE)
+    writer_errors = []
+    budget = memory_budget or MemoryBudget(memory_budget_mb * 1024 * 1024 if memory_budget_mb else None)
+    pool = CanvasPool(canvas_pool_size, budget=budget) if canvas_pool_size else None
+
+    def writer():
+        while True:
+            item = encode_queue.get()
+            if item is None:
+                break
+            merged, merged_name, merged_bytes = item
+            if writer_errors:
+                merged = None
+                budget.release(merged_bytes)
+                continue
+            try:
+                if container is None:
+                    save_sheet(merged, os.path.join(dst_dir, merged_name), sheet_format)
+                else:
+                    buffer = io.BytesIO()
+                    save_sheet(merged, buffer, sheet_format)
+                    container.write_bytes(merged_name, buffer.getvalue())
+            except Exception as e:
+                writer_errors.append(e)
+            finally:
+                # 写盘结束后画布回到画布池，并释放这张拼接图占用的预算
+                if pool is not None:
+                    pool.release(merged)
+                merged = None
+                budget.release(merged_bytes)
+
+    writer_thread = threading.Thread(target=writer, name="merge-writer", daemon=True)
+    writer_thread.start()
+
+    # batches 也可以是按需生成批次的迭代器，此时总数未知，不报告进度
+    total_batches = len(batches) if hasattr(batches, "__len__") else None
+    readers = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="merge-reader")
+    # 预读队列：每项是一个批次、其预估内存及所有图片的解码任务
+    upcoming = iter(batches)
+    pending = deque()
+    max_pending = (max(prefetch_batches, io_workers) if budget.budget_bytes else prefetch_batches) + 1
+    # 预算不足时暂缓提交的批次
+    deferred = []
+
+    def prefetch():
+        """在数量和内存预算允许的范围内继续提交批次"""
+        while len(pending) < max_pending:
+            if not deferred:
+                batch = next(upcoming, None)
+                if batch is None:
+                    return
+                deferred.append((batch, estimate_batch_bytes(batch, spacing, max_size, tile_scaling)))
+            batch, cost = deferred[0]
+            if not budget.admits(cost, idle=not pending):
+                # 空闲画布占用的预算先让给新批次
+                if pool is None or not pool.evict() or not budget.admits(cost, idle=not pending):
+                    return
+            deferred.pop()
+            budget.acquire(cost)
+            # 批次内尺寸最大的图片最先开始解码
+            futures = [None] * len(batch["images"])
+            for i in order_by_cost(range(len(futures)), lambda i: batch["images"][i].width * batch["images"][i].height):
+                futures[i] = readers.submit(read_source, batch["images"][i], dst_dir, keep_originals, container,
+                                            batch["filenames"][i])
+            pending.append((batch, cost, futures))
+
+    finished = []
+    budget.enter()
+    try:
+        prefetch()
+        done = 0
+        while pending:
+            batch, cost, futures = pending[0]
+
+            results = [future.result() for future in futures]
+            # 无法解码的图片从批次中去掉（布局和记录都不包含它），其余图片照常拼接
+            kept = [i for i, (image, _, _) in enumerate(results) if image is not None]
+            if len(kept) < len(results):
+                batch = dict(batch, images=[batch["images"][i] for i in kept],
+                             filenames=[batch["filenames"][i] for i in kept],
+                             exif=[batch["exif"][i] for i in kept])
+                results = [results[i] for i in kept]
+            if not results:
+                pending.popleft()
+                budget.release(cost)
+                prefetch()
+                done += 1
+                if total_batches:
+                    _report_progress(progress, done / total_batches * 100)
+                continue
+
+            loaded, original_refs, exif_blobs = zip(*results)
+            del results
+            merged, positions, scale = compose_batch(batch, list(loaded), spacing, max_size, align, tile_scaling, pool)
+            budget.sample()
+            del loaded
+            pending.popleft()
+            # 源图片和缩放前的画布已释放，只有拼接结果继续占用预算直到写盘完成
+            merged_bytes = merged.width * merged.height * 3
+            budget.acquire(merged_bytes)
+            budget.release(cost)
+            prefetch()
+            for pos, ref, exif_blob in zip(positions, original_refs, exif_blobs):
+                if ref:
+                    pos["original"] = ref
+                if exif_blob:
+                    pos["exif_blob"] = exif_store.add(exif_blob)
+            # 重复图片与首个相同图片共用拼接位置
+            for pos, img in zip(list(positions), batch["images"]):
+                for dup_name, dup_exif in img.duplicates:
+                    dup_pos = dict(pos, file=dup_name, exif_data=dup_exif, duplicate_of=pos["file"])
+                    positions.append(dup_pos)
+
+            # 生成带方向标识的文件名
+            merged_name = merged_file_name(batch, sheet_format)
+            encode_queue.put((merged, merged_name, merged_bytes))
+            if writer_errors:
+                raise writer_errors[0]
+
+            entry = {
+                "merged_file": merged_name,
+                "positions": positions,
+                "spacing": spacing,
+                "rows": batch["rows"],
+                "cols": batch["cols"],
+                "scale": scale,
+                "orientation": batch["orientation"]
+            }
+            if align:
+                entry["mcu_align"] = align
+            if tile_scaling != DEFAULT_TILE_SCALING:
+                entry["tile_scaling"] = tile_scaling
+            finished.append((batch["index"], entry))
+
+            done += 1
+            if total_batches:
+                _report_progress(progress, done / total_batches * 100)
+
+        # 记录按批次序号排列，与处理顺序无关
+        record_data.extend(entry for _, entry in sorted(finished, key=lambda item: item[0]))
+    finally:
+        # 出错时取消尚未开始的预读任务，并等待写盘线程处理完已拼接好的图片
+        readers.shutdown(wait=True, cancel_futures=True)
+        encode_queue.put(None)
+        writer_thread.join()
+        if pool is not None:
+            pool.evict()
+        budget.exit()
+        if own_exif_store:
+            exif_store.close()
+
+    if writer_errors:
+        raise writer_errors[0]
+
+
+def save_sheet(merged, fp, sheet_format):
+    """按拼接图格式编码并写入，fp 可以是文件路径或文件对象"""
+    if sheet_format == "jpeg":
+        merged.save(fp, "JPEG", **SHEET_JPEG_OPTIONS)
+    else:
+        merged.save(fp, "PNG")
+
 
 def merge_image_batches_optimized(images, filenames, exif_metadata, rows, cols, spacing, max_size, 
-                        progress_var, dst_dir, record_data, orientation, start_index):
+                        progress, dst_dir, record_data, orientation, start_index, keep_originals=False,
+                        sheet_format=DEFAULT_SHEET_FORMAT, tile_scaling=DEFAULT_TILE_SCALING):
     """批量合并一组图片
     images: 图片列表
     filenames: 文件名列表
@@ -316,202 +2175,659 @@ def merge_image_batches_optimized(images, filenames, exif_metadata, rows, cols,
     rows, cols: 网格行列数
     spacing: 图片间距
     max_size: 最大尺寸限制
-    progress_var: 进度条变量
+    progress: 进度回调（0~100），可为空
     dst_dir: 输出目录
     record_data: 记录数据列表
     orientation: 方向标识（portrait或landscape）
     start_index: 起始批次索引
+    keep_originals: 是否把JPEG原图存入原图库
+    sheet_format: 拼接图格式（png 或 jpeg），jpeg 时图片位置按MCU对齐，拆分时可无损裁剪
+    tile_scaling: 超过 max_size 时整张缩放（canvas）还是逐张缩放到统一单元格（cell）
     """
-    idx = 0
-    batch_size = rows * cols
-    total_batches = (len(images) + batch_size - 1) // batch_size
-    
-    while idx < len(images):
-        batch_imgs = images[idx:idx + batch_size]
-        batch_names = filenames[idx:idx + batch_size]
+    batches = plan_image_batches(images, filenames, exif_metadata, rows, cols, orientation, start_index)
+    run_merge_pipeline(batches, spacing, max_size, progress, dst_dir, record_data,
+                       keep_originals=keep_originals, sheet_format=sheet_format, tile_scaling=tile_scaling)
+    return start_index + len(batches)
 
-        # 计算每列最大宽度，每行最大高度（网格尺寸）
-        col_widths = [max((img.width for img in batch_imgs[i::cols]), default=0) for i in range(cols)]
-        row_heights = [max((img.height for img in batch_imgs[r*cols:(r+1)*cols]), default=0) for r in range(rows)]
 
-        total_width = sum(col_widths) + (cols - 1) * spacing
-        total_height = sum(row_heights) + (rows - 1) * spacing
+class WatermarkCache:
+    """水印缓存：每个水印文件只读取一次，缩放并调整透明度后的结果按尺寸缓存
+    线程安全，多个拆分任务可以共用同一个实例
+    """
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._sources = {}
+        self._prepared = OrderedDict()
+        # id(缩放好的水印) -> (水印, 预乘后的RGB, 255-alpha)，随缩放结果一起淘汰
+        self._premultiplied = {}
+        self._lock = threading.Lock()
+
+    def get(self, watermark_path, target_width, opacity):
+        stat = os.stat(watermark_path)
+        key = (watermark_path, stat.st_mtime_ns, target_width, opacity)
+        with self._lock:
+            watermark = self._prepared.get(key)
+            if watermark is not None:
+                self._prepared.move_to_end(key)
+                return watermark
+            source_key = (watermark_path, stat.st_mtime_ns)
+            source = self._sources.get(source_key)
+            if source is None:
+                source = self._sources[source_key] = Image.open(watermark_path).convert("RGBA")
+            watermark = prepare_watermark(source, target_width, opacity)
+            self._prepared[key] = watermark
+            while len(self._prepared) > self.max_entries:
+                _, evicted = self._prepared.popitem(last=False)
+                self._premultiplied.pop(id(evicted), None)
+            return watermark
+
+    def premultiplied(self, watermark):
+        """返回 get() 所得水印的预乘alpha数组，每个水印只计算一次"""
+        with self._lock:
+            entry = self._premultiplied.get(id(watermark))
+            if entry is None or entry[0] is not watermark:
+                entry = (watermark,) + premultiply_watermark(watermark)
+                if any(cached is watermark for cached in self._prepared.values()):
+                    self._premultiplied[id(watermark)] = entry
+            return entry[1], entry[2]
+
+
+def premultiply_watermark(watermark):
+    """把RGBA水印转为 (RGB*alpha, 255-alpha) 两个uint16数组，混合时只需一次乘加"""
+    pixels = np.asarray(watermark, dtype=np.uint16)
+    alpha = pixels[..., 3:4]
+    return pixels[..., :3] * alpha, 255 - alpha
+
+
+def blend_watermark(image, watermark, x, y, clip=None, mode=DEFAULT_WATERMARK_BLEND, cache=None):
+    """把RGBA水印原地混合到RGB图片的 (x, y) 处，只读写水印与 clip 区域的交集，其余像素不动
+    clip: (左, 上, 右, 下)，水印超出的部分被裁掉，默认为整张图片
+    mode: "pillow" 或 "numpy"（预乘alpha、uint16运算）；未安装numpy时使用pillow
+    """
+    clip_left, clip_top, clip_right, clip_bottom = clip or (0, 0, image.width, image.height)
+    left, top = max(x, clip_left), max(y, clip_top)
+    right, bottom = min(x + watermark.width, clip_right), min(y + watermark.height, clip_bottom)
+    if right <= left or bottom <= top:
+        return image
+    inner = (left - x, top - y, right - x, bottom - y)
+
+    if mode == "numpy" and np is not None:
+        premultiplied, inverse_alpha = (cache.premultiplied(watermark) if cache is not None
+                                        else premultiply_watermark(watermark))
+        rows, cols = slice(inner[1], inner[3]), slice(inner[0], inner[2])
+        region = np.asarray(image.crop((left, top, right, bottom)), dtype=np.uint16)
+        # 预乘后：结果 = 水印RGB*alpha + 背景*(255-alpha)，除以255并四舍五入
+        blended = (premultiplied[rows, cols] + region * inverse_alpha[rows, cols] + 127) // 255
+        image.paste(Image.fromarray(blended.astype(np.uint8), "RGB"), (left, top))
+        return image
 
-        merged = Image.new('RGB', (total_width, total_height), color=(255, 255, 255))
+    if inner != (0, 0, watermark.width, watermark.height):
+        watermark = watermark.crop(inner)
+    image.paste(watermark, (left, top), watermark)
+    return image
 
-        positions = []
-        y_offset = 0
-        for r in range(rows):
-            x_offset = 0
-            for c in range(cols):
-                idx_in_batch = r * cols + c
-                if idx_in_batch < len(batch_imgs):
-                    im = batch_imgs[idx_in_batch]
-                    merged.paste(im, (x_offset, y_offset))
-                    # 获取对应图片的EXIF数据
-                    img_idx = idx + idx_in_batch
-                    exif_data = exif_metadata[img_idx] if img_idx < len(exif_metadata) else {}
-                    
-                    positions.append({
-                        "file": batch_names[idx_in_batch],
-                        "x": x_offset,
-                        "y": y_offset,
-                        "w": im.width,
-                        "h": im.height,
-                        "exif_data": exif_data
-                    })
-                x_offset += col_widths[c] + spacing
-            y_offset += row_heights[r] + spacing
-
-        # 限制合成图最大宽高 max_size，超过则整体缩放
-        w, h = merged.size
-        scale = min(max_size / w, max_size / h, 1.0)
-        if scale < 1.0:
-            new_w = int(w * scale)
-            new_h = int(h * scale)
-            merged = merged.resize((new_w, new_h), Image.LANCZOS)
-            for pos in positions:
-                pos["x"] = int(pos["x"] * scale)
-                pos["y"] = int(pos["y"] * scale)
-                pos["w"] = int(pos["w"] * scale)
-                pos["h"] = int(pos["h"] * scale)
-
-        # 生成带方向标识的文件名
-        batch_index = start_index + (idx // batch_size) + 1
-        merged_name = f"merged_{orientation}_{batch_index:04d}.png"
-        merged_path = os.path.join(dst_dir, merged_name)
-        merged.save(merged_path)
-
-        record_data.append({
-            "merged_file": merged_name,
-            "positions": positions,
-            "spacing": spacing,
-            "rows": rows,
-            "cols": cols,
-            "scale": scale,
-            "orientation": orientation
-        })
 
-        idx += batch_size
-        current_progress = (batch_index) / (total_batches + start_index) * 100
-        progress_var.set(int(current_progress))
-        root.update_idletasks()
-        
-    return start_index + total_batches
+def prepare_watermark(watermark, target_width, opacity):
+    """把RGBA水印缩放到目标宽度（保持比例）并按透明度调整alpha通道"""
+    original_width, original_height = watermark.size
+    scale = target_width / original_width
+    target_height = int(original_height * scale)
+
+    watermark = watermark.resize((target_width, target_height), Image.LANCZOS)
+
+    # 调整透明度
+    alpha = watermark.split()[3]
+    alpha = ImageEnhance.Brightness(alpha).enhance(opacity / 100)
+    watermark.putalpha(alpha)
+    return watermark
 
 
+def watermark_placement(img_width, img_height, watermark_path, watermark_size, position, opacity, cache=None):
+    """计算一张图片上的水印：返回 (缩放好的RGBA水印, x, y)，坐标相对于图片左上角"""
+    # 关键修改：使用宽度和高度中的较小值作为基准计算水印大小
+    base_dimension = min(img_width, img_height)  # 取宽高中的较小值
+    target_ratio = watermark_size / 100.0        # 例如 20 = 占基准尺寸的 20%
+    target_width = int(base_dimension * target_ratio)
+
+    if cache is not None:
+        watermark = cache.get(watermark_path, target_width, opacity)
+    else:
+        watermark = prepare_watermark(Image.open(watermark_path).convert("RGBA"), target_width, opacity)
+
+    wm_width, wm_height = watermark.size
+
+    # 计算位置
+    if position == 0:      # 左上
+        x, y = 10, 10
+    elif position == 1:    # 右上
+        x, y = img_width - wm_width - 10, 10
+    elif position == 2:    # 左下
+        x, y = 10, img_height - wm_height - 10
+    elif position == 3:    # 右下
+        x, y = img_width - wm_width - 10, img_height - wm_height - 10
+    elif position == 4:    # 居中
+        x, y = (img_width - wm_width) // 2, (img_height - wm_height) // 2
+    elif position == 5:    # 底部居中
+        x, y = (img_width - wm_width) // 2, img_height - wm_height - 10
+    else:
+        raise ValueError(f"未知的水印位置: {position}")
+    return watermark, x, y
 
 
-def add_watermark(image, watermark_path, watermark_size, position, opacity):
+def add_watermark(image, watermark_path, watermark_size, position, opacity, cache=None,
+                  blend=DEFAULT_WATERMARK_BLEND):
     if not watermark_path or not os.path.exists(watermark_path):
         return image
 
     try:
-        watermark = Image.open(watermark_path).convert("RGBA")
-
-        # 背景图尺寸
-        img_width, img_height = image.size
-        original_width, original_height = watermark.size
-
-        # 关键修改：使用宽度和高度中的较小值作为基准计算水印大小
-        base_dimension = min(img_width, img_height)  # 取宽高中的较小值
-        target_ratio = watermark_size / 100.0        # 例如 20 = 占基准尺寸的 20%
-        target_width = int(base_dimension * target_ratio)
-        scale = target_width / original_width
-        target_height = int(original_height * scale)
-
-        watermark = watermark.resize((target_width, target_height), Image.LANCZOS)
-
-        # 调整透明度
-        alpha = watermark.split()[3]
-        alpha = ImageEnhance.Brightness(alpha).enhance(opacity / 100)
-        watermark.putalpha(alpha)
-
-        wm_width, wm_height = watermark.size
-
-        # 计算位置
-        if position == 0:      # 左上
-            x, y = 10, 10
-        elif position == 1:    # 右上
-            x, y = img_width - wm_width - 10, 10
-        elif position == 2:    # 左下
-            x, y = 10, img_height - wm_height - 10
-        elif position == 3:    # 右下
-            x, y = img_width - wm_width - 10, img_height - wm_height - 10
-        elif position == 4:    # 居中
-            x, y = (img_width - wm_width) // 2, (img_height - wm_height) // 2
-        elif position == 5:    # 底部居中
-            x, y = (img_width - wm_width) // 2, img_height - wm_height - 10
-
-        # 合成水印
-        if image.mode != 'RGBA':
-            image = image.convert('RGBA')
-        image.paste(watermark, (x, y), watermark)
+        watermark, x, y = watermark_placement(image.width, image.height, watermark_path, watermark_size,
+                                              position, opacity, cache)
 
+        # 合成水印：RGB图片只混合水印覆盖的区域，不需要整张转换为RGBA
+        if image.mode == 'RGB':
+            return blend_watermark(image, watermark, x, y, mode=blend, cache=cache)
+        image = image.convert('RGBA')
+        image.paste(watermark, (x, y), watermark)
         return image.convert('RGB')
     except Exception as e:
         print(f"添加水印失败: {e}")
         return image
 
 
-def split_images(merged_dir, progress_var, watermark_path, watermark_size, watermark_pos, watermark_opacity):
-    if not merged_dir or not os.path.exists(merged_dir):
-        messagebox.showerror("错误", "请选择有效的拼接图片文件夹")
-        return
-
-    record_file = os.path.join(merged_dir, "record.json")
-    if not os.path.exists(record_file):
-        messagebox.showerror("错误", "找不到 record.json 文件")
-        return
-
-    with open(record_file, 'r', encoding='utf-8') as f:
-        record_data = json.load(f)
-
-    dst_dir = os.path.join(merged_dir, "split_output")
-    os.makedirs(dst_dir, exist_ok=True)
-
-    total_batches = len(record_data)
-    for i, entry in enumerate(record_data, start=1):
-        merged_path = os.path.join(merged_dir, entry["merged_file"])
-        if not os.path.exists(merged_path):
-            print(f"跳过缺失文件: {merged_path}")
-            continue
-
-        merged_img = Image.open(merged_path)
-        positions = entry["positions"]
-
-        for pos in positions:
-            crop_img = merged_img.crop((
-                pos["x"], pos["y"],
-                pos["x"] + pos["w"], pos["y"] + pos["h"]
-            ))
-            
-            # 添加水印
-            if watermark_enabled_var.get() == 1 and watermark_path and os.path.exists(watermark_path):
-                crop_img = add_watermark(crop_img, watermark_path, watermark_size, watermark_pos, watermark_opacity)
-            
-            # 获取目标文件路径和扩展名
-            target_file = os.path.join(dst_dir, pos["file"])
-            file_ext = os.path.splitext(pos["file"])[1].lower()
-            
-            # 如果有EXIF数据，尝试将其还原到拆分后的图片
-            exif_data = pos.get("exif_data", {})
-            exif_bytes = exif_from_json(exif_data)
-            if file_ext in ['.jpg', '.jpeg'] and exif_bytes:
-                crop_img.save(target_file, "jpeg", quality=95, exif=exif_bytes)
-            elif file_ext == ".png":
-                from PIL.PngImagePlugin import PngInfo
-                pnginfo = PngInfo()
-                for k, v in exif_data.items():
-                    if not k.startswith("_"):
-                        pnginfo.add_text(k, str(v))
-                crop_img.save(target_file, "PNG", pnginfo=pnginfo, optimize=True)
+def iter_prefetched(items, loader, read_ahead, budget_bytes, cost_fn):
+    """按原顺序产出 (item, loader(item))，后台线程提前加载后续 read_ahead 项
+    已加载、尚未处理完的数据（包括调用方正在处理的一项）估算总大小不超过 budget_bytes，
+    预读队列为空时无论预算如何都会加载下一项，保证处理能继续
+    """
+    items = list(items)
+    executor = ThreadPoolExecutor(max_workers=max(1, read_ahead), thread_name_prefix="prefetch")
+    pending = deque()
+    next_idx = 0
+    held_bytes = 0
+    try:
+        while True:
+            while next_idx < len(items) and len(pending) <= read_ahead:
+                item = items[next_idx]
+                cost = cost_fn(item)
+                if pending and held_bytes + cost > budget_bytes:
+                    break
+                pending.append((item, executor.submit(loader, item), cost))
+                held_bytes += cost
+                next_idx += 1
+            if not pending:
+                break
+            item, future, cost = pending.popleft()
+            yield item, future.result()
+            # 先释放已处理完的数据，再预读下一项
+            future = None
+            held_bytes -= cost
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def shrink_to_edge(image, max_edge):
+    """把图片缩小到长边不超过 max_edge（不放大）
+    先用 reduce() 按整数倍做快速的盒式缩小，保留目标尺寸2倍以上的分辨率，再用LANCZOS缩放到目标尺寸，
+    避免每次都在全分辨率上重采样
+    """
+    width, height = image.size
+    scale = max_edge / max(width, height)
+    if scale >= 1.0:
+        return image
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    factor = int(1 / (scale * 2))
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image.resize(size, Image.LANCZOS)
+
+
+def insert_jpeg_exif(data, exif_bytes):
+    """在JPEG字节的SOI（以及紧随其后的JFIF APP0段）之后插入EXIF APP1段，exif_bytes 为空时原样返回"""
+    if not exif_bytes:
+        return data
+    if not exif_bytes.startswith(b"Exif\x00\x00"):
+        exif_bytes = b"Exif\x00\x00" + exif_bytes
+    insert_at = 2
+    if data[2:4] == b"\xff\xe0":
+        insert_at = 4 + struct.unpack(">H", data[4:6])[0]
+    segment = b"\xff\xe1" + struct.pack(">H", len(exif_bytes) + 2) + exif_bytes
+    return data[:insert_at] + segment + data[insert_at:]
+
+
+def estimate_merged_bytes(entry):
+    """根据记录中的拼接位置估算合成图解码后的内存占用（RGB每像素3字节）"""
+    positions = entry.get("positions", [])
+    width = max((pos["x"] + pos["w"] for pos in positions), default=0)
+    height = max((pos["y"] + pos["h"] for pos in positions), default=0)
+    return width * height * 3
+
+
+class SplitJob:
+    """一次拆分任务
+    与 MergeJob 一样不依赖界面和全局变量；多个任务可共用一个 WatermarkCache，
+    复用已读取和缩放好的水印
+    merged_dir: 拼接输出目录（包含 record.json），也可以是拼接时生成的单文件容器（.zip）
+    watermark_enabled: 是否添加水印，水印文件不存在时自动忽略
+    dst_dir: 输出目录，默认为 merged_dir/split_output；容器 X.zip 默认为同目录下的 X_split_output
+    largest_first: run() 时先处理解码后最大的拼接图，预读线程不会在最后只剩一张大图可做
+    watermark_on_canvas: 在整张合成图上一次性为所有图片区域添加水印后再裁剪，
+        每张图片不再单独转换和分配内存；为假时逐张裁剪后添加
+    watermark_blend: 水印混合方式，见 WATERMARK_BLEND_MODES
+    png_profile: PNG输出的保存方式，见 SPLIT_PNG_PROFILES
+    output_formats: 按原扩展名改变输出格式，例如 {".png": ".jpg", ".bmp": ".png"}；未列出的保持原格式
+    lossless_crop: 拼接图为按MCU对齐的JPEG、输出为JPEG且不加水印时，用 jpegtran 在DCT域直接裁剪，
+        不解码也不重新编码；找不到 jpegtran 或裁剪失败时退回解码裁剪
+    renditions: 同时生成的预览长边尺寸，例如 [2048, 512]；run() 从内存中已裁剪的图片逐级缩小，
+        写入与 dst_dir 平行的 dst_dir_2048px 等目录，文件名和目录结构与 dst_dir 相同
+    progress: 进度回调，参数为0~100的整数
+    """
+    def __init__(self, merged_dir, watermark_path="", watermark_size=50, watermark_pos=3, watermark_opacity=70,
+                 watermark_enabled=True, dst_dir=None, read_ahead=DEFAULT_SPLIT_READ_AHEAD,
+                 memory_budget_mb=DEFAULT_SPLIT_MEMORY_BUDGET_MB, watermark_cache=None, largest_first=True,
+                 watermark_on_canvas=True, watermark_blend=DEFAULT_WATERMARK_BLEND,
+                 png_profile=DEFAULT_SPLIT_PNG_PROFILE, output_formats=None, lossless_crop=True, renditions=(),
+                 progress=None):
+        self.merged_dir = merged_dir
+        self.watermark_path = watermark_path
+        self.watermark_size = watermark_size
+        self.watermark_pos = watermark_pos
+        self.watermark_opacity = watermark_opacity
+        self.apply_watermark = bool(watermark_enabled and watermark_path and os.path.exists(watermark_path))
+        self.from_container = bool(merged_dir) and os.path.isfile(merged_dir)
+        if dst_dir is None and merged_dir:
+            if self.from_container:
+                dst_dir = os.path.splitext(os.path.abspath(merged_dir))[0] + "_split_output"
+            else:
+                dst_dir = os.path.join(merged_dir, "split_output")
+        self.dst_dir = dst_dir
+        self.store = None
+        self.read_ahead = read_ahead
+        self.memory_budget_mb = memory_budget_mb
+        self.watermark_cache = watermark_cache if watermark_cache is not None else WatermarkCache()
+        self.largest_first = largest_first
+        self.watermark_on_canvas = watermark_on_canvas
+        if watermark_blend not in WATERMARK_BLEND_MODES:
+            raise JobError(f"不支持的水印混合方式: {watermark_blend}")
+        self.watermark_blend = watermark_blend
+        if png_profile not in SPLIT_PNG_PROFILES:
+            raise JobError(f"不支持的PNG保存方式: {png_profile}，请选择 {', '.join(SPLIT_PNG_PROFILES)}")
+        self.png_profile = png_profile
+        self.output_formats = {}
+        for src_ext, dst_ext in (output_formats or {}).items():
+            src_ext, dst_ext = ("." + ext.lower().lstrip(".") for ext in (src_ext, dst_ext))
+            if dst_ext not in Image.registered_extensions():
+                raise JobError(f"不支持的输出格式: {dst_ext}")
+            self.output_formats[src_ext] = dst_ext
+        self.jpegtran = shutil.which("jpegtran") if lossless_crop else None
+        if not all(isinstance(size, int) and size > 0 for size in renditions):
+            raise JobError(f"预览尺寸必须是正整数: {list(renditions)}")
+        # 从大到小生成，每一级在上一级的基础上缩小
+        self.renditions = sorted(set(renditions), reverse=True)
+        # 最近一次无损裁剪读取的JPEG拼接图 (文件名, 字节)，同一张拼接图只读取一次
+        self._sheet = None
+        self.progress = progress
+        self.total_batches = 0
+
+    def validate(self):
+        if not self.merged_dir or not os.path.exists(self.merged_dir):
+            raise JobError("请选择有效的拼接图片文件夹")
+        if self.store is None:
+            if self.from_container:
+                if not zipfile.is_zipfile(self.merged_dir):
+                    raise JobError("不是有效的拼接容器文件")
+                self.store = MergedContainerStore(self.merged_dir)
             else:
-                crop_img.save(target_file)
+                self.store = MergedDirStore(self.merged_dir)
+        if not self.store.exists("record.json"):
+            raise JobError("找不到 record.json 文件")
+
+    def close(self):
+        """关闭容器文件；之后再次调用任何方法时会重新打开"""
+        self._sheet = None
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def load_record(self):
+        self.validate()
+        return json.loads(self.store.read("record.json").decode('utf-8'))
+
+    def output_name(self, filename):
+        """拆分后的文件名：按 output_formats 替换扩展名，目录部分保持不变"""
+        root, ext = os.path.splitext(filename)
+        return root + self.output_formats.get(ext.lower(), ext)
+
+    def is_safe_name(self, pos):
+        """记录中的文件名必须是相对路径，拆分时不能写到输出目录之外"""
+        if safe_member_name(pos["file"]) is None:
+            print(f"跳过记录中不安全的文件名: {pos['file']}")
+            return False
+        return True
+
+    def original_ref(self, pos):
+        """不加水印、不改变格式且原图库中有原图时返回其引用路径，可直接复制还原"""
+        if self.apply_watermark or not pos.get("original") or self.output_name(pos["file"]) != pos["file"]:
+            return None
+        return pos["original"] if self.store.exists(pos["original"]) else None
+
+    def can_crop_lossless(self, entry, pos):
+        """图片位于按MCU对齐的JPEG拼接图中、输出仍为JPEG且不加水印时，可以无损裁剪"""
+        align = entry.get("mcu_align")
+        if not (self.jpegtran and align) or self.apply_watermark:
+            return False
+        if os.path.splitext(self.output_name(pos["file"]))[1].lower() not in ('.jpg', '.jpeg'):
+            return False
+        return pos["x"] % align == 0 and pos["y"] % align == 0
+
+    def crop_lossless(self, entry, pos, exif_bytes):
+        """用 jpegtran 从JPEG拼接图中裁剪出一张图片并插入EXIF，返回JPEG字节
+        裁剪失败时返回None，并且本任务之后不再尝试无损裁剪
+        """
+        merged_name = entry["merged_file"]
+        if self._sheet is None or self._sheet[0] != merged_name:
+            self._sheet = (merged_name, self.store.read(merged_name))
+        crop = f"{pos['w']}x{pos['h']}+{pos['x']}+{pos['y']}"
+        try:
+            result = subprocess.run([self.jpegtran, "-copy", "none", "-optimize", "-crop", crop],
+                                    input=self._sheet[1], capture_output=True, check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"无损裁剪失败，改为解码裁剪: {e}")
+            self.jpegtran = None
+            return None
+        return insert_jpeg_exif(result.stdout, exif_bytes)
+
+    def needs_decode(self, entry):
+        return not all(self.original_ref(pos) or self.can_crop_lossless(entry, pos) for pos in entry["positions"])
+
+    def load_merged(self, entry):
+        merged_name = entry["merged_file"]
+        if not self.store.exists(merged_name):
+            return None
+        # 所有图片都能从原图库还原或无损裁剪时不必解码合成图
+        if not self.needs_decode(entry):
+            return merged_name
+        merged_img = self.store.open_image(merged_name)
+        merged_img.load()
+        return merged_img
+
+    def estimate_bytes(self, entry):
+        return estimate_merged_bytes(entry) if self.needs_decode(entry) else 0
+
+    def watermark_canvas(self, merged_img, positions):
+        """在整张合成图上为每个图片区域添加水印，水印超出图片区域的部分被裁掉
+        （与裁剪后单独添加时被图片边缘裁掉的效果相同），返回添加了水印的合成图
+        """
+        if merged_img.mode != 'RGB':
+            merged_img = merged_img.convert('RGB')
+        for pos in positions:
+            # 重复图片与首个相同图片共用同一区域，只添加一次
+            if pos.get("duplicate_of"):
+                continue
+            try:
+                watermark, x, y = watermark_placement(pos["w"], pos["h"], self.watermark_path, self.watermark_size,
+                                                      self.watermark_pos, self.watermark_opacity,
+                                                      self.watermark_cache)
+            except Exception as e:
+                print(f"添加水印失败: {e}")
+                continue
+            tile_box = (pos["x"], pos["y"], pos["x"] + pos["w"], pos["y"] + pos["h"])
+            blend_watermark(merged_img, watermark, pos["x"] + x, pos["y"] + y, tile_box,
+                            self.watermark_blend, self.watermark_cache)
+        return merged_img
+
+    def prepare_canvas(self, merged_img, positions):
+        """需要时在整张合成图上预先添加水印，返回 (合成图, 裁剪后是否还需逐张添加水印)"""
+        if self.apply_watermark and self.watermark_on_canvas:
+            return self.watermark_canvas(merged_img, positions), False
+        return merged_img, self.apply_watermark
+
+    def crop_tile(self, merged_img, pos, watermark=None):
+        """从合成图中裁剪出一张图片，需要时添加水印
+        watermark 为假时不添加（合成图上已添加过），为空时按任务设置决定
+        """
+        crop_img = merged_img.crop((
+            pos["x"], pos["y"],
+            pos["x"] + pos["w"], pos["y"] + pos["h"]
+        ))
+
+        # 添加水印
+        if self.apply_watermark if watermark is None else watermark:
+            crop_img = add_watermark(crop_img, self.watermark_path, self.watermark_size,
+                                     self.watermark_pos, self.watermark_opacity, self.watermark_cache,
+                                     self.watermark_blend)
+        return crop_img
+
+    def tile_exif(self, pos):
+        """取回一张图片的EXIF字节，没有时返回None
+        新记录从旁路文件原样取回EXIF块，旧记录从 exif_data 字典重建
+        """
+        if pos.get("exif_blob"):
+            offset, length = pos["exif_blob"]
+            return self.store.read(EXIF_BLOB_FILE, offset, length)
+        return exif_from_json(pos.get("exif_data", {}))
+
+    def save_tile(self, crop_img, pos, fp, exif_bytes):
+        """按输出文件扩展名编码图片并写入EXIF，fp 可以是文件路径或文件对象"""
+        # 获取目标文件扩展名
+        file_ext = os.path.splitext(self.output_name(pos["file"]))[1].lower()
+
+        # 如果有EXIF数据，尝试将其还原到拆分后的图片
+        exif_data = pos.get("exif_data", {})
+        if file_ext in ['.jpg', '.jpeg'] and exif_bytes:
+            crop_img.save(fp, "jpeg", quality=95, exif=exif_bytes)
+        elif file_ext == ".png":
+            from PIL.PngImagePlugin import PngInfo
+            pnginfo = PngInfo()
+            for k, v in exif_data.items():
+                if not k.startswith("_"):
+                    pnginfo.add_text(k, str(v))
+            png_options = dict(SPLIT_PNG_PROFILES[self.png_profile])
+            if pos.get("exif_blob"):
+                png_options["exif"] = exif_bytes
+            crop_img.save(fp, "PNG", pnginfo=pnginfo, **png_options)
+        else:
+            crop_img.save(fp, Image.registered_extensions().get(file_ext))
+
+    def rendition_dir(self, max_edge):
+        return RENDITION_DIR_FORMAT.format(self.dst_dir, max_edge)
+
+    def decode_for_renditions(self, data):
+        """解码已编码的图片（原图库中的原图或无损裁剪结果）用于生成预览
+        JPEG按最大的预览尺寸草稿解码（DCT域按1/2~1/8缩小），并按EXIF方向修正
+        """
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+        scale = self.renditions[0] / max(width, height)
+        if scale < 1.0:
+            image.draft('RGB', (int(width * scale) + 1, int(height * scale) + 1))
+        image = ImageOps.exif_transpose(image)
+        return image if image.mode == 'RGB' else image.convert('RGB')
+
+    def save_renditions(self, image, pos, exif_bytes):
+        """从内存中的图片逐级缩小，按输出文件名写入各预览目录"""
+        parts = self.output_name(pos["file"]).split("/")
+        for max_edge in self.renditions:
+            image = shrink_to_edge(image, max_edge)
+            target_file = os.path.join(self.rendition_dir(max_edge), *parts)
+            if len(parts) > 1:
+                os.makedirs(os.path.dirname(target_file), exist_ok=True)
+            self.save_tile(image, pos, target_file, exif_bytes)
+
+    def restore_bytes(self, filename):
+        """只还原记录中的一张图片，返回编码后的字节；找不到时抛出 JobError"""
+        try:
+            for entry in self.load_record():
+                for pos in entry["positions"]:
+                    if pos["file"] != filename:
+                        continue
+                    original_ref = self.original_ref(pos)
+                    if original_ref:
+                        return self.store.read(original_ref)
+                    if not self.store.exists(entry["merged_file"]):
+                        raise JobError(f"找不到拼接图片: {entry['merged_file']}")
+                    if self.can_crop_lossless(entry, pos):
+                        data = self.crop_lossless(entry, pos, self.tile_exif(pos))
+                        if data is not None:
+                            return data
+                    with self.store.open_image(entry["merged_file"]) as merged_img:
+                        crop_img = self.crop_tile(merged_img, pos)
+                    buffer = io.BytesIO()
+                    self.save_tile(crop_img, pos, buffer, self.tile_exif(pos))
+                    return buffer.getvalue()
+            raise JobError(f"记录中没有该图片: {filename}")
+        finally:
+            self.close()
+
+    def iter_merged(self, read_ahead, largest_first=False):
+        """按记录顺序产出 (序号, 记录项, 合成图)，缺失的合成图会被跳过
+        当前合成图被处理的同时，后台线程读取并解码后面 read_ahead 张合成图
+        largest_first 为真时按解码后的大小从大到小产出
+        """
+        record_data = self.load_record()
+        self.total_batches = len(record_data)
+        if largest_first:
+            record_data = order_by_cost(record_data, estimate_merged_bytes)
+        prefetched = iter_prefetched(record_data, self.load_merged, read_ahead,
+                                     self.memory_budget_mb * 1024 * 1024, self.estimate_bytes)
+        try:
+            for i, (entry, merged_img) in enumerate(prefetched, start=1):
+                if merged_img is None:
+                    print(f"跳过缺失文件: {self.merged_dir}/{entry['merged_file']}")
+                    continue
+                yield i, entry, merged_img
+                merged_img = None
+        finally:
+            # 提前结束时先停止预读线程，之后才能关闭容器
+            prefetched.close()
+
+    def iter_tiles(self, read_ahead=0):
+        """逐张产出还原后的图片 (输出文件名, 编码后的字节, EXIF字节或None)，不写入磁盘
+        默认不预读，任何时刻只持有一张解码后的合成图
+        """
+        merged_iter = self.iter_merged(read_ahead)
+        try:
+            for i, entry, merged_img in merged_iter:
+                tile_watermark = None
+                for pos in entry["positions"]:
+                    if not self.is_safe_name(pos):
+                        continue
+                    # 原图库中的原图直接返回原始字节
+                    original_ref = self.original_ref(pos)
+                    if original_ref:
+                        data = self.store.read(original_ref)
+                        with Image.open(io.BytesIO(data)) as original:
+                            exif_bytes = original.info.get('exif')
+                        yield self.output_name(pos["file"]), data, exif_bytes
+                        continue
+
+                    exif_bytes = self.tile_exif(pos)
+                    if self.can_crop_lossless(entry, pos):
+                        data = self.crop_lossless(entry, pos, exif_bytes)
+                        if data is not None:
+                            yield self.output_name(pos["file"]), data, exif_bytes
+                            continue
+
+                    if isinstance(merged_img, str):
+                        merged_img = self.store.open_image(merged_img)
+                    if tile_watermark is None:
+                        merged_img, tile_watermark = self.prepare_canvas(merged_img, entry["positions"])
+                    buffer = io.BytesIO()
+                    self.save_tile(self.crop_tile(merged_img, pos, tile_watermark), pos, buffer, exif_bytes)
+                    yield self.output_name(pos["file"]), buffer.getvalue(), exif_bytes
+
+                merged_img = None
+                _report_progress(self.progress, i / self.total_batches * 100)
+        finally:
+            merged_iter.close()
+            self.close()
+
+        _report_progress(self.progress, 100)
+
+    def output_paths(self):
+        """任务会写入的路径（输出目录和各级预览目录），HTTP服务据此拒绝输出重叠的任务"""
+        return [self.dst_dir] + [self.rendition_dir(max_edge) for max_edge in self.renditions]
+
+    def run(self):
+        """执行拆分，返回输出目录（预览目录见 rendition_dir）"""
+        dst_dir = self.dst_dir
+        os.makedirs(dst_dir, exist_ok=True)
+        for max_edge in self.renditions:
+            os.makedirs(self.rendition_dir(max_edge), exist_ok=True)
+
+        merged_iter = self.iter_merged(self.read_ahead, self.largest_first)
+        try:
+            for i, entry, merged_img in merged_iter:
+                positions = entry["positions"]
+                tile_watermark = None
+
+                for pos in positions:
+                    if not self.is_safe_name(pos):
+                        continue
+                    # 来自压缩包的文件名可能带有包内目录
+                    target_file = os.path.join(dst_dir, *self.output_name(pos["file"]).split("/"))
+                    if "/" in pos["file"]:
+                        os.makedirs(os.path.dirname(target_file), exist_ok=True)
+
+                    # 快速路径：原样复制原始JPEG字节，不解码也不重新编码，EXIF完整保留
+                    original_ref = self.original_ref(pos)
+                    if original_ref:
+                        self.store.copy_to(original_ref, target_file)
+                        if self.renditions:
+                            self.save_renditions(self.decode_for_renditions(self.store.read(original_ref)),
+                                                 pos, self.tile_exif(pos))
+                        continue
+
+                    # JPEG拼接图按MCU对齐时在DCT域裁剪，不重新编码
+                    if self.can_crop_lossless(entry, pos):
+                        exif_bytes = self.tile_exif(pos)
+                        data = self.crop_lossless(entry, pos, exif_bytes)
+                        if data is not None:
+                            with open(target_file, 'wb') as f:
+                                f.write(data)
+                            if self.renditions:
+                                self.save_renditions(self.decode_for_renditions(data), pos, exif_bytes)
+                            continue
+
+                    if isinstance(merged_img, str):
+                        # 原图在预读之后被删除或无损裁剪失败，退回到裁剪合成图
+                        merged_img = self.store.open_image(merged_img)
+                    if tile_watermark is None:
+                        merged_img, tile_watermark = self.prepare_canvas(merged_img, positions)
+                    crop_img = self.crop_tile(merged_img, pos, tile_watermark)
+                    exif_bytes = self.tile_exif(pos)
+                    self.save_tile(crop_img, pos, target_file, exif_bytes)
+                    if self.renditions:
+                        self.save_renditions(crop_img, pos, exif_bytes)
+
+                merged_img = None
+                _report_progress(self.progress, i / self.total_batches * 100)
+        finally:
+            merged_iter.close()
+            self.close()
+
+        _report_progress(self.progress, 100)
+        return dst_dir
+
+
+def iter_split_images(merged_dir, **options):
+    """流式拆分：逐张产出 (文件名, 编码后的字节, EXIF字节或None)
+    options 与 SplitJob 的参数相同，例如 watermark_path、watermark_size
+    """
+    return SplitJob(merged_dir, **options).iter_tiles()
 
 
-        progress_var.set(int(i / total_batches * 100))
-        root.update_idletasks()
+def split_images(merged_dir, progress_var, watermark_path, watermark_size, watermark_pos, watermark_opacity,
+                 watermark_enabled=True, read_ahead=DEFAULT_SPLIT_READ_AHEAD,
+                 memory_budget_mb=DEFAULT_SPLIT_MEMORY_BUDGET_MB):
+    """界面入口：按 record.json 拆分拼接图片，并保存当前水印设置"""
+    job = SplitJob(merged_dir, watermark_path, watermark_size, watermark_pos, watermark_opacity,
+                   watermark_enabled=watermark_enabled, read_ahead=read_ahead,
+                   memory_budget_mb=memory_budget_mb, progress=gui_progress(progress_var))
+    try:
+        dst_dir = job.run()
+    except JobError as e:
+        messagebox.showerror("错误", str(e))
+        return
 
     # 保存当前水印设置
     config = {
@@ -519,7 +2835,7 @@ def split_images(merged_dir, progress_var, watermark_path, watermark_size, water
         "watermark_size": watermark_size,
         "watermark_pos": watermark_pos,
         "watermark_opacity": watermark_opacity,
-        "watermark_enabled": 1   # 1=开启, 0=关闭
+        "watermark_enabled": 1 if watermark_enabled else 0   # 1=开启, 0=关闭
 
     }
     save_watermark_config(config)
@@ -528,6 +2844,14 @@ def split_images(merged_dir, progress_var, watermark_path, watermark_size, water
     messagebox.showinfo("完成", f"拆分完成，输出目录: {dst_dir}")
 
 
+def gui_progress(progress_var):
+    """把引擎的进度回调接到界面进度条上"""
+    def update(percent):
+        progress_var.set(percent)
+        root.update_idletasks()
+    return update
+
+
 def choose_folder(entry_widget):
     folder = filedialog.askdirectory()
     if folder:
@@ -553,7 +2877,9 @@ def start_merge():
     except ValueError:
         messagebox.showerror("错误", "请输入有效的数字")
         return
-    merge_images_grid(entry_merge_src.get().strip(), merge_count, spacing, max_size, progress_var, split_by_orientation)
+    merge_images_grid(entry_merge_src.get().strip(), merge_count, spacing, max_size, progress_var, split_by_orientation,
+                      keep_originals=keep_originals_var.get(), dedup=dedup_var.get(),
+                      recursive=recursive_var.get(), per_folder=per_folder_var.get())
 
 
 def start_split():
@@ -572,10 +2898,347 @@ def start_split():
         watermark_path,
         watermark_size,
         watermark_pos,
-        watermark_opacity
+        watermark_opacity,
+        watermark_enabled=watermark_enabled_var.get() == 1
     )
 
 
+# HTTP服务允许通过接口创建任务时传入的参数：MergeJob/SplitJob 中除回调和共享对象以外的全部构造参数
+# （拼接任务共用服务的内存预算，因此不接受 memory_budget_mb）
+MERGE_JOB_FIELDS = ("src_dir", "merge_count", "spacing", "max_size", "split_by_orientation",
+                    "keep_originals", "dedup", "dst_dir", "io_workers", "prefetch_batches", "container",
+                    "recursive", "per_folder", "largest_first", "sheet_format", "tile_scaling", "header_cache")
+SPLIT_JOB_FIELDS = ("merged_dir", "watermark_path", "watermark_size", "watermark_pos", "watermark_opacity",
+                    "watermark_enabled", "dst_dir", "read_ahead", "memory_budget_mb", "largest_first",
+                    "watermark_on_canvas", "watermark_blend", "png_profile", "output_formats", "lossless_crop",
+                    "renditions")
+
+
+class ServiceBusy(JobError):
+    """服务已满负荷，HTTP接口返回503"""
+
+
+class JobManager:
+    """HTTP服务的任务队列
+    固定数量的工作线程依次执行排队的拼接/拆分任务，排队任务数超过 max_pending 时拒绝新任务，
+    输出路径与排队中或运行中的任务重叠时也拒绝，避免两个任务互相覆盖；
+    单张还原在请求线程中执行，同时进行的还原数不超过 max_restores（默认与 workers 相同）；
+    所有拆分任务共用一个 WatermarkCache，所有拼接任务共用一个 memory_budget_mb 的 MemoryBudget
+    """
+    def __init__(self, workers=DEFAULT_SERVICE_WORKERS, max_pending=DEFAULT_SERVICE_MAX_PENDING,
+                 max_history=DEFAULT_SERVICE_MAX_HISTORY, max_restores=None,
+                 memory_budget_mb=DEFAULT_MERGE_MEMORY_BUDGET_MB):
+        self.max_pending = max_pending
+        self.max_history = max_history
+        self.watermark_cache = WatermarkCache()
+        self.memory_budget = MemoryBudget(memory_budget_mb * 1024 * 1024 if memory_budget_mb else None)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-worker")
+        self._restore_slots = threading.BoundedSemaphore(max_restores or workers)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create_job(self, kind, params, progress):
+        """按接口参数创建任务对象，参数无效时抛出 JobError"""
+        if not isinstance(params, dict):
+            raise JobError("请求内容必须是JSON对象")
+        fields = {"merge": MERGE_JOB_FIELDS, "split": SPLIT_JOB_FIELDS}.get(kind)
+        if fields is None:
+            raise JobError(f"不支持的任务类型: {kind}")
+        unknown = sorted(set(params) - set(fields))
+        if unknown:
+            raise JobError(f"不支持的参数: {', '.join(unknown)}")
+        try:
+            if kind == "merge":
+                job = MergeJob(memory_budget=self.memory_budget, progress=progress, **params)
+            else:
+                job = SplitJob(watermark_cache=self.watermark_cache, progress=progress, **params)
+        except (TypeError, AttributeError) as e:
+            raise JobError(f"参数错误: {e}")
+        try:
+            job.validate()
+        except JobError:
+            self._discard(job)
+            raise
+        return job
+
+    @staticmethod
+    def _discard(job):
+        """丢弃没有进入队列的任务：拆分任务在 validate() 中可能已打开容器文件"""
+        if isinstance(job, SplitJob):
+            job.close()
+
+    def submit(self, kind, params):
+        """提交任务，返回任务ID"""
+        job_id = uuid.uuid4().hex
+        status = {"id": job_id, "type": kind, "status": "queued", "progress": 0,
+                  "result": None, "error": None, "created": time.time()}
+
+        def update_progress(percent):
+            status["progress"] = percent
+
+        job = self.create_job(kind, params, update_progress)
+        status["outputs"] = [os.path.abspath(path) for path in job.output_paths()]
+        try:
+            with self._lock:
+                pending = sum(1 for item in self._jobs.values() if item["status"] == "queued")
+                if pending >= self.max_pending:
+                    raise JobError("排队的任务过多，请稍后再试")
+                # 任务结束（done/failed）后其输出路径自动可以再次使用
+                for item in self._jobs.values():
+                    if item["status"] not in ("queued", "running"):
+                        continue
+                    for path in status["outputs"]:
+                        if any(paths_overlap(path, other) for other in item["outputs"]):
+                            raise JobError(f"输出路径 {path} 与未完成的任务 {item['id']} 重叠，"
+                                           f"请等待其完成或更换输出目录")
+                self._jobs[job_id] = status
+                self._prune()
+        except JobError:
+            self._discard(job)
+            raise
+        self._executor.submit(self._run, job, status)
+        return job_id
+
+    def restore(self, merged_dir, filename, **options):
+        """还原单张图片，返回 (字节, 输出文件名)；options 与 SplitJob 的参数相同
+        同时进行的还原已达 max_restores 时不等待，直接抛出 ServiceBusy
+        """
+        if not self._restore_slots.acquire(blocking=False):
+            raise ServiceBusy("同时还原的图片过多，请稍后再试")
+        try:
+            job = SplitJob(merged_dir, watermark_cache=self.watermark_cache, **options)
+            return job.restore_bytes(filename), job.output_name(filename)
+        finally:
+            self._restore_slots.release()
+
+    def _run(self, job, status):
+        status["status"] = "running"
+        try:
+            status["result"] = job.run()
+            status["status"] = "done"
+        except Exception as e:
+            status["error"] = str(e)
+            status["status"] = "failed"
+
+    def _prune(self):
+        """只保留最近 max_history 个已结束的任务状态"""
+        finished = [job_id for job_id, item in self._jobs.items() if item["status"] in ("done", "failed")]
+        for job_id in finished[:max(0, len(finished) - self.max_history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            status = self._jobs.get(job_id)
+            return dict(status) if status else None
+
+    def list(self):
+        with self._lock:
+            return [dict(status) for status in self._jobs.values()]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """HTTP接口
+    POST /jobs/merge、POST /jobs/split  提交任务（JSON参数），返回任务ID
+    GET  /jobs、GET /jobs/<id>          查询任务状态和进度
+    GET  /restore?merged_dir=...&file=... 直接返回还原后的单张原图
+    """
+    server_version = "MergeSplitService/1.0"
+
+    def send_json(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "jobs":
+            self.send_json(404, {"error": "接口不存在"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            params = json.loads(self.rfile.read(length) or b"{}")
+            job_id = self.server.manager.submit(parts[1], params)
+        except ValueError:
+            self.send_json(400, {"error": "请求内容不是有效的JSON"})
+            return
+        except JobError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(202, {"id": job_id})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        manager = self.server.manager
+        if parts == ["jobs"]:
+            self.send_json(200, manager.list())
+        elif len(parts) == 2 and parts[0] == "jobs":
+            status = manager.get(parts[1])
+            if status is None:
+                self.send_json(404, {"error": "任务不存在"})
+            else:
+                self.send_json(200, status)
+        elif parts == ["restore"]:
+            self.send_restored(parse_qs(url.query))
+        else:
+            self.send_json(404, {"error": "接口不存在"})
+
+    def send_restored(self, query):
+        merged_dir = query.get("merged_dir", [""])[0]
+        filename = query.get("file", [""])[0]
+        watermark_path = query.get("watermark_path", [""])[0]
+        try:
+            data, output_name = self.server.manager.restore(
+                merged_dir, filename,
+                watermark_path=watermark_path,
+                watermark_size=int(query.get("watermark_size", [50])[0]),
+                watermark_pos=int(query.get("watermark_pos", [3])[0]),
+                watermark_opacity=int(query.get("watermark_opacity", [70])[0]),
+                watermark_enabled=bool(watermark_path),
+            )
+        except ValueError:
+            self.send_json(400, {"error": "水印参数错误"})
+            return
+        except ServiceBusy as e:
+            self.send_json(503, {"error": str(e)})
+            return
+        except JobError as e:
+            self.send_json(404, {"error": str(e)})
+            return
+        self.send_response(200)
+        content_type = mimetypes.guess_type(output_name)[0]
+        self.send_header("Content-Type", content_type or "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        print(f"[{self.log_date_time_string()}] {self.address_string()} {format % args}")
+
+
+def serve(host=DEFAULT_SERVICE_HOST, port=DEFAULT_SERVICE_PORT, workers=DEFAULT_SERVICE_WORKERS,
+          max_pending=DEFAULT_SERVICE_MAX_PENDING):
+    """启动本地HTTP服务，直到 Ctrl+C"""
+    server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    server.daemon_threads = True
+    server.manager = JobManager(workers, max_pending)
+    print(f"服务已启动: http://{host}:{port}，工作线程 {workers} 个")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.manager.shutdown()
+        print("服务已停止")
+
+
+def run_cli(argv):
+    """命令行入口，带参数运行 mian.py 时使用"""
+    parser = argparse.ArgumentParser(prog="mian.py", description="图片拼接/拆分工具命令行模式")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    watch_parser = subparsers.add_parser("watch", help="监视文件夹，新照片凑满一批即自动拼接")
+    watch_parser.add_argument("src_dir", help="要监视的源图片文件夹")
+    watch_parser.add_argument("--count", type=int, default=6, choices=sorted(MERGE_OPTIONS), help="每张拼接图包含的图片数量")
+    watch_parser.add_argument("--spacing", type=int, default=0, help="图片间距(px)")
+    watch_parser.add_argument("--max-size", type=int, default=DEFAULT_MAX_SIZE, help="拼接图最大宽高(px)")
+    watch_parser.add_argument("--mixed", action="store_true", help="横竖屏混合拼接")
+    watch_parser.add_argument("--keep-originals", action="store_true", help="保留JPEG原图用于无损还原")
+    watch_parser.add_argument("--output", help="输出目录，默认为 <src_dir>/merged_output")
+    watch_parser.add_argument("--poll", type=float, default=DEFAULT_WATCH_POLL_INTERVAL, help="扫描间隔(秒)")
+    watch_parser.add_argument("--settle", type=float, default=DEFAULT_WATCH_SETTLE_TIME,
+                              help="文件多久不再变化才认为写入完成(秒)")
+    watch_parser.add_argument("--flush-on-exit", action="store_true", help="退出时把不足一批的图片也拼接")
+
+    serve_parser = subparsers.add_parser("serve", help="启动本地HTTP服务，通过接口提交拼接/拆分任务")
+    serve_parser.add_argument("--host", default=DEFAULT_SERVICE_HOST, help="监听地址")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_SERVICE_PORT, help="监听端口")
+    serve_parser.add_argument("--workers", type=int, default=DEFAULT_SERVICE_WORKERS, help="同时执行的任务数")
+    serve_parser.add_argument("--max-pending", type=int, default=DEFAULT_SERVICE_MAX_PENDING, help="最多排队的任务数")
+
+    def add_merge_arguments(sub_parser):
+        sub_parser.add_argument("src_dir", help="源图片文件夹")
+        sub_parser.add_argument("--count", type=int, default=6, choices=sorted(MERGE_OPTIONS), help="每张拼接图包含的图片数量")
+        sub_parser.add_argument("--spacing", type=int, default=0, help="图片间距(px)")
+        sub_parser.add_argument("--max-size", type=int, default=DEFAULT_MAX_SIZE, help="拼接图最大宽高(px)")
+        sub_parser.add_argument("--mixed", action="store_true", help="横竖屏混合拼接")
+        sub_parser.add_argument("--keep-originals", action="store_true", help="保留JPEG原图用于无损还原")
+        sub_parser.add_argument("--dedup", action="store_true", help="去除重复图片")
+        sub_parser.add_argument("--recursive", action="store_true", help="包含子文件夹")
+        sub_parser.add_argument("--per-folder", action="store_true", help="每个子文件夹单独拼接")
+        sub_parser.add_argument("--sheet-format", default=DEFAULT_SHEET_FORMAT, choices=list(SHEET_FORMATS),
+                                help="拼接图格式，jpeg 时拆分JPEG图片可无损裁剪")
+        sub_parser.add_argument("--tile-scaling", default=DEFAULT_TILE_SCALING, choices=TILE_SCALING_MODES,
+                                help="超过最大宽高时整张缩放(canvas)或逐张缩放到统一单元格(cell)")
+        sub_parser.add_argument("--no-header-cache", action="store_true", help="不使用持久化的文件头缓存")
+        sub_parser.add_argument("--output", help="输出目录，默认为 <src_dir>/merged_output")
+
+    def merge_job_from_args(args):
+        return MergeJob(args.src_dir, args.count, args.spacing, args.max_size,
+                        split_by_orientation=not args.mixed, keep_originals=args.keep_originals,
+                        dedup=args.dedup, dst_dir=args.output, recursive=args.recursive,
+                        per_folder=args.per_folder, sheet_format=args.sheet_format,
+                        tile_scaling=args.tile_scaling, header_cache=not args.no_header_cache)
+
+    dry_run_parser = subparsers.add_parser("dry-run", help="只读取文件头，预估拼接图数量、尺寸、内存和输出大小")
+    add_merge_arguments(dry_run_parser)
+    dry_run_parser.add_argument("--details", action="store_true", help="逐张列出拼接图")
+    dry_run_parser.add_argument("--json", help="把完整的预估结果保存为JSON文件")
+
+    plan_parser = subparsers.add_parser("plan", help="分片执行第一步：只读取文件头，生成批次清单")
+    add_merge_arguments(plan_parser)
+    plan_parser.add_argument("manifest", help="批次清单输出路径（JSON）")
+
+    execute_parser = subparsers.add_parser("execute", help="分片执行第二步：执行批次清单中的一个分片")
+    execute_parser.add_argument("manifest", help="批次清单路径")
+    execute_parser.add_argument("--shard", default="1/1", help="要执行的分片，格式 i/n，例如 3/8")
+    execute_parser.add_argument("--src", help="覆盖清单中的源图片文件夹（本节点挂载点不同时）")
+    execute_parser.add_argument("--output", help="覆盖清单中的输出目录")
+    execute_parser.add_argument("--io-workers", type=int, default=DEFAULT_IO_WORKERS, help="读取线程数")
+    execute_parser.add_argument("--memory-budget", type=int, default=DEFAULT_MERGE_MEMORY_BUDGET_MB,
+                                help="处理中批次的内存上限(MB)")
+
+    merge_records_parser = subparsers.add_parser("merge-records", help="分片执行第三步：合并各分片的记录")
+    merge_records_parser.add_argument("manifest", help="批次清单路径")
+    merge_records_parser.add_argument("--output", help="覆盖清单中的输出目录")
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "watch":
+            watcher = FolderWatcher(
+                args.src_dir, args.count, args.spacing, args.max_size,
+                split_by_orientation=not args.mixed, keep_originals=args.keep_originals,
+                dst_dir=args.output, poll_interval=args.poll, settle_time=args.settle
+            )
+            watcher.run(flush_on_exit=args.flush_on_exit)
+        elif args.command == "serve":
+            serve(args.host, args.port, args.workers, args.max_pending)
+        elif args.command == "dry-run":
+            report = merge_job_from_args(args).dry_run()
+            print_plan_report(report, args.details)
+            if args.json:
+                save_record(args.json, report)
+        elif args.command == "plan":
+            write_manifest(merge_job_from_args(args), args.manifest)
+        elif args.command == "execute":
+            shard, shard_count = parse_shard(args.shard)
+            execute_manifest(args.manifest, shard, shard_count, src_dir=args.src, dst_dir=args.output,
+                             io_workers=args.io_workers, memory_budget_mb=args.memory_budget)
+        elif args.command == "merge-records":
+            merge_shard_records(args.manifest, dst_dir=args.output)
+    except JobError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
 def exif_from_json(exif_data: dict):
     """
     把 record.json 里保存的 exif_data 转换成 piexif 可以写入的 exif_bytes
@@ -660,111 +3323,134 @@ def exif_from_json(exif_data: dict):
         return None
 
 
-# 初始化主窗口
-root = tk.Tk()
-root.title("图片拼接/拆分工具（带水印记忆功能）")
-root.geometry("700x500")
-
-# 加载水印配置
-config = load_watermark_config()
-
-progress_var = tk.IntVar()
-progress_bar = ttk.Progressbar(root, orient="horizontal", length=680, mode="determinate", variable=progress_var)
-progress_bar.pack(pady=5)
-
-frame_merge = tk.LabelFrame(root, text="功能1: 图片网格拼接")
-frame_merge.pack(fill="x", padx=10, pady=5)
-
-tk.Label(frame_merge, text="源图片文件夹:").grid(row=0, column=0, sticky="w")
-entry_merge_src = tk.Entry(frame_merge, width=50)
-entry_merge_src.grid(row=0, column=1)
-tk.Button(frame_merge, text="选择", command=lambda: choose_folder(entry_merge_src)).grid(row=0, column=2)
-
-# 合并数量选择
-merge_count_var = tk.IntVar(value=6)  # 默认选择6张
-merge_count_frame = tk.Frame(frame_merge)
-merge_count_frame.grid(row=1, column=0, columnspan=3, pady=5)
-tk.Label(merge_count_frame, text="每张合并图片包含的图片数量: ").pack(side=tk.LEFT)
-
-# 创建合并数量选项按钮
-for count in sorted(MERGE_OPTIONS.keys()):
-    tk.Radiobutton(merge_count_frame, text=str(count), variable=merge_count_var, value=count).pack(side=tk.LEFT, padx=10)
-
-# 横竖屏分开拼接选项
-frame_orientation = tk.Frame(frame_merge)
-frame_orientation.grid(row=2, column=0, columnspan=3, pady=5)
-tk.Label(frame_orientation, text="是否将横竖屏分开拼接: ").pack(side=tk.LEFT)
-split_by_orientation_var = tk.BooleanVar(value=DEFAULT_SPLIT_BY_ORIENTATION)
-tk.Radiobutton(frame_orientation, text="是", variable=split_by_orientation_var, value=True).pack(side=tk.LEFT, padx=10)
-tk.Radiobutton(frame_orientation, text="否", variable=split_by_orientation_var, value=False).pack(side=tk.LEFT, padx=10)
-
-# 添加布局说明
-layout_desc = tk.Label(frame_merge, text="注: 默认自动按横竖屏分类，6张时竖屏2行3列，横屏3行2列", 
-                       fg="gray", font=("SimHei", 9))
-layout_desc.grid(row=3, column=0, columnspan=3, sticky="w", padx=5)
-
-tk.Label(frame_merge, text="间距(px):").grid(row=3, column=0, sticky="w")
-entry_spacing = tk.Entry(frame_merge, width=5)
-entry_spacing.grid(row=3, column=1, sticky="w")
-entry_spacing.insert(0, "0")
-
-tk.Label(frame_merge, text="最大合成图宽高限制(px):").grid(row=3, column=1, sticky="e", padx=(100, 0))
-entry_maxsize = tk.Entry(frame_merge, width=7)
-entry_maxsize.grid(row=3, column=1, sticky="e", padx=(200, 0))
-entry_maxsize.insert(0, str(DEFAULT_MAX_SIZE))
-
-tk.Button(frame_merge, text="开始拼接", command=start_merge).grid(row=4, column=1, pady=5)
-
-frame_split = tk.LabelFrame(root, text="功能2: 图片拆分")
-frame_split.pack(fill="x", padx=10, pady=5)
-
-tk.Label(frame_split, text="拼接图片文件夹:").grid(row=0, column=0, sticky="w")
-entry_split_src = tk.Entry(frame_split, width=50)
-entry_split_src.grid(row=0, column=1)
-tk.Button(frame_split, text="选择", command=lambda: choose_folder(entry_split_src)).grid(row=0, column=2)
-
-# 水印设置区域
-frame_watermark = tk.LabelFrame(frame_split, text="水印设置")
-frame_watermark.grid(row=1, column=0, columnspan=3, sticky="we", padx=5, pady=5)
-# 水印开关
-watermark_enabled_var = tk.IntVar(value=config.get("watermark_enabled", 1))
-tk.Checkbutton(frame_watermark, text="启用水印", variable=watermark_enabled_var).grid(row=0, column=3, padx=10)
-
-
-tk.Label(frame_watermark, text="水印图片:").grid(row=0, column=0, sticky="w")
-entry_watermark = tk.Entry(frame_watermark, width=40)
-entry_watermark.grid(row=0, column=1, sticky="w")
-entry_watermark.insert(0, config["watermark_path"])  # 加载保存的路径
-tk.Button(frame_watermark, text="选择", command=lambda: choose_watermark(entry_watermark)).grid(row=0, column=2)
-
-# 水印大小
-tk.Label(frame_watermark, text="水印大小(%):").grid(row=1, column=0, sticky="w")
-watermark_size_var = tk.IntVar(value=config["watermark_size"])
-scale_size = Scale(frame_watermark, from_=10, to=100, orient="horizontal", variable=watermark_size_var)
-scale_size.grid(row=1, column=1, sticky="we")
-
-# 水印位置
-tk.Label(frame_watermark, text="水印位置:").grid(row=2, column=0, sticky="w")
-watermark_pos_var = tk.IntVar(value=config["watermark_pos"])
-pos_frame = tk.Frame(frame_watermark)
-pos_frame.grid(row=2, column=1, sticky="w")
-tk.Radiobutton(pos_frame, text="左上", variable=watermark_pos_var, value=0).pack(side=tk.LEFT, padx=5)
-tk.Radiobutton(pos_frame, text="右上", variable=watermark_pos_var, value=1).pack(side=tk.LEFT, padx=5)
-tk.Radiobutton(pos_frame, text="左下", variable=watermark_pos_var, value=2).pack(side=tk.LEFT, padx=5)
-tk.Radiobutton(pos_frame, text="右下", variable=watermark_pos_var, value=3).pack(side=tk.LEFT, padx=5)
-tk.Radiobutton(pos_frame, text="居中", variable=watermark_pos_var, value=4).pack(side=tk.LEFT, padx=5)
-tk.Radiobutton(pos_frame, text="底部居中", variable=watermark_pos_var, value=5).pack(side=tk.LEFT, padx=5)
-
-# 水印透明度
-tk.Label(frame_watermark, text="透明度(%):").grid(row=3, column=0, sticky="w")
-watermark_opacity_var = tk.IntVar(value=config["watermark_opacity"])
-scale_opacity = Scale(frame_watermark, from_=10, to=100, orient="horizontal", variable=watermark_opacity_var)
-scale_opacity.grid(row=3, column=1, sticky="we")
-
-tk.Button(frame_split, text="开始拆分", command=start_split).grid(row=2, column=1, pady=10)
-
-# 让拆分区域的列能够自适应宽度
-frame_split.grid_columnconfigure(1, weight=1)
-frame_watermark.grid_columnconfigure(1, weight=1)
-
-root.mainloop()
+if __name__ == "__main__":
+    # 带参数运行时进入命令行模式，例如: python mian.py watch <文件夹>
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
+
+    # 初始化主窗口
+    root = tk.Tk()
+    root.title("图片拼接/拆分工具（带水印记忆功能）")
+    root.geometry("700x500")
+
+    # 加载水印配置
+    config = load_watermark_config()
+
+    progress_var = tk.IntVar()
+    progress_bar = ttk.Progressbar(root, orient="horizontal", length=680, mode="determinate", variable=progress_var)
+    progress_bar.pack(pady=5)
+
+    frame_merge = tk.LabelFrame(root, text="功能1: 图片网格拼接")
+    frame_merge.pack(fill="x", padx=10, pady=5)
+
+    tk.Label(frame_merge, text="源图片文件夹:").grid(row=0, column=0, sticky="w")
+    entry_merge_src = tk.Entry(frame_merge, width=50)
+    entry_merge_src.grid(row=0, column=1)
+    tk.Button(frame_merge, text="选择", command=lambda: choose_folder(entry_merge_src)).grid(row=0, column=2)
+
+    # 合并数量选择
+    merge_count_var = tk.IntVar(value=6)  # 默认选择6张
+    merge_count_frame = tk.Frame(frame_merge)
+    merge_count_frame.grid(row=1, column=0, columnspan=3, pady=5)
+    tk.Label(merge_count_frame, text="每张合并图片包含的图片数量: ").pack(side=tk.LEFT)
+
+    # 创建合并数量选项按钮
+    for count in sorted(MERGE_OPTIONS.keys()):
+        tk.Radiobutton(merge_count_frame, text=str(count), variable=merge_count_var, value=count).pack(side=tk.LEFT, padx=10)
+
+    # 横竖屏分开拼接选项
+    frame_orientation = tk.Frame(frame_merge)
+    frame_orientation.grid(row=2, column=0, columnspan=3, pady=5)
+    tk.Label(frame_orientation, text="是否将横竖屏分开拼接: ").pack(side=tk.LEFT)
+    split_by_orientation_var = tk.BooleanVar(value=DEFAULT_SPLIT_BY_ORIENTATION)
+    tk.Radiobutton(frame_orientation, text="是", variable=split_by_orientation_var, value=True).pack(side=tk.LEFT, padx=10)
+    tk.Radiobutton(frame_orientation, text="否", variable=split_by_orientation_var, value=False).pack(side=tk.LEFT, padx=10)
+
+    # 添加布局说明
+    layout_desc = tk.Label(frame_merge, text="注: 默认自动按横竖屏分类，6张时竖屏2行3列，横屏3行2列", 
+                           fg="gray", font=("SimHei", 9))
+    layout_desc.grid(row=3, column=0, columnspan=3, sticky="w", padx=5)
+
+    tk.Label(frame_merge, text="间距(px):").grid(row=3, column=0, sticky="w")
+    entry_spacing = tk.Entry(frame_merge, width=5)
+    entry_spacing.grid(row=3, column=1, sticky="w")
+    entry_spacing.insert(0, "0")
+
+    tk.Label(frame_merge, text="最大合成图宽高限制(px):").grid(row=3, column=1, sticky="e", padx=(100, 0))
+    entry_maxsize = tk.Entry(frame_merge, width=7)
+    entry_maxsize.grid(row=3, column=1, sticky="e", padx=(200, 0))
+    entry_maxsize.insert(0, str(DEFAULT_MAX_SIZE))
+
+    # 保留原图选项
+    keep_originals_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(frame_merge, text="保留JPEG原图（不加水印拆分时无损还原）",
+                   variable=keep_originals_var).grid(row=4, column=0, columnspan=3, sticky="w")
+
+    # 去除重复图片选项
+    dedup_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(frame_merge, text="去除重复图片（相同内容只拼接一次）",
+                   variable=dedup_var).grid(row=4, column=1, columnspan=2, sticky="e")
+
+    # 子文件夹选项
+    recursive_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(frame_merge, text="包含子文件夹",
+                   variable=recursive_var).grid(row=5, column=0, columnspan=3, sticky="w")
+    per_folder_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(frame_merge, text="每个子文件夹单独拼接",
+                   variable=per_folder_var).grid(row=5, column=1, columnspan=2, sticky="e")
+
+    tk.Button(frame_merge, text="开始拼接", command=start_merge).grid(row=6, column=1, pady=5)
+
+    frame_split = tk.LabelFrame(root, text="功能2: 图片拆分")
+    frame_split.pack(fill="x", padx=10, pady=5)
+
+    tk.Label(frame_split, text="拼接图片文件夹:").grid(row=0, column=0, sticky="w")
+    entry_split_src = tk.Entry(frame_split, width=50)
+    entry_split_src.grid(row=0, column=1)
+    tk.Button(frame_split, text="选择", command=lambda: choose_folder(entry_split_src)).grid(row=0, column=2)
+
+    # 水印设置区域
+    frame_watermark = tk.LabelFrame(frame_split, text="水印设置")
+    frame_watermark.grid(row=1, column=0, columnspan=3, sticky="we", padx=5, pady=5)
+    # 水印开关
+    watermark_enabled_var = tk.IntVar(value=config.get("watermark_enabled", 1))
+    tk.Checkbutton(frame_watermark, text="启用水印", variable=watermark_enabled_var).grid(row=0, column=3, padx=10)
+
+
+    tk.Label(frame_watermark, text="水印图片:").grid(row=0, column=0, sticky="w")
+    entry_watermark = tk.Entry(frame_watermark, width=40)
+    entry_watermark.grid(row=0, column=1, sticky="w")
+    entry_watermark.insert(0, config["watermark_path"])  # 加载保存的路径
+    tk.Button(frame_watermark, text="选择", command=lambda: choose_watermark(entry_watermark)).grid(row=0, column=2)
+
+    # 水印大小
+    tk.Label(frame_watermark, text="水印大小(%):").grid(row=1, column=0, sticky="w")
+    watermark_size_var = tk.IntVar(value=config["watermark_size"])
+    scale_size = Scale(frame_watermark, from_=10, to=100, orient="horizontal", variable=watermark_size_var)
+    scale_size.grid(row=1, column=1, sticky="we")
+
+    # 水印位置
+    tk.Label(frame_watermark, text="水印位置:").grid(row=2, column=0, sticky="w")
+    watermark_pos_var = tk.IntVar(value=config["watermark_pos"])
+    pos_frame = tk.Frame(frame_watermark)
+    pos_frame.grid(row=2, column=1, sticky="w")
+    tk.Radiobutton(pos_frame, text="左上", variable=watermark_pos_var, value=0).pack(side=tk.LEFT, padx=5)
+    tk.Radiobutton(pos_frame, text="右上", variable=watermark_pos_var, value=1).pack(side=tk.LEFT, padx=5)
+    tk.Radiobutton(pos_frame, text="左下", variable=watermark_pos_var, value=2).pack(side=tk.LEFT, padx=5)
+    tk.Radiobutton(pos_frame, text="右下", variable=watermark_pos_var, value=3).pack(side=tk.LEFT, padx=5)
+    tk.Radiobutton(pos_frame, text="居中", variable=watermark_pos_var, value=4).pack(side=tk.LEFT, padx=5)
+    tk.Radiobutton(pos_frame, text="底部居中", variable=watermark_pos_var, value=5).pack(side=tk.LEFT, padx=5)
+
+    # 水印透明度
+    tk.Label(frame_watermark, text="透明度(%):").grid(row=3, column=0, sticky="w")
+    watermark_opacity_var = tk.IntVar(value=config["watermark_opacity"])
+    scale_opacity = Scale(frame_watermark, from_=10, to=100, orient="horizontal", variable=watermark_opacity_var)
+    scale_opacity.grid(row=3, column=1, sticky="we")
+
+    tk.Button(frame_split, text="开始拆分", command=start_split).grid(row=2, column=1, pady=10)
+
+    # 让拆分区域的列能够自适应宽度
+    frame_split.grid_columnconfigure(1, weight=1)
+    frame_watermark.grid_columnconfigure(1, weight=1)
+
+    root.mainloop()
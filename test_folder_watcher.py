@@ -0,0 +1,170 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+from PIL import Image
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mian
+
+
+def make_photo(path, size=(300, 400), age=60, color=(120, 100, 180)):
+    """生成纯色测试图片，修改时间设为 age 秒之前（视为已写入完成）"""
+    Image.new("RGB", size, color=color).save(path, quality=95)
+    if age:
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+
+
+def make_truncated(path):
+    """文件头完整、像素数据被截断的JPEG"""
+    Image.effect_noise((300, 400), 40).convert("RGB").save(path, quality=95)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:len(data) * 4 // 10])
+    mtime = time.time() - 60
+    os.utime(path, (mtime, mtime))
+
+
+def merged_names(record):
+    return sorted(pos["file"] for entry in record for pos in entry["positions"])
+
+
+def wait_until(condition, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_watcher_batches(work_dir):
+    print("\n===== 测试: 监视文件夹，凑满一批后合并 =====")
+    src_dir = os.path.join(work_dir, "src")
+    dst_dir = os.path.join(work_dir, "out")
+    os.makedirs(src_dir)
+    for i in range(3):
+        make_photo(os.path.join(src_dir, f"old_{i}.jpg"))
+    watcher = mian.FolderWatcher(src_dir, merge_count=2, dst_dir=dst_dir, settle_time=5)
+    first = watcher.poll_once()
+    # 刚写入的文件要等 settle_time 之后才会被合并
+    make_photo(os.path.join(src_dir, "new.jpg"), age=0)
+    now = time.time()
+    early = watcher.poll_once(now=now)
+    settled = watcher.poll_once(now=now + 10)
+    record = mian.load_record(os.path.join(dst_dir, "record.json"))
+    print(f"第一次合并 {first} 张，新文件稳定前 {early} 张，稳定后 {settled} 张，记录中 {merged_names(record)}")
+
+    # 重启后已记录的文件不会重复合并
+    restarted = mian.FolderWatcher(src_dir, merge_count=2, dst_dir=dst_dir, settle_time=5).poll_once(flush=True)
+    print(f"重启后合并 {restarted} 张")
+    return (first == 1 and early == 0 and settled == 1 and restarted == 0
+            and merged_names(record) == ["new.jpg", "old_0.jpg", "old_1.jpg", "old_2.jpg"])
+
+
+def test_watcher_truncated_file(work_dir):
+    print("\n===== 测试: 监视的文件夹中出现截断的JPEG =====")
+    src_dir = os.path.join(work_dir, "src")
+    dst_dir = os.path.join(work_dir, "out")
+    os.makedirs(src_dir)
+    for i in range(3):
+        make_photo(os.path.join(src_dir, f"photo_{i}.jpg"))
+    make_truncated(os.path.join(src_dir, "photo_3.jpg"))
+    watcher = mian.FolderWatcher(src_dir, merge_count=4, dst_dir=dst_dir, settle_time=1)
+    merged = watcher.poll_once()
+    again = watcher.poll_once(flush=True)
+    record = mian.load_record(os.path.join(dst_dir, "record.json"))
+    print(f"合并 {merged} 张，其中图片 {merged_names(record)}；再次扫描合并 {again} 张")
+    # 截断的文件被标记为已处理，不会每轮都重新尝试
+    return (merged == 1 and again == 0 and merged_names(record) == ["photo_0.jpg", "photo_1.jpg", "photo_2.jpg"]
+            and "photo_3.jpg" in watcher.seen)
+
+
+def test_watcher_survives_failure(work_dir):
+    print("\n===== 测试: 某一轮合并失败后监视继续，下一轮重试 =====")
+    src_dir = os.path.join(work_dir, "src")
+    dst_dir = os.path.join(work_dir, "out")
+    os.makedirs(src_dir)
+    for i in range(2):
+        make_photo(os.path.join(src_dir, f"photo_{i}.jpg"))
+
+    original = mian.run_merge_pipeline
+    calls = []
+
+    def failing_once(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError("磁盘已满")
+        return original(*args, **kwargs)
+
+    mian.run_merge_pipeline = failing_once
+    stop_event = threading.Event()
+    watcher = mian.FolderWatcher(src_dir, merge_count=2, dst_dir=dst_dir, poll_interval=0.05, settle_time=1)
+    thread = threading.Thread(target=watcher.run, args=(stop_event,), daemon=True)
+    try:
+        thread.start()
+        recorded = wait_until(lambda: len(watcher.record_data) == 1)
+        alive = thread.is_alive()
+    finally:
+        stop_event.set()
+        thread.join(10)
+        mian.run_merge_pipeline = original
+    record = mian.load_record(os.path.join(dst_dir, "record.json"))
+    print(f"合并尝试 {len(calls)} 次，失败后监视线程仍在运行: {alive}，记录中 {merged_names(record)}")
+    return recorded and alive and len(calls) >= 2 and merged_names(record) == ["photo_0.jpg", "photo_1.jpg"]
+
+
+def test_watcher_numbering_after_skipped_batch(work_dir):
+    print("\n===== 测试: 整批无法解码后拼接图序号不重复 =====")
+    src_dir = os.path.join(work_dir, "src")
+    dst_dir = os.path.join(work_dir, "out")
+    os.makedirs(src_dir)
+    # 第1批两张都截断，不生成拼接图；第2批 b0/b1 生成第2张拼接图
+    make_truncated(os.path.join(src_dir, "a0.jpg"))
+    make_truncated(os.path.join(src_dir, "a1.jpg"))
+    make_photo(os.path.join(src_dir, "b0.jpg"), color=(255, 0, 0))
+    make_photo(os.path.join(src_dir, "b1.jpg"), color=(255, 0, 0))
+    watcher = mian.FolderWatcher(src_dir, merge_count=2, dst_dir=dst_dir, settle_time=1)
+    watcher.poll_once()
+    make_photo(os.path.join(src_dir, "c0.jpg"), color=(0, 0, 255))
+    make_photo(os.path.join(src_dir, "c1.jpg"), color=(0, 0, 255))
+    watcher.poll_once()
+
+    record = mian.load_record(os.path.join(dst_dir, "record.json"))
+    sheets = [entry["merged_file"] for entry in record]
+    print(f"拼接图: {sheets}")
+    # 拆分后 b0 仍是自己的像素，没有被后一批覆盖
+    split_dir = mian.SplitJob(dst_dir).run()
+    with Image.open(os.path.join(split_dir, "b0.jpg")) as b0, Image.open(os.path.join(split_dir, "c0.jpg")) as c0:
+        colors = (b0.convert("RGB").getpixel((150, 200)), c0.convert("RGB").getpixel((150, 200)))
+    print(f"还原后 b0 中心颜色 {colors[0]}，c0 中心颜色 {colors[1]}")
+    return (len(sheets) == 2 and len(set(sheets)) == 2
+            and colors[0][0] > 200 and colors[0][2] < 50 and colors[1][2] > 200 and colors[1][0] < 50)
+
+
+TESTS = [test_watcher_batches, test_watcher_truncated_file, test_watcher_survives_failure,
+         test_watcher_numbering_after_skipped_batch]
+
+
+def main():
+    results = []
+    for test in TESTS:
+        with tempfile.TemporaryDirectory() as work_dir:
+            try:
+                passed = bool(test(work_dir))
+            except Exception as e:
+                print(f"测试出错: {e}")
+                passed = False
+        print(f"{test.__name__}: {'通过' if passed else '失败'}")
+        results.append(passed)
+
+    print(f"\n===== 测试总结: {sum(results)}/{len(results)} 通过 =====")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+from PIL import Image
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mian
+
+
+class RecordingCache(mian.HeaderCache):
+    """记录每次分类时命中和新读取的文件数"""
+    def update(self, hits, misses):
+        self.last = (len(hits), len(misses))
+        super().update(hits, misses)
+
+
+def make_photos(src_dir, count, size=(300, 400)):
+    os.makedirs(src_dir, exist_ok=True)
+    for i in range(count):
+        Image.new("RGB", size, color=(i * 40 % 256, 90, 160)).save(os.path.join(src_dir, f"photo_{i}.jpg"))
+
+
+def cached_paths(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return {row[0] for row in conn.execute("SELECT path FROM headers")}
+
+
+def test_hit_and_invalidation(work_dir):
+    print("\n===== 测试: 缓存命中，文件修改后失效 =====")
+    src_dir = os.path.join(work_dir, "src")
+    make_photos(src_dir, 4)
+    cache = RecordingCache(os.path.join(work_dir, "cache.sqlite3"))
+    try:
+        mian.categorize_images_by_orientation(src_dir, header_cache=cache)
+        first = cache.last
+        mian.categorize_images_by_orientation(src_dir, header_cache=cache)
+        second = cache.last
+
+        # 竖屏改成横屏：大小和修改时间都变化，缓存中的旧尺寸不能再被使用
+        changed = os.path.join(src_dir, "photo_2.jpg")
+        Image.new("RGB", (500, 200), color=(0, 0, 0)).save(changed)
+        stat = os.stat(changed)
+        os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        portrait, landscape, _, _, _, landscape_names = \
+            mian.categorize_images_by_orientation(src_dir, header_cache=cache)
+        third = cache.last
+    finally:
+        cache.close()
+    print(f"命中/新读取: 第一次 {first}，第二次 {second}，修改一张后 {third}")
+    print(f"修改后横屏图片: {landscape_names}，尺寸 {[(img.width, img.height) for img in landscape]}")
+    return (first == (0, 4) and second == (4, 0) and third == (3, 1) and len(portrait) == 3
+            and landscape_names == ["photo_2.jpg"] and (landscape[0].width, landscape[0].height) == (500, 200))
+
+
+def test_version_invalidation(work_dir):
+    print("\n===== 测试: 缓存格式版本变化时整体失效 =====")
+    src_dir = os.path.join(work_dir, "src")
+    make_photos(src_dir, 3)
+    db_path = os.path.join(work_dir, "cache.sqlite3")
+    cache = mian.HeaderCache(db_path)
+    mian.categorize_images_by_orientation(src_dir, header_cache=cache)
+    cache.close()
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(f"PRAGMA user_version = {mian.HEADER_CACHE_VERSION + 1}")
+    cache = RecordingCache(db_path)
+    try:
+        remaining = len(cached_paths(db_path))
+        mian.categorize_images_by_orientation(src_dir, header_cache=cache)
+    finally:
+        cache.close()
+    print(f"版本变化后剩余条目 {remaining}，重新读取 {cache.last}")
+    return remaining == 0 and cache.last == (0, 3)
+
+
+def test_eviction(work_dir):
+    print("\n===== 测试: 超过容量时淘汰最久未使用的条目 =====")
+    dir_a = os.path.join(work_dir, "a")
+    dir_b = os.path.join(work_dir, "b")
+    make_photos(dir_a, 3)
+    make_photos(dir_b, 2)
+    db_path = os.path.join(work_dir, "cache.sqlite3")
+    cache = RecordingCache(db_path, max_entries=3)
+    try:
+        mian.categorize_images_by_orientation(dir_a, header_cache=cache)
+        time.sleep(0.05)
+        # 再次使用 a 中的一张图片，它比 a 中其他条目更新
+        os.remove(os.path.join(dir_a, "photo_1.jpg"))
+        os.remove(os.path.join(dir_a, "photo_2.jpg"))
+        mian.categorize_images_by_orientation(dir_a, header_cache=cache)
+        time.sleep(0.05)
+        mian.categorize_images_by_orientation(dir_b, header_cache=cache)
+        paths = cached_paths(db_path)
+    finally:
+        cache.close()
+    expected = {os.path.abspath(os.path.join(dir_a, "photo_0.jpg"))} | \
+        {os.path.abspath(os.path.join(dir_b, f"photo_{i}.jpg")) for i in range(2)}
+    print(f"缓存中保留: {sorted(os.path.relpath(path, work_dir) for path in paths)}")
+    return paths == expected
+
+
+def test_merge_job_cache(work_dir):
+    print("\n===== 测试: MergeJob 使用指定的缓存文件 =====")
+    src_dir = os.path.join(work_dir, "src")
+    make_photos(src_dir, 4)
+    db_path = os.path.join(work_dir, "job_cache.sqlite3")
+    first = mian.MergeJob(src_dir, merge_count=2, dst_dir=os.path.join(work_dir, "out"), header_cache=db_path).plan()
+    second = mian.MergeJob(src_dir, merge_count=2, dst_dir=os.path.join(work_dir, "out"), header_cache=db_path).plan()
+    same = [batch["filenames"] for batch in first] == [batch["filenames"] for batch in second]
+    print(f"缓存文件已创建: {os.path.exists(db_path)}，两次计划相同: {same}")
+    return os.path.exists(db_path) and len(cached_paths(db_path)) == 4 and same
+
+
+TESTS = [test_hit_and_invalidation, test_version_invalidation, test_eviction, test_merge_job_cache]
+
+
+def main():
+    results = []
+    for test in TESTS:
+        with tempfile.TemporaryDirectory() as work_dir:
+            try:
+                passed = bool(test(work_dir))
+            except Exception as e:
+                print(f"测试出错: {e}")
+                passed = False
+        print(f"{test.__name__}: {'通过' if passed else '失败'}")
+        results.append(passed)
+
+    print(f"\n===== 测试总结: {sum(results)}/{len(results)} 通过 =====")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,253 @@
+import os
+import io
+import sys
+import json
+import time
+import tempfile
+import threading
+import zipfile
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from PIL import Image
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mian
+
+
+def make_photo(path, size=(300, 400)):
+    Image.new("RGB", size, color=(len(os.path.basename(path)) * 30 % 256, 100, 180)).save(path, quality=95)
+
+
+def wait_until(condition, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class Service:
+    """在随机端口上启动HTTP服务"""
+    def __init__(self, workers=1):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), mian.ServiceRequestHandler)
+        self.server.daemon_threads = True
+        self.server.manager = mian.JobManager(workers)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def request(self, path, params=None, body=None):
+        """返回 (状态码, 响应内容)，JSON响应解析为对象"""
+        data = body if body is not None else (json.dumps(params).encode('utf-8') if params is not None else None)
+        try:
+            with urlopen(Request(self.url + path, data=data), timeout=30) as response:
+                code, content, content_type = response.status, response.read(), response.headers["Content-Type"]
+        except HTTPError as e:
+            code, content, content_type = e.code, e.read(), e.headers["Content-Type"]
+        if content_type and content_type.startswith("application/json"):
+            content = json.loads(content)
+        return code, content
+
+    def wait_job(self, job_id):
+        wait_until(lambda: self.request(f"/jobs/{job_id}")[1]["status"] in ("done", "failed"))
+        return self.request(f"/jobs/{job_id}")[1]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.manager.shutdown()
+
+
+def test_service_endpoints(work_dir):
+    print("\n===== 测试: HTTP服务接口 =====")
+    src_dir = os.path.join(work_dir, "src")
+    os.makedirs(src_dir)
+    for i in range(4):
+        make_photo(os.path.join(src_dir, f"photo_{i}.jpg"))
+    merged_dir = os.path.join(work_dir, "merged")
+    service = Service()
+    try:
+        code, reply = service.request("/jobs/merge", {"src_dir": src_dir, "merge_count": 2, "dst_dir": merged_dir,
+                                                      "sheet_format": "jpeg", "header_cache": False})
+        merge_status = service.wait_job(reply["id"])
+        print(f"拼接任务: {code} -> {merge_status['status']}，进度 {merge_status['progress']}")
+
+        split_dir = os.path.join(work_dir, "split")
+        code, reply = service.request("/jobs/split", {"merged_dir": merged_dir, "dst_dir": split_dir,
+                                                      "renditions": [100]})
+        split_status = service.wait_job(reply["id"])
+        restored = sorted(os.listdir(split_dir)) if os.path.isdir(split_dir) else []
+        previews = sorted(os.listdir(split_dir + "_100px")) if os.path.isdir(split_dir + "_100px") else []
+        print(f"拆分任务: {code} -> {split_status['status']}，还原 {len(restored)} 张，预览 {len(previews)} 张")
+
+        code_list, jobs = service.request("/jobs")
+        code_restore, data = service.request("/restore?" + urlencode({"merged_dir": merged_dir,
+                                                                       "file": "photo_1.jpg"}))
+        with Image.open(io.BytesIO(data)) as img:
+            restored_size = img.size
+        print(f"任务列表 {code_list}，共 {len(jobs)} 个；单张还原 {code_restore}，尺寸 {restored_size}")
+
+        errors = [
+            service.request("/jobs/merge", {"src_dir": src_dir, "no_such_option": 1})[0],
+            service.request("/jobs/merge", body=b"{not json")[0],
+            service.request("/jobs/split", {"merged_dir": merged_dir, "output_formats": [".png"]})[0],
+            service.request("/jobs/unknown")[0],
+            service.request("/jobs/0123")[0],
+            service.request("/restore?" + urlencode({"merged_dir": merged_dir, "file": "missing.jpg"}))[0],
+        ]
+        print(f"错误请求的状态码: {errors}")
+    finally:
+        service.close()
+    return (merge_status["status"] == "done" and merge_status["progress"] == 100
+            and split_status["status"] == "done" and len(restored) == 4 and len(previews) == 4
+            and code_list == 200 and len(jobs) == 2 and code_restore == 200 and restored_size == (300, 400)
+            and errors == [400, 400, 400, 404, 404, 404])
+
+
+def test_service_overlapping_output(work_dir):
+    print("\n===== 测试: 输出目录与未完成的任务重叠时拒绝 =====")
+    src_dir = os.path.join(work_dir, "src")
+    os.makedirs(src_dir)
+    for i in range(2):
+        make_photo(os.path.join(src_dir, f"photo_{i}.jpg"))
+
+    # 让第一个任务停在拼接阶段，直到检查完重叠的任务
+    original = mian.run_merge_pipeline
+    release = threading.Event()
+
+    def blocked(*args, **kwargs):
+        release.wait(30)
+        return original(*args, **kwargs)
+
+    mian.run_merge_pipeline = blocked
+    service = Service(workers=2)
+    try:
+        params = {"src_dir": src_dir, "merge_count": 2, "header_cache": False}
+        first = service.request("/jobs/merge", dict(params, dst_dir=os.path.join(work_dir, "out")))
+        same = service.request("/jobs/merge", dict(params, dst_dir=os.path.join(work_dir, "out")))
+        nested = service.request("/jobs/merge", dict(params, dst_dir=os.path.join(work_dir, "out", "sub")))
+        other = service.request("/jobs/merge", dict(params, dst_dir=os.path.join(work_dir, "other")))
+        release.set()
+        statuses = [service.wait_job(reply["id"])["status"] for _, reply in (first, other)]
+        # 第一个任务完成后，同一个输出目录可以再次使用
+        again = service.request("/jobs/merge", dict(params, dst_dir=os.path.join(work_dir, "out")))
+        statuses.append(service.wait_job(again[1]["id"])["status"])
+    finally:
+        release.set()
+        mian.run_merge_pipeline = original
+        service.close()
+    print(f"状态码: 第一个 {first[0]}，相同目录 {same[0]}，子目录 {nested[0]}，其他目录 {other[0]}，完成后 {again[0]}")
+    print(f"重叠时的提示: {same[1].get('error')}")
+    return ([first[0], same[0], nested[0], other[0], again[0]] == [202, 400, 400, 202, 202]
+            and statuses == ["done", "done", "done"])
+
+
+def test_service_restore_limit(work_dir):
+    print("\n===== 测试: 同时进行的单张还原数受限 =====")
+    src_dir = os.path.join(work_dir, "src")
+    os.makedirs(src_dir)
+    for i in range(2):
+        make_photo(os.path.join(src_dir, f"photo_{i}.jpg"))
+    merged_dir = mian.MergeJob(src_dir, merge_count=2, dst_dir=os.path.join(work_dir, "merged"),
+                               header_cache=False).run()
+
+    # 第一个还原停在解码之前，占住唯一的还原名额
+    original = mian.SplitJob.restore_bytes
+    entered = threading.Event()
+    release = threading.Event()
+
+    def blocked(self, filename):
+        entered.set()
+        release.wait(30)
+        return original(self, filename)
+
+    mian.SplitJob.restore_bytes = blocked
+    service = Service(workers=1)
+    query = "/restore?" + urlencode({"merged_dir": merged_dir, "file": "photo_0.jpg"})
+    codes = []
+    try:
+        first = threading.Thread(target=lambda: codes.append(service.request(query)[0]), daemon=True)
+        first.start()
+        entered.wait(30)
+        busy = service.request(query)
+        release.set()
+        first.join(30)
+        after = service.request(query)[0]
+    finally:
+        release.set()
+        mian.SplitJob.restore_bytes = original
+        service.close()
+    print(f"第一个请求 {codes}，同时到达的请求 {busy[0]}（{busy[1].get('error')}），之后的请求 {after}")
+    return codes == [200] and busy[0] == 503 and after == 200
+
+
+def test_rejected_job_closes_container(work_dir):
+    print("\n===== 测试: 被拒绝的拆分任务关闭已打开的容器 =====")
+    src_dir = os.path.join(work_dir, "src")
+    os.makedirs(src_dir)
+    for i in range(2):
+        make_photo(os.path.join(src_dir, f"photo_{i}.jpg"))
+    container = mian.MergeJob(src_dir, merge_count=2, dst_dir=os.path.join(work_dir, "merged"),
+                              container=True, header_cache=False).run()
+    empty_zip = os.path.join(work_dir, "empty.zip")
+    with zipfile.ZipFile(empty_zip, "w") as zf:
+        zf.writestr("readme.txt", "没有 record.json")
+
+    opened = []
+    original_init = mian.MergedContainerStore.__init__
+    original_close = mian.MergedContainerStore.close
+
+    def tracking_init(self, path):
+        original_init(self, path)
+        opened.append(self)
+
+    def tracking_close(self):
+        original_close(self)
+        if self in opened:
+            opened.remove(self)
+
+    mian.MergedContainerStore.__init__ = tracking_init
+    mian.MergedContainerStore.close = tracking_close
+    manager = mian.JobManager(workers=1, max_pending=0)
+    errors = []
+    try:
+        # 排队已满时被拒绝；容器中没有 record.json 时 validate() 失败
+        for params in ({"merged_dir": container}, {"merged_dir": empty_zip}):
+            try:
+                manager.submit("split", params)
+            except mian.JobError as e:
+                errors.append(str(e))
+    finally:
+        manager.shutdown()
+        mian.MergedContainerStore.__init__ = original_init
+        mian.MergedContainerStore.close = original_close
+    print(f"拒绝原因: {errors}，仍未关闭的容器 {len(opened)} 个")
+    return len(errors) == 2 and not opened
+
+
+TESTS = [test_service_endpoints, test_service_overlapping_output, test_service_restore_limit,
+         test_rejected_job_closes_container]
+
+
+def main():
+    results = []
+    for test in TESTS:
+        with tempfile.TemporaryDirectory() as work_dir:
+            try:
+                passed = bool(test(work_dir))
+            except Exception as e:
+                print(f"测试出错: {e}")
+                passed = False
+        print(f"{test.__name__}: {'通过' if passed else '失败'}")
+        results.append(passed)
+
+    print(f"\n===== 测试总结: {sum(results)}/{len(results)} 通过 =====")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,142 @@
+import os
+import io
+import sys
+import json
+import tarfile
+import zipfile
+import tempfile
+from PIL import Image
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mian
+
+
+def photo_bytes(size, seed):
+    """生成一张纯色测试图片的JPEG字节"""
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color=(seed * 50 % 256, 120, 200 - seed * 20 % 200)).save(buffer, "jpeg", quality=95)
+    return buffer.getvalue()
+
+
+def split_files(split_dir):
+    files = []
+    for root, _, names in os.walk(split_dir):
+        for name in names:
+            files.append(os.path.relpath(os.path.join(root, name), split_dir).replace(os.sep, "/"))
+    return sorted(files)
+
+
+def same_color(path, data):
+    """还原的图片与源图片中心颜色接近"""
+    with Image.open(path) as out, Image.open(io.BytesIO(data)) as src:
+        a = out.convert("RGB").getpixel((out.width // 2, out.height // 2))
+        b = src.convert("RGB").getpixel((src.width // 2, src.height // 2))
+    return out.size == src.size and all(abs(x - y) <= 4 for x, y in zip(a, b))
+
+
+def test_merge_from_iterable(work_dir):
+    print("\n===== 测试: 从文件对象和路径混合的序列拼接 =====")
+    sources = {f"photo_{i}.jpg": photo_bytes((300, 400) if i % 2 else (400, 300), i) for i in range(6)}
+    on_disk = os.path.join(work_dir, "photo_5.jpg")
+    with open(on_disk, 'wb') as f:
+        f.write(sources["photo_5.jpg"])
+
+    def items():
+        for name, data in sources.items():
+            yield name, (on_disk if name == "photo_5.jpg" else io.BytesIO(data))
+
+    dst_dir = os.path.join(work_dir, "merged")
+    record = mian.merge_from_iterable(items(), dst_dir, merge_count=2)
+    split_dir = mian.SplitJob(dst_dir).run()
+    restored = split_files(split_dir)
+    print(f"拼接图 {len(record)} 张，还原 {restored}")
+    return (restored == sorted(sources)
+            and all(same_color(os.path.join(split_dir, name), data) for name, data in sources.items()))
+
+
+def test_unsafe_names(work_dir):
+    print("\n===== 测试: 不安全的文件名不会写到输出目录之外 =====")
+    names = ["../../escape.jpg", "/tmp/absolute.jpg", "sub/../fine.jpg", "ok.jpg"]
+    dst_dir = os.path.join(work_dir, "out", "merged")
+    record = mian.merge_from_iterable(((name, io.BytesIO(photo_bytes((300, 400), i))) for i, name in enumerate(names)),
+                                      dst_dir, merge_count=2)
+    recorded = sorted(pos["file"] for entry in record for pos in entry["positions"])
+    print(f"记录中的文件名: {recorded}")
+
+    # 手工改写的记录：拆分时同样拒绝落到输出目录之外的文件名
+    record_file = os.path.join(dst_dir, "record.json")
+    with open(record_file, encoding='utf-8') as f:
+        tampered = json.load(f)
+    tampered[0]["positions"][0]["file"] = "../../escape.jpg"
+    with open(record_file, 'w', encoding='utf-8') as f:
+        json.dump(tampered, f)
+    split_dir = mian.SplitJob(dst_dir).run()
+    streamed = [name for name, _, _ in mian.iter_split_images(dst_dir)]
+    escaped = [path for path in (os.path.join(work_dir, "escape.jpg"), os.path.join(work_dir, "out", "escape.jpg"))
+               if os.path.exists(path)]
+    print(f"拆分结果 {split_files(split_dir)}，流式产出 {streamed}，输出目录之外的文件 {escaped}")
+    return (recorded == ["fine.jpg", "ok.jpg"] and not escaped
+            and split_files(split_dir) == ["ok.jpg"] and streamed == ["ok.jpg"])
+
+
+def test_archive_sources(work_dir):
+    print("\n===== 测试: 直接从zip/tar压缩包读取源图片 =====")
+    sources = {"trip/photo_0.jpg": photo_bytes((300, 400), 0), "trip/photo_1.jpg": photo_bytes((300, 400), 1),
+               "photo_2.jpg": photo_bytes((400, 300), 2), "photo_3.jpg": photo_bytes((400, 300), 3)}
+    zip_path = os.path.join(work_dir, "photos.zip")
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        for name, data in sources.items():
+            zf.writestr(name, data)
+        zf.writestr("../evil.jpg", photo_bytes((300, 400), 4))
+        zf.writestr("notes.txt", "不是图片")
+    tar_path = os.path.join(work_dir, "photos.tar.gz")
+    with tarfile.open(tar_path, "w:gz") as tf:
+        for name, data in sources.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+
+    ok = True
+    for archive in (zip_path, tar_path):
+        dst_dir = os.path.join(work_dir, os.path.basename(archive).split(".")[-1] + "_merged")
+        mian.MergeJob(archive, merge_count=2, dst_dir=dst_dir, header_cache=False).run()
+        split_dir = mian.SplitJob(dst_dir).run()
+        restored = split_files(split_dir)
+        print(f"{os.path.basename(archive)}: 还原 {restored}")
+        ok = ok and restored == sorted(sources) and \
+            all(same_color(os.path.join(split_dir, *name.split("/")), data) for name, data in sources.items())
+
+    # 压缩包来源不支持去重和预估
+    rejected = []
+    for options, action in (({"dedup": True}, "run"), ({}, "dry_run")):
+        try:
+            getattr(mian.MergeJob(zip_path, merge_count=2, header_cache=False, **options), action)()
+        except mian.JobError as e:
+            rejected.append(str(e))
+    print(f"不支持的操作: {rejected}")
+    # 不安全的成员名 ../evil.jpg 和非图片文件都不在还原结果中
+    return ok and len(rejected) == 2
+
+
+TESTS = [test_merge_from_iterable, test_unsafe_names, test_archive_sources]
+
+
+def main():
+    results = []
+    for test in TESTS:
+        with tempfile.TemporaryDirectory() as work_dir:
+            try:
+                passed = bool(test(work_dir))
+            except Exception as e:
+                print(f"测试出错: {e}")
+                passed = False
+        print(f"{test.__name__}: {'通过' if passed else '失败'}")
+        results.append(passed)
+
+    print(f"\n===== 测试总结: {sum(results)}/{len(results)} 通过 =====")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,277 @@
+import os
+import sys
+import shutil
+import tempfile
+import zipfile
+from PIL import Image, ImageChops, ImageStat
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mian
+
+# 两次JPEG编码（源图片、拆分结果）之后允许的平均像素误差
+MAX_MEAN_DIFF = 4
+
+
+def make_photo(path, size, seed):
+    """生成带渐变的测试图片，各图片内容不同，JPEG压缩后误差也较小"""
+    width, height = size
+    gradient = Image.linear_gradient("L").resize((width, height))
+    img = Image.merge("RGB", (gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT),
+                              Image.new("L", (width, height), seed * 37 % 256)))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    img.save(path, quality=95)
+
+
+def mean_diff(a, b):
+    return sum(ImageStat.Stat(ImageChops.difference(a.convert("RGB"), b.convert("RGB"))).mean) / 3
+
+
+def make_sources(src_dir, names):
+    """按文件名生成竖屏和横屏图片（文件名含 land 的为横屏）"""
+    for i, name in enumerate(names):
+        make_photo(os.path.join(src_dir, *name.split("/")), (400, 300) if "land" in name else (300, 400), i)
+
+
+def round_trip(src_dir, dst_dir, merge_count=4, **options):
+    """拼接后立即拆分，返回 (记录, 拆分输出目录)"""
+    output = mian.MergeJob(src_dir, merge_count=merge_count, dst_dir=dst_dir, header_cache=False, **options).run()
+    split_job = mian.SplitJob(output)
+    record = split_job.load_record()
+    split_job.close()
+    return record, split_job.run()
+
+
+def restored_files(split_dir):
+    files = []
+    for root, _, names in os.walk(split_dir):
+        for name in names:
+            files.append(os.path.relpath(os.path.join(root, name), split_dir).replace(os.sep, "/"))
+    return sorted(files)
+
+
+def read_bytes(folder, name):
+    with open(os.path.join(folder, *name.split("/")), 'rb') as f:
+        return f.read()
+
+
+def check_pixels(src_dir, split_dir, names, resize=False):
+    """每张还原的图片与源图片尺寸相同、像素接近；resize 为真时按还原后的尺寸缩放源图片再比较"""
+    ok = True
+    for name in names:
+        with Image.open(os.path.join(src_dir, *name.split("/"))) as src, \
+                Image.open(os.path.join(split_dir, *name.split("/"))) as out:
+            if resize:
+                src = src.resize(out.size, Image.LANCZOS)
+            elif src.size != out.size:
+                print(f"  {name}: 尺寸 {out.size}，应为 {src.size}")
+                ok = False
+                continue
+            diff = mean_diff(src, out)
+            if diff > MAX_MEAN_DIFF:
+                print(f"  {name}: 平均像素误差 {diff:.2f}")
+                ok = False
+    return ok
+
+
+def test_default_round_trip(work_dir):
+    print("\n===== 测试: 默认参数拼接后拆分 =====")
+    names = [f"port_{i}.jpg" for i in range(5)] + [f"land_{i}.jpg" for i in range(3)]
+    src_dir = os.path.join(work_dir, "src")
+    make_sources(src_dir, names)
+    record, split_dir = round_trip(src_dir, os.path.join(work_dir, "merged"))
+    files = restored_files(split_dir)
+    # 5张竖屏分为2批，3张横屏1批
+    print(f"拼接图 {len(record)} 张（应为3张），还原 {len(files)} 张")
+    return files == sorted(names) and len(record) == 3 and check_pixels(src_dir, split_dir, names)
+
+
+def test_truncated_jpeg(work_dir):
+    print("\n===== 测试: 源文件中有截断的JPEG =====")
+    names = [f"port_{i}.jpg" for i in range(5)]
+    src_dir = os.path.join(work_dir, "src")
+    make_sources(src_dir, names)
+    # 文件头完整，像素数据只剩一部分：分类时能读取尺寸，解码时才失败
+    bad = os.path.join(src_dir, "port_2.jpg")
+    Image.effect_noise((300, 400), 40).convert("RGB").save(bad, quality=95)
+    with open(bad, 'rb') as f:
+        data = f.read()
+    with open(bad, 'wb') as f:
+        f.write(data[:len(data) * 4 // 10])
+    good = [name for name in names if name != "port_2.jpg"]
+    ok = True
+    for options in ({}, {"keep_originals": True}, {"container": True}):
+        dst_dir = os.path.join(work_dir, "merged_" + "_".join(options) if options else "merged")
+        record, split_dir = round_trip(src_dir, dst_dir, **options)
+        merged_files = sorted(pos["file"] for entry in record for pos in entry["positions"])
+        print(f"{options or '默认'}: 拼接了 {merged_files}")
+        ok = ok and merged_files == good and restored_files(split_dir) == good \
+            and check_pixels(src_dir, split_dir, good)
+    return ok
+
+
+def test_keep_originals(work_dir):
+    print("\n===== 测试: 保留原图后原样还原 =====")
+    names = [f"port_{i}.jpg" for i in range(4)] + ["land_0.jpg"]
+    src_dir = os.path.join(work_dir, "src")
+    make_sources(src_dir, names)
+    record, split_dir = round_trip(src_dir, os.path.join(work_dir, "merged"), keep_originals=True)
+    # 原图库中的原图原样复制，还原结果与源文件逐字节相同
+    identical = [name for name in names if read_bytes(src_dir, name) == read_bytes(split_dir, name)]
+    print(f"逐字节相同 {len(identical)}/{len(names)} 张")
+    return restored_files(split_dir) == sorted(names) and len(identical) == len(names)
+
+
+def test_dedup(work_dir):
+    print("\n===== 测试: 去除重复图片 =====")
+    names = [f"port_{i}.jpg" for i in range(4)]
+    src_dir = os.path.join(work_dir, "src")
+    make_sources(src_dir, names)
+    shutil.copy(os.path.join(src_dir, "port_1.jpg"), os.path.join(src_dir, "port_1_copy.jpg"))
+    names.append("port_1_copy.jpg")
+    record, split_dir = round_trip(src_dir, os.path.join(work_dir, "merged"), keep_originals=True, dedup=True)
+    # 重复图片与首个相同图片共用拼接位置，拆分时仍然各自还原
+    tiles = {(entry["merged_file"], pos["x"], pos["y"]) for entry in record for pos in entry["positions"]}
+    shared = [pos for entry in record for pos in entry["positions"] if pos["file"] == "port_1_copy.jpg"]
+    print(f"拼接了 {len(tiles)} 张图片（应为4张，重复图片共用位置），还原 {len(restored_files(split_dir))} 张")
+    return (len(tiles) == 4 and len(shared) == 1 and restored_files(split_dir) == sorted(names)
+            and read_bytes(split_dir, "port_1_copy.jpg") == read_bytes(src_dir, "port_1_copy.jpg"))
+
+
+def test_container_round_trip(work_dir):
+    print("\n===== 测试: 单文件容器输出 =====")
+    names = [f"port_{i}.jpg" for i in range(6)]
+    src_dir = os.path.join(work_dir, "src")
+    make_sources(src_dir, names)
+    dst_dir = os.path.join(work_dir, "merged")
+    record, split_dir = round_trip(src_dir, dst_dir, container=True, keep_originals=True)
+    files = restored_files(split_dir)
+    with zipfile.ZipFile(dst_dir + ".zip") as zf:
+        members = zf.namelist()
+        stored = all(info.compress_type == zipfile.ZIP_STORED for info in zf.infolist())
+    print(f"容器文件存在: {os.path.isfile(dst_dir + '.zip')}，输出目录存在: {os.path.exists(dst_dir)}，"
+          f"最后一个成员: {members[-1]}，全部不压缩: {stored}")
+    # 原图逐字节还原，record.json 写在容器最后
+    return (not os.path.exists(dst_dir) and members[-1] == "record.json" and stored
+            and files == sorted(names) and all(read_bytes(src_dir, name) == read_bytes(split_dir, name)
+                                               for name in names))
+
+
+def test_recursive_per_folder(work_dir):
+    print("\n===== 测试: 包含子目录 + 按文件夹分组 =====")
+    names = ["top.jpg", "a/port_0.jpg", "a/port_1.jpg", "a/port_2.jpg", "b/c/port_3.jpg", "b/c/port_4.jpg"]
+    src_dir = os.path.join(work_dir, "src")
+    make_sources(src_dir, names)
+    # 输出目录在源目录之内时不会被当作源图片再次扫描
+    dst_dir = os.path.join(src_dir, "merged_output")
+    record, split_dir = round_trip(src_dir, dst_dir, merge_count=2, recursive=True, per_folder=True)
+    folders = [{os.path.dirname(pos["file"]) for pos in entry["positions"]} for entry in record]
+    print(f"每张拼接图中的文件夹: {folders}")
+    files = restored_files(split_dir)
+    return (all(len(group) == 1 for group in folders) and len(record) == 4 and files == sorted(names)
+            and check_pixels(src_dir, split_dir, names))
+
+
+def test_largest_first_order(work_dir):
+    print("\n===== 测试: 先处理大批次不改变文件名和记录顺序 =====")
+    src_dir = os.path.join(work_dir, "src")
+    # 批次大小各不相同，中间的批次最大
+    sizes = [(150, 200)] * 2 + [(600, 800)] * 2 + [(300, 400)] * 2 + [(120, 160)] * 2
+    names = [f"photo_{i}.jpg" for i in range(len(sizes))]
+    for i, (name, size) in enumerate(zip(names, sizes)):
+        make_photo(os.path.join(src_dir, name), size, i)
+    layouts = []
+    outputs = []
+    for largest_first in (False, True):
+        record, split_dir = round_trip(src_dir, os.path.join(work_dir, f"merged_{largest_first}"), merge_count=2,
+                                       largest_first=largest_first)
+        layouts.append([(entry["merged_file"], [(pos["file"], pos["x"], pos["y"]) for pos in entry["positions"]])
+                        for entry in record])
+        outputs.append({name: read_bytes(split_dir, name) for name in restored_files(split_dir)})
+    print(f"按顺序: {[name for name, _ in layouts[0]]}")
+    print(f"先大后小: {[name for name, _ in layouts[1]]}")
+    return layouts[0] == layouts[1] and len(layouts[0]) == 4 and outputs[0] == outputs[1] \
+        and sorted(outputs[0]) == names
+
+
+def test_cell_scaling(work_dir):
+    print("\n===== 测试: 逐张缩放 =====")
+    src_dir = os.path.join(work_dir, "src")
+    sizes = {"big.jpg": (600, 800), "mid.jpg": (300, 400), "small_0.jpg": (150, 200), "small_1.jpg": (150, 200)}
+    for i, (name, size) in enumerate(sizes.items()):
+        make_photo(os.path.join(src_dir, name), size, i)
+    max_size = 500
+    record, split_dir = round_trip(src_dir, os.path.join(work_dir, "merged"), max_size=max_size,
+                                   tile_scaling="cell")
+    ok = True
+    for entry in record:
+        with Image.open(os.path.join(work_dir, "merged", entry["merged_file"])) as merged:
+            print(f"拼接图尺寸: {merged.size}（最大 {max_size}）")
+            ok = ok and max(merged.size) <= max_size
+        for pos in entry["positions"]:
+            expected = sizes[pos["file"]]
+            # 每张图片保持自己的宽高比，缩放比例记录在位置中
+            ok = ok and abs(pos["w"] / pos["h"] - expected[0] / expected[1]) < 0.02 and pos["scale"] <= 1.0
+    for name in sizes:
+        with Image.open(os.path.join(split_dir, name)) as out:
+            print(f"  {name}: {sizes[name]} -> {out.size}")
+    return ok and restored_files(split_dir) == sorted(sizes) and check_pixels(src_dir, split_dir, sizes, resize=True)
+
+
+def test_cell_scaling_fits(work_dir):
+    print("\n===== 测试: 逐张缩放在网格放得下时不缩小图片 =====")
+    src_dir = os.path.join(work_dir, "src")
+    # 宽图超过平均单元格，但整个网格不超过 max_size
+    names = ["wide.jpg", "narrow.jpg"]
+    for i, (name, size) in enumerate(zip(names, [(800, 300), (100, 300)])):
+        make_photo(os.path.join(src_dir, name), size, i)
+    layouts = {}
+    for tile_scaling in mian.TILE_SCALING_MODES:
+        record, split_dir = round_trip(src_dir, os.path.join(work_dir, tile_scaling), merge_count=2, max_size=1200,
+                                       tile_scaling=tile_scaling, split_by_orientation=False)
+        layouts[tile_scaling] = [(pos["file"], pos["x"], pos["y"], pos["w"], pos["h"], pos["scale"])
+                                 for entry in record for pos in entry["positions"]]
+        if tile_scaling == "cell":
+            ok = check_pixels(src_dir, split_dir, names)
+    print(f"整体缩放: {layouts['canvas']}")
+    print(f"逐张缩放: {layouts['cell']}")
+    return ok and layouts["cell"] == layouts["canvas"] and all(scale == 1.0 for *_, scale in layouts["cell"])
+
+
+def test_jpeg_sheets(work_dir):
+    print("\n===== 测试: JPEG拼接图 =====")
+    names = [f"port_{i}.jpg" for i in range(4)] + [f"land_{i}.jpg" for i in range(2)]
+    src_dir = os.path.join(work_dir, "src")
+    make_sources(src_dir, names)
+    record, split_dir = round_trip(src_dir, os.path.join(work_dir, "merged"), sheet_format="jpeg")
+    aligned = all(entry["merged_file"].endswith(".jpg") and entry.get("mcu_align") == mian.JPEG_MCU_SIZE
+                  and all(pos["x"] % mian.JPEG_MCU_SIZE == 0 and pos["y"] % mian.JPEG_MCU_SIZE == 0
+                          for pos in entry["positions"])
+                  for entry in record)
+    print(f"拼接图为JPEG且图片位置按MCU对齐: {aligned}")
+    return aligned and restored_files(split_dir) == sorted(names) and check_pixels(src_dir, split_dir, names)
+
+
+TESTS = [test_default_round_trip, test_truncated_jpeg, test_keep_originals, test_dedup,
+         test_container_round_trip, test_recursive_per_folder, test_largest_first_order, test_jpeg_sheets,
+         test_cell_scaling, test_cell_scaling_fits]
+
+
+def main():
+    results = []
+    for test in TESTS:
+        with tempfile.TemporaryDirectory() as work_dir:
+            try:
+                passed = bool(test(work_dir))
+            except Exception as e:
+                print(f"测试出错: {e}")
+                passed = False
+        print(f"{test.__name__}: {'通过' if passed else '失败'}")
+        results.append(passed)
+
+    print(f"\n===== 测试总结: {sum(results)}/{len(results)} 通过 =====")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,178 @@
+import os
+import sys
+import tempfile
+import threading
+from PIL import Image
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mian
+
+
+def make_photo(path, size, seed):
+    """生成纯色测试图片"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new("RGB", size, color=(seed * 37 % 256, 120, 200)).save(path, quality=95)
+
+
+def make_sources(src_dir, sizes):
+    names = [f"photo_{i}.jpg" for i in range(len(sizes))]
+    for i, (name, size) in enumerate(zip(names, sizes)):
+        make_photo(os.path.join(src_dir, name), size, i)
+    return names
+
+
+def sheet_sizes(merged_dir, record):
+    sizes = {}
+    for entry in record:
+        with Image.open(os.path.join(merged_dir, entry["merged_file"])) as img:
+            sizes[entry["merged_file"]] = list(img.size)
+    return sizes
+
+
+def test_dry_run_matches_merge(work_dir):
+    print("\n===== 测试: 预估结果与实际拼接一致，且不写入文件 =====")
+    src_dir = os.path.join(work_dir, "src")
+    # 大图在 max_size=1000 下需要缩小，小图不需要
+    make_sources(src_dir, [(300, 400)] * 3 + [(900, 1200)] * 2 + [(400, 300)] * 2)
+    dst_dir = os.path.join(work_dir, "merged")
+    job = mian.MergeJob(src_dir, merge_count=2, dst_dir=dst_dir, max_size=1000, header_cache=False)
+    plan = job.dry_run()
+    written = os.path.exists(dst_dir)
+
+    job.run()
+    actual = sheet_sizes(dst_dir, job.record_data)
+    estimated = {sheet["merged_file"]: sheet["output"] for sheet in plan["sheets"]}
+    print(f"预估 {plan['total_sheets']} 张（缩小 {plan['clamped_sheets']} 张），实际 {len(actual)} 张；"
+          f"预估时写入了文件: {written}")
+    for name in sorted(actual):
+        if estimated.get(name) != actual[name]:
+            print(f"  {name}: 预估 {estimated.get(name)}，实际 {actual[name]}")
+    return (not written and estimated == actual and plan["total_images"] == 7
+            and plan["clamped_sheets"] >= 1 and plan["peak_memory"] > 0)
+
+
+def test_shared_memory_budget(work_dir):
+    print("\n===== 测试: 多个拼接任务共用内存预算 =====")
+    # 另一个预算的流水线也在运行时，进程内存的增长不能算作自己的，不做修正
+    own, other = mian.MemoryBudget(1 << 30), mian.MemoryBudget(1 << 30)
+    own.enter()
+    other.enter()
+    own.acquire(1024 * 1024)
+    grown = b"\x01" * (64 * 1024 * 1024)
+    own.sample()
+    with_other = own.correction
+    other.exit()
+    own.sample()
+    alone = own.correction
+    own.release(1024 * 1024)
+    own.exit()
+    del grown
+    print(f"有其他流水线时修正系数 {with_other}，只剩自己时 {alone}")
+
+    # 服务中的拼接任务拿到同一个预算，并发运行后全部释放
+    manager = mian.JobManager(workers=2)
+    try:
+        jobs = []
+        for i in range(2):
+            src_dir = os.path.join(work_dir, f"src_{i}")
+            make_sources(src_dir, [(300, 400)] * 4)
+            jobs.append(manager.create_job("merge", {"src_dir": src_dir, "merge_count": 2, "header_cache": False},
+                                           None))
+        threads = [threading.Thread(target=job.run) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+    finally:
+        manager.shutdown()
+    shared = all(job.memory_budget is manager.memory_budget for job in jobs)
+    budget = manager.memory_budget
+    print(f"任务共用预算: {shared}，运行后占用 {budget.held} 字节、流水线 {budget.pipelines} 个，"
+          f"拼接图 {[len(job.record_data) for job in jobs]} 张")
+    return (with_other == 1.0 and alone > 1.0 and shared and budget.held == 0 and budget.pipelines == 0
+            and [len(job.record_data) for job in jobs] == [2, 2])
+
+
+def test_cell_layout_fits(work_dir):
+    print("\n===== 测试: 逐张缩放只在网格超过最大尺寸时生效 =====")
+    # 1x2 网格共 9000x3000，不超过 12000；按平均单元格（6000）会把宽图缩小
+    sizes = [(8000, 3000), (1000, 3000)]
+    width, height, offsets, scaled, scales = mian.cell_layout(sizes, 1, 2, 0, 12000)
+    print(f"放得下时: 画布 {width}x{height}，尺寸 {scaled}，比例 {scales}")
+    fits = (width, height) == (9000, 3000) and scaled == sizes and scales == [1.0, 1.0] \
+        and offsets == [(0, 0), (8000, 0)]
+    # 超过时逐张缩放，放得下单元格的小图不缩小
+    _, _, _, clamped, clamped_scales = mian.cell_layout(sizes, 1, 2, 0, 6000)
+    print(f"超过时: 尺寸 {clamped}，比例 {clamped_scales}")
+    clamps = clamped[0][0] <= 3000 and clamped[1] == (1000, 3000) and clamped_scales[1] == 1.0
+
+    # 预估与实际拼接采用同样的规则：放得下时与整体缩放的预估相同
+    src_dir = os.path.join(work_dir, "src")
+    make_sources(src_dir, [(800, 300), (100, 300)])
+    plans = {}
+    batch_bytes = {}
+    for tile_scaling in mian.TILE_SCALING_MODES:
+        job = mian.MergeJob(src_dir, merge_count=2, max_size=1200, split_by_orientation=False,
+                            tile_scaling=tile_scaling, header_cache=False)
+        batches = job.plan()
+        plans[tile_scaling] = job.dry_run()
+        batch_bytes[tile_scaling] = mian.estimate_batch_bytes(batches[0], 0, 1200, tile_scaling)
+    same_plan = [(sheet["output"], sheet["peak_memory"], sheet["originals"]) for sheet in plans["cell"]["sheets"]] == \
+        [(sheet["output"], sheet["peak_memory"], sheet["originals"]) for sheet in plans["canvas"]["sheets"]]
+    print(f"预估内存: {batch_bytes}，两种方式的拼接计划相同: {same_plan}")
+    return fits and clamps and same_plan and batch_bytes["cell"] == batch_bytes["canvas"]
+
+
+def test_canvas_pool_budget(work_dir):
+    print("\n===== 测试: 空闲画布计入内存预算，预算不足时丢弃 =====")
+    canvas_bytes = 1000 * 1000 * 3
+    budget = mian.MemoryBudget(4 * canvas_bytes)
+    pool = mian.CanvasPool(2, budget=budget)
+    canvas = pool.acquire((1000, 1000))
+    pool.release(canvas)
+    idle_held = budget.held
+    # 复用时预算还给批次的预估，再归还时重新计入
+    canvas = pool.acquire((1000, 1000))
+    reused_held = budget.held
+    pool.release(canvas)
+    # 空闲画布占着预算时放不下新批次，丢弃后可以接纳
+    blocked = not budget.admits(4 * canvas_bytes - 1, idle=False)
+    evicted = pool.evict()
+    admitted = budget.admits(4 * canvas_bytes - 1, idle=False)
+    print(f"空闲时占用 {idle_held}，复用时 {reused_held}，丢弃后 {budget.held}；"
+          f"丢弃前接纳: {not blocked}，丢弃后接纳: {admitted}")
+    pool_ok = (idle_held == canvas_bytes and reused_held == 0 and blocked and evicted and admitted
+               and budget.held == 0 and pool.reused == 1)
+
+    # 整体缩放时缩放前的大画布也回到画布池，流水线结束后全部归还
+    src_dir = os.path.join(work_dir, "src")
+    make_sources(src_dir, [(900, 1200)] * 4 + [(300, 400)] * 2)
+    shared = mian.MemoryBudget(64 * 1024 * 1024)
+    job = mian.MergeJob(src_dir, merge_count=2, max_size=1000, header_cache=False, memory_budget=shared)
+    job.run()
+    print(f"拼接 {len(job.record_data)} 张后预算占用 {shared.held} 字节")
+    return pool_ok and len(job.record_data) == 3 and shared.held == 0
+
+
+TESTS = [test_dry_run_matches_merge, test_shared_memory_budget, test_cell_layout_fits, test_canvas_pool_budget]
+
+
+def main():
+    results = []
+    for test in TESTS:
+        with tempfile.TemporaryDirectory() as work_dir:
+            try:
+                passed = bool(test(work_dir))
+            except Exception as e:
+                print(f"测试出错: {e}")
+                passed = False
+        print(f"{test.__name__}: {'通过' if passed else '失败'}")
+        results.append(passed)
+
+    print(f"\n===== 测试总结: {sum(results)}/{len(results)} 通过 =====")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,126 @@
+import os
+import sys
+import tempfile
+from PIL import Image
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mian
+
+EXIF_IMAGE_DESCRIPTION = 0x010E
+
+
+def make_photo_with_exif(path, size, description):
+    """生成带EXIF（ImageDescription 为文件名）的JPEG测试图片"""
+    img = Image.new("RGB", size, color=(len(description) * 20 % 256, 120, 200))
+    exif = Image.Exif()
+    exif[EXIF_IMAGE_DESCRIPTION] = description
+    img.save(path, quality=95, exif=exif)
+
+
+def layout_of(record):
+    """只取拼接图文件名和各图片位置，用于比较两种执行方式的结果"""
+    return [(entry["merged_file"], [(pos["file"], pos["x"], pos["y"], pos["w"], pos["h"])
+                                    for pos in entry["positions"]])
+            for entry in record]
+
+
+def blob_description(blob_file, ref):
+    with open(blob_file, 'rb') as f:
+        f.seek(ref[0])
+        blob = f.read(ref[1])
+    exif = Image.Exif()
+    exif.load(blob)
+    return exif.get(EXIF_IMAGE_DESCRIPTION)
+
+
+def test_two_shards(work_dir):
+    print("\n===== 测试: 生成批次清单，分2片执行后合并记录 =====")
+    src_dir = os.path.join(work_dir, "src")
+    os.makedirs(src_dir)
+    names = [f"photo_{i}.jpg" for i in range(8)]
+    for i, name in enumerate(names):
+        make_photo_with_exif(os.path.join(src_dir, name), (300, 400) if i % 3 else (400, 300), name)
+
+    dst_dir = os.path.join(work_dir, "sharded")
+    manifest_path = os.path.join(work_dir, "manifest.json")
+    job = mian.MergeJob(src_dir, merge_count=2, dst_dir=dst_dir, header_cache=False)
+    manifest = mian.write_manifest(job, manifest_path)
+    shard_records = [mian.execute_manifest(manifest_path, shard, 2) for shard in (1, 2)]
+    print(f"清单中 {len(manifest['batches'])} 批，两个分片分别生成 {[len(r) for r in shard_records]} 张拼接图")
+
+    # 合并成功后分片的记录和EXIF旁路文件被删除
+    record = mian.merge_shard_records(manifest_path)
+    leftovers = [name for name in os.listdir(dst_dir) if ".shard-" in name]
+    print(f"合并后记录 {len(record)} 张拼接图，剩余分片文件: {leftovers}")
+
+    # 分片结果与一次性执行相同
+    single_dir = os.path.join(work_dir, "single")
+    mian.MergeJob(src_dir, merge_count=2, dst_dir=single_dir, header_cache=False).run()
+    same_layout = layout_of(record) == layout_of(mian.load_record(os.path.join(single_dir, "record.json")))
+    print(f"与一次性执行的拼接结果相同: {same_layout}")
+
+    # 第二个分片的EXIF偏移已整体后移，指向合并后旁路文件中各自的EXIF块
+    blob_file = os.path.join(dst_dir, mian.EXIF_BLOB_FILE)
+    second_shard = {pos["file"] for entry in shard_records[1] for pos in entry["positions"]}
+    rebased = 0
+    offsets_ok = True
+    for entry in record:
+        for pos in entry["positions"]:
+            description = blob_description(blob_file, pos["exif_blob"])
+            if description != pos["file"]:
+                print(f"  {pos['file']}: EXIF偏移指向了 {description}")
+                offsets_ok = False
+            if pos["file"] in second_shard and pos["exif_blob"][0] > 0:
+                rebased += 1
+    print(f"EXIF偏移正确: {offsets_ok}，第二个分片中后移的偏移 {rebased} 个")
+
+    # 拆分后每张图片带回自己的EXIF
+    split_dir = mian.SplitJob(dst_dir).run()
+    restored_ok = True
+    for name in names:
+        with Image.open(os.path.join(split_dir, name)) as img:
+            if img.getexif().get(EXIF_IMAGE_DESCRIPTION) != name:
+                print(f"  {name}: 拆分结果中的EXIF不正确")
+                restored_ok = False
+
+    return (len(record) == len(manifest["batches"]) and not leftovers and same_layout
+            and offsets_ok and rebased == len(second_shard) > 0 and restored_ok)
+
+
+def test_incomplete_shards(work_dir):
+    print("\n===== 测试: 分片未全部完成时拒绝合并 =====")
+    src_dir = os.path.join(work_dir, "src")
+    os.makedirs(src_dir)
+    for i in range(4):
+        make_photo_with_exif(os.path.join(src_dir, f"photo_{i}.jpg"), (300, 400), f"photo_{i}.jpg")
+    manifest_path = os.path.join(work_dir, "manifest.json")
+    mian.write_manifest(mian.MergeJob(src_dir, merge_count=2, dst_dir=os.path.join(work_dir, "out"),
+                                      header_cache=False), manifest_path)
+    mian.execute_manifest(manifest_path, 2, 2)
+    try:
+        mian.merge_shard_records(manifest_path)
+    except mian.JobError as e:
+        print(f"合并被拒绝: {e}")
+        return not os.path.exists(os.path.join(work_dir, "out", "record.json"))
+    return False
+
+
+def main():
+    results = []
+    for test in (test_two_shards, test_incomplete_shards):
+        with tempfile.TemporaryDirectory() as work_dir:
+            try:
+                passed = bool(test(work_dir))
+            except Exception as e:
+                print(f"测试出错: {e}")
+                passed = False
+        print(f"{test.__name__}: {'通过' if passed else '失败'}")
+        results.append(passed)
+
+    print(f"\n===== 测试总结: {sum(results)}/{len(results)} 通过 =====")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,224 @@
+import io
+import os
+import sys
+import time
+import tempfile
+import threading
+from PIL import Image, ImageChops, ImageDraw
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mian
+
+
+def make_photo(path, size, seed):
+    """生成带渐变的测试图片，各图片内容不同"""
+    width, height = size
+    gradient = Image.linear_gradient("L").resize((width, height))
+    img = Image.merge("RGB", (gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT),
+                              Image.new("L", (width, height), seed * 37 % 256)))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    img.save(path, quality=95)
+
+
+def make_merged(work_dir, count=8, ext=".jpg", **options):
+    """生成源图片并拼接，返回 (源目录, 拼接输出目录, 文件名列表)"""
+    src_dir = os.path.join(work_dir, "src")
+    names = [f"photo_{i}{ext}" for i in range(count)]
+    for i, name in enumerate(names):
+        make_photo(os.path.join(src_dir, name), (300, 400) if i % 3 else (400, 300), i)
+    merged_dir = mian.MergeJob(src_dir, merge_count=2, dst_dir=os.path.join(work_dir, "merged"),
+                               header_cache=False, **options).run()
+    return src_dir, merged_dir, names
+
+
+def make_watermark(path):
+    """半透明的带字水印，边缘透明度各不相同"""
+    mark = Image.new("RGBA", (120, 60), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(mark)
+    draw.rectangle((4, 4, 115, 55), fill=(255, 40, 40, 160), outline=(0, 0, 0, 255))
+    draw.text((20, 22), "sample", fill=(255, 255, 255, 230))
+    mark.save(path)
+    return path
+
+
+def max_pixel_diff(first, second):
+    """两组输出中同名图片解码后的最大像素差"""
+    diff = 0
+    for name in first:
+        with Image.open(io.BytesIO(first[name])) as a, Image.open(io.BytesIO(second[name])) as b:
+            if a.size != b.size:
+                return 255
+            diff = max(diff, max(high for _, high in ImageChops.difference(a.convert("RGB"),
+                                                                            b.convert("RGB")).getextrema()))
+    return diff
+
+
+def read_outputs(split_dir):
+    """{文件名: 文件内容}"""
+    return {name: open(os.path.join(split_dir, name), 'rb').read() for name in sorted(os.listdir(split_dir))}
+
+
+def test_prefetch_bounds(work_dir):
+    print("\n===== 测试: 预读数量和内存预算 =====")
+    ok = True
+    for read_ahead, budget in ((2, 1000), (4, 25), (3, 5)):
+        lock = threading.Lock()
+        loaded = []
+        outstanding = []
+
+        def loader(item):
+            time.sleep(0.01)
+            with lock:
+                loaded.append(item)
+            return item * 10
+
+        order = []
+        for item, value in mian.iter_prefetched(range(10), loader, read_ahead, budget, lambda item: 10):
+            # 此时已加载、尚未处理完的项（包括当前这一项）
+            with lock:
+                outstanding.append(len(loaded) - len(order))
+            order.append((item, value))
+            time.sleep(0.02)
+        # 数量不超过 read_ahead + 1，总大小不超过预算（预算小于一项时也要逐项前进）
+        limit = min(read_ahead + 1, max(1, budget // 10))
+        print(f"read_ahead={read_ahead} 预算={budget}: 同时持有最多 {max(outstanding)} 项（上限 {limit}）")
+        ok = ok and order == [(i, i * 10) for i in range(10)] and max(outstanding) <= limit
+    return ok
+
+
+def test_read_ahead_output(work_dir):
+    print("\n===== 测试: 预读不改变拆分结果 =====")
+    _, merged_dir, names = make_merged(work_dir)
+    outputs = []
+    for read_ahead, budget in ((0, 1024), (3, 1024), (3, 1)):
+        split_dir = mian.SplitJob(merged_dir, dst_dir=os.path.join(work_dir, f"split_{read_ahead}_{budget}"),
+                                  read_ahead=read_ahead, memory_budget_mb=budget).run()
+        outputs.append(read_outputs(split_dir))
+    print(f"三种预读设置分别还原 {[len(output) for output in outputs]} 张")
+    return sorted(outputs[0]) == names and outputs[0] == outputs[1] == outputs[2]
+
+
+def test_iter_split_images(work_dir):
+    print("\n===== 测试: 流式拆分产出的字节与写文件的结果相同 =====")
+    _, merged_dir, names = make_merged(work_dir)
+    written = read_outputs(mian.SplitJob(merged_dir, dst_dir=os.path.join(work_dir, "split")).run())
+    streamed = {}
+    for name, data, exif_bytes in mian.iter_split_images(merged_dir):
+        streamed[name] = data
+    # 提前结束迭代也不能出错，之后仍可重新开始
+    tiles = mian.iter_split_images(merged_dir)
+    first = next(tiles)[0]
+    tiles.close()
+    again = len(list(mian.iter_split_images(merged_dir)))
+    print(f"流式产出 {len(streamed)} 张，写入文件 {len(written)} 张，提前结束后重新产出 {again} 张")
+    return sorted(streamed) == names and streamed == written and first in names and again == len(names)
+
+
+def test_watermark_on_canvas(work_dir):
+    print("\n===== 测试: 在整张拼接图上加水印与逐张加水印结果相同 =====")
+    _, merged_dir, names = make_merged(work_dir, ext=".png")
+    watermark = make_watermark(os.path.join(work_dir, "mark.png"))
+    outputs = {}
+    for on_canvas in (True, False):
+        split_dir = mian.SplitJob(merged_dir, watermark_path=watermark, watermark_size=30, watermark_opacity=80,
+                                  dst_dir=os.path.join(work_dir, f"split_{on_canvas}"),
+                                  watermark_on_canvas=on_canvas).run()
+        outputs[on_canvas] = read_outputs(split_dir)
+    plain = read_outputs(mian.SplitJob(merged_dir, watermark_enabled=False,
+                                       dst_dir=os.path.join(work_dir, "plain")).run())
+    diff = max_pixel_diff(outputs[True], outputs[False])
+    print(f"两种方式的最大像素差 {diff}，与不加水印的最大像素差 {max_pixel_diff(outputs[True], plain)}")
+    return (sorted(outputs[True]) == sorted(outputs[False]) == names and diff <= 1
+            and max_pixel_diff(outputs[True], plain) > 10)
+
+
+def test_watermark_blend_modes(work_dir):
+    print("\n===== 测试: pillow 与 numpy 两种水印混合方式结果相同 =====")
+    if mian.np is None:
+        print("未安装numpy，跳过")
+        return True
+    _, merged_dir, names = make_merged(work_dir, ext=".png")
+    watermark = make_watermark(os.path.join(work_dir, "mark.png"))
+    outputs = {}
+    for blend in mian.WATERMARK_BLEND_MODES:
+        for on_canvas in (True, False):
+            split_dir = mian.SplitJob(merged_dir, watermark_path=watermark, watermark_size=30, watermark_opacity=80,
+                                      dst_dir=os.path.join(work_dir, f"split_{blend}_{on_canvas}"),
+                                      watermark_on_canvas=on_canvas, watermark_blend=blend).run()
+            outputs[blend, on_canvas] = read_outputs(split_dir)
+    # 两种方式的取整方法不同，允许每个通道相差1
+    diffs = [max_pixel_diff(outputs["pillow", on_canvas], outputs["numpy", on_canvas]) for on_canvas in (True, False)]
+    print(f"整张加水印时最大像素差 {diffs[0]}，逐张加水印时 {diffs[1]}")
+    return all(sorted(output) == names for output in outputs.values()) and max(diffs) <= 1
+
+
+def test_png_profiles_and_formats(work_dir):
+    print("\n===== 测试: PNG保存方式只影响文件大小，output_formats 改变输出格式 =====")
+    _, merged_dir, names = make_merged(work_dir, ext=".png")
+    outputs = {}
+    for profile in mian.SPLIT_PNG_PROFILES:
+        split_dir = mian.SplitJob(merged_dir, dst_dir=os.path.join(work_dir, f"split_{profile}"),
+                                  png_profile=profile).run()
+        outputs[profile] = read_outputs(split_dir)
+    sizes = {profile: sum(len(data) for data in output.values()) for profile, output in outputs.items()}
+    diffs = [max_pixel_diff(outputs["balanced"], output) for output in outputs.values()]
+    print(f"各保存方式的总大小 {sizes}，与 balanced 的最大像素差 {max(diffs)}")
+
+    converted = read_outputs(mian.SplitJob(merged_dir, dst_dir=os.path.join(work_dir, "split_jpg"),
+                                           output_formats={".png": ".jpg"}).run())
+    formats = set()
+    for data in converted.values():
+        with Image.open(io.BytesIO(data)) as img:
+            formats.add(img.format)
+    print(f"转换后的文件 {sorted(converted)[:2]}...，格式 {formats}")
+    return (all(sorted(output) == names for output in outputs.values()) and max(diffs) == 0
+            and sizes["fast"] >= sizes["max"]
+            and sorted(converted) == [name.replace(".png", ".jpg") for name in names] and formats == {"JPEG"})
+
+
+def test_renditions(work_dir):
+    print("\n===== 测试: 拆分时同时生成多个预览尺寸 =====")
+    _, merged_dir, names = make_merged(work_dir)
+    dst_dir = os.path.join(work_dir, "split")
+    mian.SplitJob(merged_dir, dst_dir=dst_dir, renditions=[200, 100]).run()
+    full = read_outputs(dst_dir)
+    ok = sorted(full) == names
+    for edge in (200, 100):
+        rendition_dir = mian.RENDITION_DIR_FORMAT.format(dst_dir, edge)
+        previews = sorted(os.listdir(rendition_dir)) if os.path.isdir(rendition_dir) else []
+        sizes = []
+        for name in previews:
+            with Image.open(os.path.join(rendition_dir, name)) as preview, \
+                    Image.open(io.BytesIO(full[name])) as original:
+                sizes.append(preview.size)
+                # 长边缩小到 edge，宽高比与全尺寸结果相同
+                ok = ok and max(preview.size) == edge \
+                    and abs(preview.width / preview.height - original.width / original.height) < 0.02
+        print(f"{edge}px: {len(previews)} 张，尺寸 {sorted(set(sizes))}")
+        ok = ok and previews == names
+    return ok
+
+
+TESTS = [test_prefetch_bounds, test_read_ahead_output, test_iter_split_images, test_watermark_on_canvas,
+         test_watermark_blend_modes, test_png_profiles_and_formats, test_renditions]
+
+
+def main():
+    results = []
+    for test in TESTS:
+        with tempfile.TemporaryDirectory() as work_dir:
+            try:
+                passed = bool(test(work_dir))
+            except Exception as e:
+                print(f"测试出错: {e}")
+                passed = False
+        print(f"{test.__name__}: {'通过' if passed else '失败'}")
+        results.append(passed)
+
+    print(f"\n===== 测试总结: {sum(results)}/{len(results)} 通过 =====")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)